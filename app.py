@@ -1,22 +1,39 @@
 import os
 import asyncio
 import re
+import copy
+import random
 import unicodedata
+import contextvars
+from operator import attrgetter
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from telegram.ext import Application, ContextTypes, CommandHandler, JobQueue, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import (
+    Application, ContextTypes, CommandHandler, JobQueue, CallbackQueryHandler, MessageHandler, filters,
+    BasePersistence, PersistenceInput, TypeHandler,
+)
 from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 
 # время и часовой пояс
 from datetime import time as _t, datetime as _dt, timedelta as _td
 from zoneinfo import ZoneInfo
 
 import storage
+import shared_state
+import metrics
+import tracing
+import sampling_profiler
+import gcal_quota
 from calendar_source import (
+    cache_fallbacks,
     fetch_today_events, fetch_events_next_days, fetch_events_struct,
     fetch_tasks_today, fetch_tasks_next_days, fetch_tasks_struct,
     fetch_events_struct_for_calendar, fetch_tasks_struct_for_list,
 )
+from gcal_policy import deadline as google_deadline
+from gcal_time import DigestItem, dated_item
 
 # 1) Загружаем .env
 load_dotenv()
@@ -24,6 +41,10 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 TZ_NAME  = os.getenv("TZ", "Europe/Belgrade")
 TZ = ZoneInfo(TZ_NAME)
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# Свой Bot API сервер (telegram-bot-api --local или заглушка из bench/), по умолчанию api.telegram.org
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "").rstrip("/")
+# Верхняя граница на все запросы к Google в одном дайджесте (секунды)
+DIGEST_GOOGLE_BUDGET = float(os.getenv("DIGEST_GOOGLE_BUDGET", "30"))
 
 #1.1) проверка user id
 def is_admin(user_id: int | None) -> bool:
@@ -188,39 +209,38 @@ def _fmt_unified(d, title, t):
 
 
 # --- формирование текста дайджеста ---
+#
+# Дайджест собирается из трёх источников: события, задачи, напоминания.
+# Источники идут параллельно в пуле потоков, на всё — DIGEST_SLA секунд.
+# Если источник не успел (или упал), секцию рисуем по последним известным
+# данным с пометкой «⏳», а асинхронные отправители потом правят сообщение,
+# когда опоздавший источник досчитается.
+
+DIGEST_SLA = float(os.getenv("DIGEST_SLA", "8"))
+DIGEST_SOURCE_NAMES = {"events": "события", "tasks": "задачи", "reminders": "напоминания"}
+_EMPTY_WINDOWS = ([], [], [])
+_ITEM_KEY = attrgetter("key")
+
+_digest_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="digest")
+# (вид дайджеста, источник) -> (данные, когда получены)
+_last_source_data: dict[tuple[str, str], tuple[object, _dt]] = {}
+# (день ISO, снимок событий/задач) последней полностью свежей сборки — в общем
+# хранилище под ключом вида дайджеста: фоновую сверку может выполнить любой инстанс
+_DIGEST_MODEL_KEY = "digest:model:{}"
+
+
+def _split_reminders(all_rem: list, visible, today) -> tuple[list[DigestItem], list[DigestItem], list[DigestItem], list[str]]:
+    """Разносит видимые напоминания по окнам (сегодня/неделя/месяц) + недатированные."""
+    rem = [r if isinstance(r, dict) else {"text": str(r)} for r in all_rem]
+    rem = [r for r in rem if (r.get("text") or "").strip()]
+    rem = [r for r in rem if visible(r)]
 
-def build_digest_text() -> str:
-    now_dt = _dt.now(TZ)
-    now_str = now_dt.strftime("%d.%m.%Y %H:%M")
-    today = now_dt.date()
-
-    # События и задачи (структурированные)
-    ev_today  = fetch_events_struct(TZ_NAME, 0, 0)
-    ev_week   = fetch_events_struct(TZ_NAME, 1, 7)
-    ev_month  = fetch_events_struct(TZ_NAME, 8, 31)
-    ts_today  = fetch_tasks_struct(TZ_NAME, 0, 0)
-    ts_week   = fetch_tasks_struct(TZ_NAME, 1, 7)
-    ts_month  = fetch_tasks_struct(TZ_NAME, 8, 31)
-
-    # Напоминания: нормализуем и фильтруем по видимости для админа
-    all_rem = storage.list_custom_reminders()
-
-    def _visible_for_admin(r: dict) -> bool:
-        uid = r.get("user_id")
-        shared = bool(r.get("share"))
-        return (uid == ADMIN_ID) or (uid == GUEST_USER_ID) or shared
-
-    all_rem = [r if isinstance(r, dict) else {"text": str(r)} for r in all_rem]
-    all_rem = [r for r in all_rem if (r.get("text") or "").strip()]
-    all_rem = [r for r in all_rem if _visible_for_admin(r)]
-
-    # Разносим по окнам + недатированные отдельно
-    rem_today: list[dict] = []
-    rem_week:  list[dict] = []
-    rem_month: list[dict] = []
+    rem_today: list[DigestItem] = []
+    rem_week:  list[DigestItem] = []
+    rem_month: list[DigestItem] = []
     rem_undated: list[str] = []
 
-    for r in all_rem:
+    for r in rem:
         txt = (r.get("text") or "").strip()
         if not txt:
             continue
@@ -236,40 +256,173 @@ def build_digest_text() -> str:
             continue
 
         if d == today:
-            rem_today.append({"date": d, "title": txt, "time": ""})
+            rem_today.append(dated_item(d, txt))
         elif today + _td(days=1) <= d <= today + _td(days=7):
-            rem_week.append({"date": d, "title": txt, "time": ""})
+            rem_week.append(dated_item(d, txt))
         elif today + _td(days=8) <= d <= today + _td(days=31):
-            rem_month.append({"date": d, "title": txt, "time": ""})
+            rem_month.append(dated_item(d, txt))
+
+    return rem_today, rem_week, rem_month, rem_undated
+
+
+def _visible_for_admin(r: dict) -> bool:
+    uid = r.get("user_id")
+    shared = bool(r.get("share"))
+    return (uid == ADMIN_ID) or (uid == GUEST_USER_ID) or shared
+
+
+def _visible_for_guest(r: dict) -> bool:
+    uid = r.get("user_id")
+    shared = bool(r.get("share"))
+    return (uid == GUEST_USER_ID) or (uid == ADMIN_ID and shared)
+
+
+def _digest_sources(kind: str, today) -> dict:
+    """Источники дайджеста вида kind ("admin" | "guest"): имя -> функция без аргументов."""
+    if kind == "guest":
+        cal_name = GUEST_CALENDAR_NAME
+        tl_name  = GUEST_TASKLIST_NAME
+
+        def events():
+            if not cal_name:
+                return _EMPTY_WINDOWS
+            with google_deadline(DIGEST_GOOGLE_BUDGET), _stage("google_events"):
+                return (fetch_events_struct_for_calendar(TZ_NAME, 0, 0, cal_name),
+                        fetch_events_struct_for_calendar(TZ_NAME, 1, 7, cal_name),
+                        fetch_events_struct_for_calendar(TZ_NAME, 8, 31, cal_name))
+
+        def tasks():
+            if not tl_name:
+                return _EMPTY_WINDOWS
+            with google_deadline(DIGEST_GOOGLE_BUDGET), _stage("google_tasks"):
+                return (fetch_tasks_struct_for_list(TZ_NAME, 0, 0, tl_name),
+                        fetch_tasks_struct_for_list(TZ_NAME, 1, 7, tl_name),
+                        fetch_tasks_struct_for_list(TZ_NAME, 8, 31, tl_name))
+
+        visible = _visible_for_guest
+    else:
+        def events():
+            with google_deadline(DIGEST_GOOGLE_BUDGET), _stage("google_events"):
+                return (fetch_events_struct(TZ_NAME, 0, 0),
+                        fetch_events_struct(TZ_NAME, 1, 7),
+                        fetch_events_struct(TZ_NAME, 8, 31))
+
+        def tasks():
+            with google_deadline(DIGEST_GOOGLE_BUDGET), _stage("google_tasks"):
+                return (fetch_tasks_struct(TZ_NAME, 0, 0),
+                        fetch_tasks_struct(TZ_NAME, 1, 7),
+                        fetch_tasks_struct(TZ_NAME, 8, 31))
+
+        visible = _visible_for_admin
+
+    def reminders():
+        with _stage("storage"):
+            return _split_reminders(storage.list_custom_reminders(), visible, today)
+
+    def _stage(stage: str):
+        return metrics.DIGEST_STAGE_SECONDS.time(stage=stage, digest=kind)
+
+    return {"events": events, "tasks": tasks, "reminders": reminders}
+
+
+def _run_source(kind: str, name: str, fn):
+    """
+    Данные источника и список его подмен (см. calendar_source.cache_fallbacks):
+    stored_at записей кэша, отданных вместо Google, и None за пропущенные ресурсы.
+    """
+    with tracing.span(f"digest.{name}", digest=kind), cache_fallbacks() as served:
+        data = fn()
+    if None not in served:
+        # данные с пропущенным календарём/списком не годятся в запас для следующих сборок
+        _last_source_data[(kind, name)] = (data, _stale_since(served) if served else _dt.now(TZ))
+    return data, served
+
+
+def _stale_since(served: list[float | None]) -> _dt | None:
+    """Время самых старых данных источника; None — часть данных не получена вовсе."""
+    if None in served:
+        return None
+    return _dt.fromtimestamp(min(served), TZ)
+
+
+def _start_sources(kind: str, today) -> dict[str, Future]:
+    # copy_context — чтобы спаны источников вложились в спан текущего апдейта
+    return {
+        name: _digest_pool.submit(contextvars.copy_context().run, _run_source, kind, name, fn)
+        for name, fn in _digest_sources(kind, today).items()
+    }
+
+
+def _collect_sources(kind: str, futures: dict[str, Future]) -> tuple[dict, dict]:
+    """
+    Забирает готовые результаты. Для неуспевших/упавших источников — последние
+    известные данные; их имена попадают в stale (имя -> время данных или None).
+    Источник, часть которого Google не отдал (взята из кэша или пропущена), — тоже stale.
+    """
+    parts: dict = {}
+    stale: dict = {}
+    for name, fut in futures.items():
+        if fut.done() and fut.exception() is None:
+            parts[name], served = fut.result()
+            if served:
+                stale[name] = _stale_since(served)
+            continue
+        if fut.done():
+            print(f"[digest] {kind}/{name}: {fut.exception()!r}")
+        data, at = _last_source_data.get((kind, name), (None, None))
+        if data is None:
+            data = (*_EMPTY_WINDOWS, []) if name == "reminders" else _EMPTY_WINDOWS
+        parts[name] = data
+        stale[name] = at
+    return parts, stale
+
+
+def _stale_lines(stale: dict) -> list[str]:
+    if not stale:
+        return []
+    marks = []
+    for name, at in stale.items():
+        label = DIGEST_SOURCE_NAMES.get(name, name)
+        marks.append(f"{label} (от {at:%H:%M})" if at else f"{label} (данные неполные)")
+    return [f"⏳ Не успели обновиться: {', '.join(marks)}", ""]
+
+
+def _merge_items(*groups: list[DigestItem]) -> list[DigestItem]:
+    """События, задачи и напоминания одного окна — по дню, целодневные после тех, что со временем."""
+    items = [it for group in groups for it in group]
+    items.sort(key=_ITEM_KEY)
+    return items
+
+
+def _render_digest(now_dt: _dt, parts: dict, stale: dict) -> str:
+    now_str = now_dt.strftime("%d.%m.%Y %H:%M")
+    ev_today, ev_week, ev_month = parts["events"]
+    ts_today, ts_week, ts_month = parts["tasks"]
+    rem_today, rem_week, rem_month, rem_undated = parts["reminders"]
 
     # Формируем текст
     lines = [
         "🌅 Доброе утро!",
         f"Сейчас: {now_str}",
         "",
+        *_stale_lines(stale),
         "Ваши события и напоминания.",
         "",
     ]
 
-    today_items = ev_today + ts_today + rem_today
-    today_items.sort(key=lambda x: (x["date"], x["time"] or "99:99"))
     lines.append("❗️Сегодня:")
-    for it in today_items:
-        lines.append(_fmt_unified(it["date"], it["title"], it["time"]))
+    for it in _merge_items(ev_today, ts_today, rem_today):
+        lines.append(_fmt_unified(it.date, it.title, it.time))
     lines.append("")
 
-    week_items = ev_week + ts_week + rem_week
-    week_items.sort(key=lambda x: (x["date"], x["time"] or "99:99"))
     lines.append("🗓 В ближайшую неделю:")
-    for it in week_items:
-        lines.append(_fmt_unified(it["date"], it["title"], it["time"]))
+    for it in _merge_items(ev_week, ts_week, rem_week):
+        lines.append(_fmt_unified(it.date, it.title, it.time))
     lines.append("")
 
-    month_items = ev_month + ts_month + rem_month
-    month_items.sort(key=lambda x: (x["date"], x["time"] or "99:99"))
     lines.append("🗓 В ближайший месяц:")
-    for it in month_items:
-        lines.append(_fmt_unified(it["date"], it["title"], it["time"]))
+    for it in _merge_items(ev_month, ts_month, rem_month):
+        lines.append(_fmt_unified(it.date, it.title, it.time))
 
     # Недатированные — отдельным блоком
     if rem_undated:
@@ -281,79 +434,32 @@ def build_digest_text() -> str:
     return "\n".join(lines)
 
 
-def build_guest_digest_text() -> str:
-    now_dt = _dt.now(TZ)
+def _render_guest_digest(now_dt: _dt, parts: dict, stale: dict) -> str:
     now_str = now_dt.strftime("%d.%m.%Y %H:%M")
-
-    cal_name = GUEST_CALENDAR_NAME
-    tl_name  = GUEST_TASKLIST_NAME
-
-    ev_today  = fetch_events_struct_for_calendar(TZ_NAME, 0, 0, cal_name) if cal_name else []
-    ev_week   = fetch_events_struct_for_calendar(TZ_NAME, 1, 7, cal_name) if cal_name else []
-    ev_month  = fetch_events_struct_for_calendar(TZ_NAME, 8, 31, cal_name) if cal_name else []
-    ts_today  = fetch_tasks_struct_for_list(TZ_NAME, 0, 0, tl_name) if tl_name else []
-    ts_week   = fetch_tasks_struct_for_list(TZ_NAME, 1, 7, tl_name) if tl_name else []
-    ts_month  = fetch_tasks_struct_for_list(TZ_NAME, 8, 31, tl_name) if tl_name else []
-
-    # Напоминания, видимые гостю
-    today = now_dt.date()
-    all_rem = storage.list_custom_reminders()
-
-    def _visible_for_guest(r: dict) -> bool:
-        uid = r.get("user_id")
-        shared = bool(r.get("share"))
-        return (uid == GUEST_USER_ID) or (uid == ADMIN_ID and shared)
-
-    rem = [r if isinstance(r, dict) else {"text": str(r)} for r in all_rem]
-    rem = [r for r in rem if (r.get("text") or "").strip()]
-    rem = [r for r in rem if _visible_for_guest(r)]
-
-    rem_today: list[dict] = []
-    rem_week: list[dict] = []
-    rem_month: list[dict] = []
-    rem_undated: list[str] = []
-
-    for r in rem:
-        txt = (r.get("text") or "").strip()
-        if not txt:
-            continue
-        due = r.get("due")
-        if not due:
-            rem_undated.append(txt)
-            continue
-        try:
-            d = _dt.strptime(due, "%Y-%m-%d").date()
-        except ValueError:
-            rem_undated.append(txt)
-            continue
-
-        if d == today:
-            rem_today.append({"date": d, "title": txt, "time": ""})
-        elif today + _td(days=1) <= d <= today + _td(days=7):
-            rem_week.append({"date": d, "title": txt, "time": ""})
-        elif today + _td(days=8) <= d <= today + _td(days=31):
-            rem_month.append({"date": d, "title": txt, "time": ""})
+    ev_today, ev_week, ev_month = parts["events"]
+    ts_today, ts_week, ts_month = parts["tasks"]
+    rem_today, rem_week, rem_month, rem_undated = parts["reminders"]
 
     lines = [
         "🌅 Доброе утро!",
         f"Сейчас: {now_str}",
         "",
+        *_stale_lines(stale),
     ]
 
-    def _append_section(title: str, items: list[dict]):
+    def _append_section(title: str, items: list[DigestItem]):
         lines.append(title)
         if not items:
             lines.append("• (пусто)")
             lines.append("")
             return
-        items.sort(key=lambda x: (x["date"], x["time"] or "99:99"))
         for it in items:
-            lines.append(_fmt_unified(it["date"], it["title"], it["time"]))
+            lines.append(_fmt_unified(it.date, it.title, it.time))
         lines.append("")
 
-    _append_section("❗️Сегодня:", (ev_today + ts_today + rem_today))
-    _append_section("🗓 В ближайшую неделю:", (ev_week + ts_week + rem_week))
-    _append_section("🗓 В ближайший месяц:", (ev_month + ts_month + rem_month))
+    _append_section("❗️Сегодня:", _merge_items(ev_today, ts_today, rem_today))
+    _append_section("🗓 В ближайшую неделю:", _merge_items(ev_week, ts_week, rem_week))
+    _append_section("🗓 В ближайший месяц:", _merge_items(ev_month, ts_month, rem_month))
 
     if rem_undated:
         lines.append("📝 Без даты:")
@@ -364,6 +470,274 @@ def build_guest_digest_text() -> str:
     return "\n".join(lines)
 
 
+_RENDERERS = {"admin": _render_digest, "guest": _render_guest_digest}
+
+
+def _render(kind: str, now_dt: _dt, parts: dict, stale: dict) -> str:
+    with metrics.DIGEST_STAGE_SECONDS.time(stage="render", digest=kind):
+        return _RENDERERS[kind](now_dt, parts, stale)
+
+
+def _build_text(kind: str) -> str:
+    with metrics.DIGEST_SECONDS.time(digest=kind):
+        now_dt = _dt.now(TZ)
+        futures = _start_sources(kind, now_dt.date())
+        futures_wait(futures.values(), timeout=DIGEST_SLA)
+        parts, stale = _collect_sources(kind, futures)
+        _remember_model(kind, now_dt, parts, stale)
+        return _render(kind, now_dt, parts, stale)
+
+
+def build_digest_text() -> str:
+    return _build_text("admin")
+
+
+def build_guest_digest_text() -> str:
+    return _build_text("guest")
+
+
+async def build_digest_within_sla(kind: str = "admin", *, prebuilt: str | None = None):
+    """
+    Неблокирующая сборка: текст в пределах DIGEST_SLA и корутина с полным
+    текстом, если какой-то источник опоздал (иначе None).
+    prebuilt — слот плановой рассылки ("YYYY-MM-DD@HH:MM"): взять её свежую
+    предсборку, если она есть.
+    """
+    if prebuilt:
+        text = await _render_prebuilt(kind, prebuilt)
+        if text is not None:
+            return text, None
+    with metrics.DIGEST_SECONDS.time(digest=kind):
+        now_dt = _dt.now(TZ)
+        futures = _start_sources(kind, now_dt.date())
+        await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()], timeout=DIGEST_SLA)
+        parts, stale = _collect_sources(kind, futures)
+        await asyncio.to_thread(_remember_model, kind, now_dt, parts, stale)
+        text = _render(kind, now_dt, parts, stale)
+
+    late = [f for f in futures.values() if not f.done()]
+    if not late:
+        return text, None
+
+    async def _complete() -> str:
+        await asyncio.wait([asyncio.wrap_future(f) for f in late])
+        parts_full, stale_full = _collect_sources(kind, futures)
+        now_full = _dt.now(TZ)
+        await asyncio.to_thread(_remember_model, kind, now_full, parts_full, stale_full)
+        return _render(kind, now_full, parts_full, stale_full)
+
+    return text, _complete()
+
+
+# --- предсборка к плановой рассылке ---
+#
+# Чтобы все рассылки не шли в Google в одну секунду, источники каждой собираются
+# заранее — в окне DIGEST_PREBUILD_MINUTES до отправки, по очереди и со случайным
+# сдвигом (см. _prebuild_leads). Результат лежит в общем хранилище под слотом
+# рассылки (дата@время); в минуту отправки остаётся перечитать напоминания
+# и отрисовать текст. Окно не переходит через полночь: окна «сегодня/неделя»
+# в calendar_source считаются от текущей даты, и вчерашняя сборка не подошла бы.
+
+DIGEST_PREBUILD_MINUTES = float(os.getenv("DIGEST_PREBUILD_MINUTES", "10"))  # 0 — собирать в момент отправки
+DIGEST_PREBUILD_JITTER = float(os.getenv("DIGEST_PREBUILD_JITTER", "1"))    # доля слота на случайный сдвиг
+_PREBUILT_KEY = "digest:prebuilt:{}"  # вид -> {слот: (время сборки, источники)}
+
+
+async def prebuild_digest(kind: str, slot: str) -> bool:
+    """Собирает события и задачи вида kind без SLA и кладёт их в хранилище под slot."""
+    now_dt = _dt.now(TZ)
+    futures = _start_sources(kind, now_dt.date())
+    await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()])
+    parts, stale = _collect_sources(kind, futures)
+    if any(name in stale for name in _SNAPSHOT_SOURCES):
+        return False  # с опоздавшим источником — пусть соберёт сама рассылка
+    payload = (now_dt.timestamp(), {name: parts[name] for name in _SNAPSHOT_SOURCES})
+    # прошлые слоты больше не понадобятся — храним только этот
+    await asyncio.to_thread(shared_state.backend().set, _PREBUILT_KEY.format(kind), {slot: payload})
+    return True
+
+
+async def _render_prebuilt(kind: str, slot: str) -> str | None:
+    prebuilt = await asyncio.to_thread(shared_state.backend().get, _PREBUILT_KEY.format(kind), {})
+    entry = prebuilt.get(slot)
+    now_dt = _dt.now(TZ)
+    # нет сборки к этому слоту или она старше окна (+запас на сдвиг) — не годится
+    if not entry or now_dt.timestamp() - entry[0] > (DIGEST_PREBUILD_MINUTES + 5) * 60:
+        return None
+    parts = dict(entry[1])
+    parts["reminders"] = await asyncio.to_thread(_digest_sources(kind, now_dt.date())["reminders"])
+    metrics.DIGEST_PREBUILT.inc(digest=kind)
+    await asyncio.to_thread(_remember_model, kind, now_dt, parts, {})
+    return _render(kind, now_dt, parts, {})
+
+
+async def prebuild_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    kind = context.job.data["kind"]
+    try:
+        ok = await prebuild_digest(kind, _today_slot(context.job.data["time"]))
+    except Exception as e:
+        print(f"[digest] предсборка {kind} не удалась: {e!r}")
+        return
+    if not ok:
+        print(f"[digest] предсборка {kind}: источник опоздал, соберём при отправке")
+
+
+def schedule_late_digest_update(
+    context: ContextTypes.DEFAULT_TYPE,
+    message: Message | None,
+    late,
+    reply_markup=None,
+    *,
+    cache: bool = False,
+) -> None:
+    """Когда опоздавший источник досчитается — правим уже отправленный дайджест на месте."""
+    if late is None:
+        return
+    if message is None:
+        late.close()
+        return
+
+    async def _update():
+        try:
+            text = await late
+        except Exception as e:
+            print(f"[digest] late update failed: {e!r}")
+            return
+        if cache:
+            context.bot_data["last_digest_text"] = text
+            await asyncio.to_thread(storage.set_last_digest, text)
+        if (message.text or "") == text:
+            return
+        try:
+            await context.bot.edit_message_text(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                text=text,
+                reply_markup=reply_markup,
+            )
+        except BadRequest:
+            pass
+
+    context.application.create_task(_update())
+
+
+# --- фоновая сверка дайджеста и уведомления об изменениях ---
+#
+# Раз в DIGEST_SYNC_MINUTES задача JobQueue собирает дайджест в фоне
+# (с push-каналами и ETag это в основном кэш), сравнивает события и задачи
+# на сегодня и неделю с последней сборкой, которую пользователь видел,
+# и присылает короткое сообщение только о том, что изменилось.
+# Заодно обновляет кэш дайджеста для show_digest_copy.
+
+DIGEST_SYNC_MINUTES = float(os.getenv("DIGEST_SYNC_MINUTES", "15"))  # 0 — выключено
+DIGEST_ALERT_MAX_LINES = int(os.getenv("DIGEST_ALERT_MAX_LINES", "10"))
+_SNAPSHOT_SOURCES = ("events", "tasks")
+
+
+def _digest_snapshot(parts: dict) -> dict:
+    """{источник: {название: [(дата ISO, время), ...]}} по окнам «сегодня» и «неделя»."""
+    snap: dict = {}
+    for name in _SNAPSHOT_SOURCES:
+        ev_today, ev_week, _ = parts[name]
+        by_title: dict[str, list] = {}
+        for it in ev_today + ev_week:
+            by_title.setdefault(it.title, []).append((it.date.isoformat(), it.time))
+        snap[name] = {title: sorted(slots) for title, slots in by_title.items()}
+    return snap
+
+
+def _remember_model(kind: str, now_dt: _dt, parts: dict, stale: dict) -> tuple[str, dict] | None:
+    """
+    Запоминает снимок полностью свежей сборки. Если хоть один источник опоздал,
+    взят из кэша вместо Google или пропустил календарь/список — не запоминает:
+    иначе пропавшие события ушли бы в уведомления как удалённые, а потом как новые.
+    """
+    if stale:
+        return None
+    model = (now_dt.date().isoformat(), _digest_snapshot(parts))
+    shared_state.backend().set(_DIGEST_MODEL_KEY.format(kind), model)
+    return model
+
+
+def _fmt_slot(slot) -> str:
+    d, t = slot
+    return f"{_dt.fromisoformat(d):%d.%m}" + (f" {t}" if t else "")
+
+
+def _diff_snapshots(old: dict, new: dict) -> list[str]:
+    lines: list[str] = []
+    for name in _SNAPSHOT_SOURCES:
+        label = "[Задача] " if name == "tasks" else ""
+        before, after = old.get(name, {}), new.get(name, {})
+        for title in sorted(set(before) | set(after)):
+            a, b = before.get(title, []), after.get(title, [])
+            if a == b:
+                continue
+            if not a:
+                lines.append(f"➕ {_fmt_slot(b[0])} {label}{title}")
+            elif not b:
+                lines.append(f"➖ {_fmt_slot(a[0])} {label}{title}")
+            else:
+                lines.append(f"🔁 {label}{title}: {_fmt_slot(a[0])} → {_fmt_slot(b[0])}")
+    return lines
+
+
+def _format_changes(changes: list[str]) -> str:
+    shown = changes[:DIGEST_ALERT_MAX_LINES]
+    text = "🔔 Изменения в дайджесте:\n" + "\n".join(shown)
+    if len(changes) > len(shown):
+        text += f"\n…и ещё {len(changes) - len(shown)}"
+    return text
+
+
+async def _sync_digest(context: ContextTypes.DEFAULT_TYPE, kind: str, chat_id: int) -> None:
+    now_dt = _dt.now(TZ)
+    futures = _start_sources(kind, now_dt.date())
+    # SLA тут не нужен: ждём все источники, Google ограничен DIGEST_GOOGLE_BUDGET
+    await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()])
+    parts, stale = _collect_sources(kind, futures)
+
+    previous = await asyncio.to_thread(shared_state.backend().get, _DIGEST_MODEL_KEY.format(kind))
+    current = await asyncio.to_thread(_remember_model, kind, now_dt, parts, stale)
+    if kind == "admin":
+        text = _render(kind, now_dt, parts, stale)
+        context.bot_data["last_digest_text"] = text
+        if current is not None and current != previous:
+            await asyncio.to_thread(storage.set_last_digest, text)
+
+    # первая сборка, смена дня или неполные данные — сравнивать не с чем
+    if current is None or previous is None or previous[0] != current[0]:
+        return
+    changes = _diff_snapshots(previous[1], current[1])
+    if not changes:
+        return
+    print(f"[sync] {kind}: {len(changes)} изменений -> {chat_id}")
+    await context.bot.send_message(chat_id=chat_id, text=_format_changes(changes))
+
+
+async def digest_sync_job(context: ContextTypes.DEFAULT_TYPE):
+    targets = [("admin", await asyncio.to_thread(storage.get_chat_id))]
+    if GUEST_USER_ID:
+        targets.append(("guest", GUEST_USER_ID))
+    for kind, chat_id in targets:
+        if not chat_id:
+            continue  # уведомлять некого — дайджест ради него не собираем и квоту Google не тратим
+        try:
+            await _sync_digest(context, kind, chat_id)
+        except Exception as e:
+            print(f"[sync] {kind}: {e!r}")
+
+
+def register_digest_sync_job(job_queue) -> None:
+    if job_queue is None or DIGEST_SYNC_MINUTES <= 0:
+        return
+    if job_queue.get_jobs_by_name("digest_sync"):
+        return
+    job_queue.run_repeating(
+        digest_sync_job, interval=DIGEST_SYNC_MINUTES * 60, first=60, name="digest_sync",
+    )
+
+
 # копия дайджеста для повторных выводов
 async def show_digest_copy(
     context: ContextTypes.DEFAULT_TYPE,
@@ -378,7 +752,7 @@ async def show_digest_copy(
     """
     text = context.bot_data.get("last_digest_text")
     if not text:
-        text, _ = storage.get_last_digest()
+        text, _ = await asyncio.to_thread(storage.get_last_digest)
     if not text:
         await context.bot.send_message(
             chat_id=chat_id,
@@ -399,19 +773,21 @@ async def rebuild_and_show_digest(
     with_menu: bool = True,
     show_loading: bool = True,
     reply_to_message_id: int | None = None,
+    prebuilt: str | None = None,
 ):
     loading_msg = await show_loading_message(context, chat_id, enabled=show_loading)
     try:
-        digest_text = build_digest_text()
+        digest_text, late = await build_digest_within_sla("admin", prebuilt=prebuilt)
         context.bot_data["last_digest_text"] = digest_text
-        storage.set_last_digest(digest_text)
+        await asyncio.to_thread(storage.set_last_digest, digest_text)
         reply_markup = build_main_menu(user_id) if with_menu else None
-        await context.bot.send_message(
+        sent = await context.bot.send_message(
             chat_id=chat_id,
             text=digest_text,
             reply_markup=reply_markup,
             reply_to_message_id=reply_to_message_id,
         )
+        schedule_late_digest_update(context, sent, late, reply_markup, cache=True)
     finally:
         await hide_loading_message(context, loading_msg)
 
@@ -423,17 +799,22 @@ async def send_guest_digest_message(
     *,
     show_loading: bool = True,
     skip_if_blank: bool = False,
+    prebuilt: str | None = None,
 ) -> tuple[bool, str]:
     loading_msg = await show_loading_message(context, chat_id, enabled=show_loading)
     try:
-        text = build_guest_digest_text()
+        text, late = await build_digest_within_sla("guest", prebuilt=prebuilt)
         if skip_if_blank and not text.strip():
+            if late is not None:
+                late.close()
             return False, text
-        await context.bot.send_message(
+        reply_markup = build_main_menu(user_id_for_menu)
+        sent = await context.bot.send_message(
             chat_id=chat_id,
             text=text,
-            reply_markup=build_main_menu(user_id_for_menu),
+            reply_markup=reply_markup,
         )
+        schedule_late_digest_update(context, sent, late, reply_markup)
         return True, text
     finally:
         await hide_loading_message(context, loading_msg)
@@ -469,7 +850,35 @@ async def cmd_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Тест ок ✅")
 
 # 4) Отправка дайджеста
+async def _schedule_moved(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Время рассылки поменяли (возможно, на другом инстансе), а эта задача
+    стоит на старом — переставляем её и ничего не шлём.
+    """
+    planned = (context.job.data or {}).get("time")
+    if not planned:
+        return False
+    daily_time = await asyncio.to_thread(storage.get_daily_time)
+    if planned == daily_time.strftime("%H:%M"):
+        return False
+    print(f"[digest] {context.job.name}: время {planned} устарело, переставляю")
+    chat_id = await asyncio.to_thread(storage.get_chat_id)
+    if chat_id:
+        await register_daily_job(context, chat_id)
+    return True
+
+
+async def _claim_scheduled_run(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    job = context.job
+    if await asyncio.to_thread(_claim_daily_run, job.name, (job.data or {}).get("time")):
+        return True
+    print(f"[digest] {job.name}: сегодняшняя рассылка уже отправлена")
+    return False
+
+
 async def send_morning_digest(context: ContextTypes.DEFAULT_TYPE):
+    if await _schedule_moved(context) or not await _claim_scheduled_run(context):
+        return
     chat_id = context.job.data["chat_id"]
     print(f"[digest] sending to {chat_id}") # лог
     # На главном экране всегда должна быть клавиатура с основными действиями.
@@ -482,16 +891,18 @@ async def send_morning_digest(context: ContextTypes.DEFAULT_TYPE):
         user_id_for_menu,
         with_menu=True,
         show_loading=False,
+        prebuilt=_today_slot(context.job.data.get("time")),
     )
 
 async def send_guest_morning_digest(context: ContextTypes.DEFAULT_TYPE):
-    if not GUEST_USER_ID:
+    if not GUEST_USER_ID or await _schedule_moved(context) or not await _claim_scheduled_run(context):
         return
     await send_guest_digest_message(
         context,
         chat_id=GUEST_USER_ID,
         user_id_for_menu=GUEST_USER_ID,
         show_loading=False,
+        prebuilt=_today_slot(context.job.data.get("time")),
     )
 
 
@@ -571,6 +982,81 @@ async def cmd_testguestdigesttome(update: Update, context: ContextTypes.DEFAULT_
     msg = await update.message.reply_text("Гостевой дайджест отправлен вам.")
     schedule_message_autodelete(msg, context)
 
+# 5.0) Профайлер по команде админа: /profile [секунды] [N]u | /profile stop
+def _parse_profile_args(args: list[str]) -> tuple[float | None, int | None]:
+    seconds = updates = None
+    for a in args:
+        a = a.lower()
+        if a.endswith("u") and a[:-1].isdigit():
+            updates = int(a[:-1])
+        elif a.isdigit():
+            seconds = float(a)
+        else:
+            raise ValueError(a)
+    return seconds, updates
+
+
+async def _deliver_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, session) -> None:
+    collapsed = await asyncio.wrap_future(session.done)
+    stamp = _dt.now(TZ).strftime("%Y%m%d-%H%M%S")
+    await context.bot.send_document(
+        chat_id,
+        document=collapsed.encode("utf-8"),
+        filename=f"profile-{stamp}.collapsed.txt",
+        caption=f"Сэмплов: {session.samples}, апдейтов: {session.updates_seen}. "
+                f"Формат collapsed stacks (flamegraph.pl / speedscope).",
+    )
+
+
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = await guard_auth_and_get_uid(update, context)
+    if uid is None:
+        return
+    if not is_admin(uid):
+        msg = await update.message.reply_text("Недостаточно прав.")
+        schedule_message_autodelete(msg, context)
+        return msg
+
+    if context.args and context.args[0].lower() == "stop":
+        session = sampling_profiler.active()
+        if session is None:
+            await update.message.reply_text("Профайлер не запущен.")
+        else:
+            session.stop()
+        return
+
+    try:
+        seconds, updates = _parse_profile_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text("Формат: /profile [секунды] [N]u, например /profile 60 или /profile 120 50u")
+        return
+    try:
+        session = sampling_profiler.start(seconds, updates)
+    except RuntimeError as e:
+        await update.message.reply_text(str(e))
+        return
+
+    limit = f"{session.seconds:.0f} с" + (f" или {updates} апдейтов" if updates else "")
+    await update.message.reply_text(f"Профайлер запущен: {limit}. Результат пришлю файлом.")
+    context.application.create_task(_deliver_profile(context, update.effective_chat.id, session))
+
+
+async def _count_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Считает апдейты для /profile N u — и в вебхуке, и в long polling."""
+    sampling_profiler.note_update()
+
+
+# 5.0.1) Расход квоты Google по методам: /quota
+async def cmd_quota(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = await guard_auth_and_get_uid(update, context)
+    if uid is None:
+        return
+    if not is_admin(uid):
+        msg = await update.message.reply_text("Недостаточно прав.")
+        schedule_message_autodelete(msg, context)
+        return msg
+    await update.message.reply_text(gcal_quota.report())
+
 # 5.1) Команда для установки времени дайджеста
 async def cmd_settime(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Установить ежедневное время рассылки: /settime 07:45"""
@@ -583,7 +1069,7 @@ async def cmd_settime(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     raw = context.args[0].strip()
     try:
-        storage.set_daily_time(raw)
+        await asyncio.to_thread(storage.set_daily_time, raw)
     except Exception:
         await show_digest_copy(context, update.effective_chat.id, update.effective_user.id)
         await update.message.reply_text("Неверный формат. Используй HH:MM (00–23:59).")
@@ -591,8 +1077,8 @@ async def cmd_settime(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Перерегистрируем задачу для этого чата
     cid = update.effective_chat.id
-    storage.set_chat_id(cid)  # на всякий случай — сохраним чат
-    register_daily_job(context, cid)
+    await asyncio.to_thread(storage.set_chat_id, cid)  # на всякий случай — сохраним чат
+    await register_daily_job(context, cid)
 
     await update.message.reply_text(f"Готово! Теперь утренний дайджест приходит в {raw} ({TZ_NAME}).")
 
@@ -602,41 +1088,169 @@ async def cmd_when(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if uid is None:
         return
     """Показать текущее время рассылки"""
-    t = storage.get_daily_time()
+    t = await asyncio.to_thread(storage.get_daily_time)
     await show_digest_copy(context, update.effective_chat.id, update.effective_user.id)
     await update.message.reply_text(f"Текущее время рассылки: {t.strftime('%H:%M')} ({TZ_NAME}).")
 
 # 6) Регистрация ежедневной задачи
-def register_daily_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    jq = context.job_queue
-    if jq is None:
-        return
+#
+# Расписания рассылок лежат в общем хранилище (SCHEDULES_KEY): имя задачи ->
+# {"kind": "admin" | "guest", "chat_id", "time": "HH:MM", "last_run": "YYYY-MM-DD@HH:MM"}.
+# При старте restore_schedules ставит их в JobQueue заново (без /start), а если
+# сегодняшняя рассылка пропущена (бот лежал/деплоился) и прошло не больше
+# DIGEST_CATCHUP_MINUTES — досылает её. last_run помечается атомарно перед
+# отправкой, так что рестарт или второй инстанс не продублирует дайджест.
+
+SCHEDULES_KEY = "schedules:digest"
+DIGEST_CATCHUP_MINUTES = float(os.getenv("DIGEST_CATCHUP_MINUTES", "30"))
+
+
+def _today_slot(planned: str | None) -> str:
+    """Слот сегодняшней рассылки на время planned: "YYYY-MM-DD@HH:MM"."""
+    return f"{_dt.now(TZ).date().isoformat()}@{planned or ''}"
+
+
+def _digest_callbacks() -> dict:
+    return {"admin": send_morning_digest, "guest": send_guest_morning_digest}
 
+
+def _desired_schedules(chat_id: int) -> dict[str, dict]:
     base_t = storage.get_daily_time()
-    t_with_tz = _t(base_t.hour, base_t.minute, tzinfo=TZ)
+    wanted = {f"morning_digest_{chat_id}": {"kind": "admin", "chat_id": chat_id, "time": f"{base_t:%H:%M}"}}
+    if GUEST_USER_ID:
+        wanted[f"guest_digest_{GUEST_USER_ID}"] = {"kind": "guest", "chat_id": GUEST_USER_ID, "time": f"{base_t:%H:%M}"}
+    return wanted
+
+
+def _prebuild_leads(schedules: dict[str, dict]) -> dict[str, float]:
+    """
+    За сколько секунд до отправки собирать каждую рассылку. Рассылки с одним
+    временем делят окно DIGEST_PREBUILD_MINUTES на слоты по порядку (ранг),
+    внутри слота — случайный сдвиг. Последняя пятая часть окна — запас, чтобы
+    и последняя предсборка успела до минуты отправки. Окно обрезается полуночью:
+    предсборка идёт в тот же день, что и рассылка (в 00:00 её нет вовсе).
+    """
+    if DIGEST_PREBUILD_MINUTES <= 0:
+        return {}
+    by_time: dict[str, list[str]] = {}
+    for name, entry in schedules.items():
+        by_time.setdefault(entry["time"], []).append(name)
+    leads = {}
+    for at, names in by_time.items():
+        hh, mm = map(int, at.split(":"))
+        window = min(DIGEST_PREBUILD_MINUTES * 60, hh * 3600 + mm * 60)
+        if window <= 0:
+            continue
+        slot = window * 0.8 / len(names)
+        for rank, name in enumerate(sorted(names)):
+            leads[name] = window - rank * slot - random.uniform(0, slot * min(DIGEST_PREBUILD_JITTER, 1.0))
+    return leads
+
+
+def _schedule_all(jq, schedules: dict[str, dict]) -> None:
+    leads = _prebuild_leads(schedules)
+    for name, entry in schedules.items():
+        _schedule_job(jq, name, entry, leads.get(name))
 
-    # основная задача
-    name_main = f"morning_digest_{chat_id}"
-    for job in jq.get_jobs_by_name(name_main):
+
+def _schedule_job(jq, name: str, entry: dict, prebuild_lead: float | None = None) -> None:
+    for job in (*jq.get_jobs_by_name(name), *jq.get_jobs_by_name(f"prebuild_{name}")):
         job.schedule_removal()
+    hh, mm = map(int, entry["time"].split(":"))
+    if prebuild_lead:
+        at = _dt.combine(_dt.now(TZ).date(), _t(hh, mm)) - _td(seconds=int(prebuild_lead))
+        jq.run_daily(
+            callback=prebuild_digest_job,
+            time=at.time().replace(tzinfo=TZ),
+            name=f"prebuild_{name}",
+            data={"kind": entry["kind"], "time": entry["time"]},
+        )
     jq.run_daily(
-        callback=send_morning_digest,
-        time=t_with_tz,
-        name=name_main,
-        data={"chat_id": chat_id},
+        callback=_digest_callbacks()[entry["kind"]],
+        time=_t(hh, mm, tzinfo=TZ),
+        name=name,
+        data={"chat_id": entry["chat_id"], "time": entry["time"]},
+        # цикл был занят в момент срабатывания — всё равно выполнить, но один раз
+        job_kwargs={"misfire_grace_time": int(DIGEST_CATCHUP_MINUTES * 60), "coalesce": True},
     )
 
-    # гостевая задача (если настроен гость)
-    if GUEST_USER_ID:
-        name_guest = f"guest_digest_{GUEST_USER_ID}"
-        for job in jq.get_jobs_by_name(name_guest):
-            job.schedule_removal()
-        jq.run_daily(
-            callback=send_guest_morning_digest,
-            time=t_with_tz,
-            name=name_guest,
-            data={"chat_id": GUEST_USER_ID},
-        )
+
+def _claim_daily_run(name: str, planned: str | None) -> bool:
+    """Помечает сегодняшнюю рассылку name отправленной; False — её уже кто-то отправил."""
+    slot = _today_slot(planned)
+    with shared_state.backend().edit(SCHEDULES_KEY, {}) as schedules:
+        entry = schedules.get(name)
+        if entry is None:
+            return True
+        if entry.get("last_run") == slot:
+            return False
+        entry["last_run"] = slot
+        return True
+
+
+async def register_daily_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    jq = context.job_queue
+    if jq is None:
+        return
+    # хранилище — в потоке (SQLite может ждать блокировку), JobQueue — в цикле
+    wanted = await asyncio.to_thread(_save_schedules, chat_id)
+    _apply_schedules(jq, wanted)
+
+
+def _save_schedules(chat_id: int) -> dict[str, dict]:
+    """Сохраняет расписания админа (и гостя) по текущему времени рассылки."""
+    wanted = _desired_schedules(chat_id)
+    with shared_state.backend().edit(SCHEDULES_KEY, {}) as schedules:
+        for name in [n for n in schedules if n not in wanted]:
+            del schedules[name]  # сменился чат — старую рассылку убираем
+        for name, entry in wanted.items():
+            schedules[name] = {**entry, "last_run": schedules.get(name, {}).get("last_run")}
+    return wanted
+
+
+def _apply_schedules(jq, wanted: dict[str, dict]) -> None:
+    """Приводит задачи JobQueue к расписаниям wanted."""
+    for name in _scheduled_names(jq):
+        if name.removeprefix("prebuild_") not in wanted:
+            for job in jq.get_jobs_by_name(name):
+                job.schedule_removal()
+    _schedule_all(jq, wanted)
+
+    register_digest_sync_job(jq)
+
+
+def _scheduled_names(jq) -> set[str]:
+    prefixes = ("morning_digest_", "guest_digest_", "prebuild_")
+    return {j.name for j in jq.jobs() if j.name and j.name.startswith(prefixes)}
+
+
+async def restore_schedules(jq) -> None:
+    """
+    Ставит сохранённые рассылки при старте. Первый запуск после обновления —
+    расписание берём из storage (chat_id + время), как раньше делал /start.
+    """
+    schedules = await asyncio.to_thread(shared_state.backend().get, SCHEDULES_KEY, {})
+    chat_id = None if schedules else await asyncio.to_thread(storage.get_chat_id)
+    if chat_id:
+        # без истории отправок не досылаем: старая версия могла уже отправить
+        _apply_schedules(jq, await asyncio.to_thread(_save_schedules, chat_id))
+        print("[digest] расписания созданы из настроек storage")
+        return
+    _schedule_all(jq, schedules)
+    register_digest_sync_job(jq)
+
+    now = _dt.now(TZ)
+    for name, entry in schedules.items():
+        hh, mm = map(int, entry["time"].split(":"))
+        due = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        missed = entry.get("last_run") != _today_slot(entry["time"])
+        if missed and due <= now <= due + _td(minutes=DIGEST_CATCHUP_MINUTES):
+            print(f"[digest] {name}: пропущена рассылка {entry['time']}, досылаю")
+            jq.run_once(
+                _digest_callbacks()[entry["kind"]], 1, name=name,
+                data={"chat_id": entry["chat_id"], "time": entry["time"]},
+            )
+    print(f"[digest] расписания восстановлены: {', '.join(sorted(schedules)) or '—'}")
 
 
 # Регистрацию ежедневной рассылки делаем ПОСЛЕ того,
@@ -647,14 +1261,14 @@ async def cmd_start_and_schedule(update: Update, context: ContextTypes.DEFAULT_T
     if uid is None:
         return
     cid = update.effective_chat.id
-    storage.set_chat_id(cid)
+    await asyncio.to_thread(storage.set_chat_id, cid)
     uid = update.effective_user.id if update.effective_user else None
 
     try:
-        register_daily_job(context, cid)
+        await register_daily_job(context, cid)
     except RuntimeError:
         await asyncio.sleep(0.5)
-        register_daily_job(context, cid)
+        await register_daily_job(context, cid)
 
     reply_to = update.message.message_id if update.message else None
     await rebuild_and_show_digest(
@@ -761,7 +1375,7 @@ async def cmd_addreminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         share_flag = True
 
     try:
-        storage.add_custom_reminder(body, due=due_iso, user_id=uid, share=share_flag)
+        await asyncio.to_thread(storage.add_custom_reminder, body, due=due_iso, user_id=uid, share=share_flag)
     except ValueError as e:
         await update.message.reply_text(str(e))
         return
@@ -786,7 +1400,7 @@ async def cmd_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = await guard_auth_and_get_uid(update, context)
     if uid is None:
         return
-    items = storage.list_user_reminders(uid)
+    items = await asyncio.to_thread(storage.list_user_reminders, uid)
     if not items:
         await show_digest_copy(context, update.effective_chat.id, update.effective_user.id)
         await update.message.reply_text("Пока нет пользовательских напоминаний.")
@@ -818,7 +1432,7 @@ async def cmd_clearreminders(update: Update, context: ContextTypes.DEFAULT_TYPE)
     uid = await guard_auth_and_get_uid(update, context)
     if uid is None:
         return
-    storage.clear_custom_reminders()
+    await asyncio.to_thread(storage.clear_custom_reminders)
     await rebuild_and_show_digest(context, update.effective_chat.id, update.effective_user.id, with_menu=True)
     await update.message.reply_text("Список напоминаний очищен.")
 
@@ -866,7 +1480,7 @@ async def on_settings_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # вход на экран выбора времени
     if data in ("settings:settime", "settings:time"):
-        t = storage.get_daily_time()
+        t = await asyncio.to_thread(storage.get_daily_time)
         context.user_data["edit_time"] = t
         await query.answer()
         return await safe_edit(
@@ -896,7 +1510,9 @@ async def on_settings_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # кнопки корректировки времени и сохранение
     if data.startswith("settings:time:"):
         action = data.split(":")[2]  # "-10" | "+10" | "-60" | "+60" | "save"
-        t = context.user_data.get("edit_time", storage.get_daily_time())
+        t = context.user_data.get("edit_time")
+        if t is None:
+            t = await asyncio.to_thread(storage.get_daily_time)
 
         if action == "-10":
             t = _shift_time(t, -10)
@@ -908,9 +1524,9 @@ async def on_settings_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
             t = _shift_time(t, +60)
         elif action == "save":
             # сохраняем строкой HH:MM и перерегистрируем джоб
-            storage.set_daily_time(_fmt_time(t))
+            await asyncio.to_thread(storage.set_daily_time, _fmt_time(t))
             context.user_data.pop("edit_time", None)
-            register_daily_job(context, chat_id)
+            await register_daily_job(context, chat_id)
             await query.answer("Сохранено")
             # после сохранения вернёмся на экран настроек
             return await safe_edit(
@@ -929,7 +1545,19 @@ async def on_settings_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 
+def _callback_branch(data: str) -> str:
+    """Ветка on_callback без индексов: 'editrem:3' -> 'editrem', 'settings:time:+10' -> 'settings:time'."""
+    parts = [p for p in data.split(":") if p and not p.lstrip("+-").isdigit()]
+    return ":".join(parts[:2]) or "(empty)"
+
+
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    data = update.callback_query.data if update.callback_query else ""
+    with tracing.span("on_callback", branch=_callback_branch(data or "")):
+        return await _handle_callback(update, context)
+
+
+async def _handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = await guard_auth_and_get_uid(update, context)
     if uid is None:
         return
@@ -987,7 +1615,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["at_root"] = False
 
         # ОБЯЗАТЕЛЬНО: получить список прежде чем проверять
-        items = storage.list_user_reminders(uid)
+        items = await asyncio.to_thread(storage.list_user_reminders, uid)
 
         if not items:
             await context.bot.send_message(
@@ -1021,7 +1649,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return await query.answer("Ошибка: неверный индекс", show_alert=True)
 
         # ✅ загрузить список перед использованием
-        items = storage.list_user_reminders(uid)
+        items = await asyncio.to_thread(storage.list_user_reminders, uid)
 
         if idx < 0 or idx >= len(items):
             return await query.answer("Напоминание не найдено", show_alert=True)
@@ -1053,7 +1681,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("editremdel:"):
         await query.answer()
         uid = query.from_user.id
-        ok = storage.delete_user_reminder(uid, int(data.split(":")[1]))
+        ok = await asyncio.to_thread(storage.delete_user_reminder, uid, int(data.split(":")[1]))
         # После удаления сразу перестроим дайджест 
         await rebuild_and_show_digest(context, 
                                       chat_id=query.message.chat_id, 
@@ -1089,10 +1717,12 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = query.message.chat_id if query.message else query.from_user.id
         loading_msg = await show_loading_message(context, chat_id)
         try:
-            digest_text = build_digest_text()
+            digest_text, late = await build_digest_within_sla("admin")
             context.bot_data["last_digest_text"] = digest_text
-            storage.set_last_digest(digest_text)
-            await safe_edit(query, digest_text, build_main_menu(query.from_user.id))
+            await asyncio.to_thread(storage.set_last_digest, digest_text)
+            reply_markup = build_main_menu(query.from_user.id)
+            await safe_edit(query, digest_text, reply_markup)
+            schedule_late_digest_update(context, query.message, late, reply_markup, cache=True)
         finally:
             await hide_loading_message(context, loading_msg)
         context.user_data["at_root"] = True
@@ -1120,7 +1750,8 @@ async def on_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             share_flag = True
 
-        ok = storage.update_user_reminder(
+        ok = await asyncio.to_thread(
+            storage.update_user_reminder,
             user_id=uid,
             index_in_user_list=idx,
             new_text=body,
@@ -1153,7 +1784,7 @@ async def on_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             share_flag = True
 
         try:
-            storage.add_custom_reminder(body, due=iso, user_id=uid, share=share_flag)
+            await asyncio.to_thread(storage.add_custom_reminder, body, due=iso, user_id=uid, share=share_flag)
         except ValueError as e:
             await update.effective_message.reply_text(str(e))
             return
@@ -1168,6 +1799,142 @@ async def on_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # для серверного запуска с webhook из server.py
 
+class TimedRequest(HTTPXRequest):
+    """HTTP-транспорт Bot API с замером задержки каждого метода (для /metrics)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        with metrics.BOT_API_SECONDS.time(method=api_method), tracing.span("bot_api", method=api_method):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+# --- общее состояние для нескольких инстансов (см. shared_state) ---
+
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "5"))
+# Задачи, которые среди инстансов выполняет ровно один на каждое срабатывание
+CLUSTER_JOB_PREFIXES = ("morning_digest_", "guest_digest_", "prebuild_", "digest_sync", "gcal_push_renew")
+CLUSTER_JOB_LEASE = float(os.getenv("CLUSTER_JOB_LEASE", "600"))
+
+
+class SharedPersistence(BasePersistence):
+    """
+    user_data/bot_data в shared_state. Перед каждым апдейтом и задачей данные
+    перечитываются, если их поменял другой инстанс; пишутся только изменившиеся.
+    """
+
+    def __init__(self):
+        super().__init__(
+            store_data=PersistenceInput(chat_data=False, callback_data=False),
+            update_interval=STATE_FLUSH_INTERVAL,
+        )
+        self._seen: dict[str, object] = {}  # ключ -> что последним прочли/записали сами
+
+    async def _read(self, key: str) -> dict:
+        value = await asyncio.to_thread(shared_state.backend().get, key, {})
+        self._seen[key] = value
+        return copy.deepcopy(value)
+
+    async def _write(self, key: str, data: dict) -> None:
+        if self._seen.get(key) == data:
+            return
+        self._seen[key] = data
+        await asyncio.to_thread(shared_state.backend().set, key, data)
+
+    async def _refresh(self, key: str, target: dict) -> None:
+        seen = self._seen.get(key)
+        stored = await asyncio.to_thread(shared_state.backend().get, key, {})
+        # не поменялось с нашей последней записи — локальная копия свежее
+        # (в ней могут быть ещё не сброшенные правки)
+        if seen is not None and stored == seen:
+            return
+        self._seen[key] = stored
+        target.clear()
+        target.update(copy.deepcopy(stored))
+
+    async def get_user_data(self) -> dict:
+        return {}  # подтягиваются по одному в refresh_user_data
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return await self._read("bot_data")
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name, key, new_state) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._write(f"user:{user_id}", data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._write("bot_data", data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._seen.pop(f"user:{user_id}", None)
+        await asyncio.to_thread(shared_state.backend().delete, f"user:{user_id}")
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh(f"user:{user_id}", user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        await self._refresh("bot_data", bot_data)
+
+    async def flush(self) -> None:
+        pass
+
+
+class ClusterJobQueue(JobQueue):
+    """
+    JobQueue для нескольких инстансов: задачи из CLUSTER_JOB_PREFIXES ставит
+    каждый инстанс, а выполняет на каждом срабатывании тот, кто первым взял
+    аренду в shared_state (остальные пропускают).
+    """
+
+    @staticmethod
+    async def job_callback(job_queue, job) -> None:
+        name = job.name or ""
+        if name.startswith(CLUSTER_JOB_PREFIXES):
+            lease = f"job:{name}"
+            if isinstance(job.data, dict) and job.data.get("time"):
+                lease += f"@{job.data['time']}"  # перенос времени — новое срабатывание
+            interval = getattr(job.job.trigger, "interval", None)
+            ttl = min(CLUSTER_JOB_LEASE, interval.total_seconds() / 2) if interval else CLUSTER_JOB_LEASE
+            if not await asyncio.to_thread(shared_state.claim, lease, ttl):
+                print(f"[jobs] {name}: выполняет другой инстанс")
+                return
+        await JobQueue.job_callback(job_queue, job)
+
+
+def _application_builder():
+    builder = (
+        # свой request заменяет транспорт PTB целиком — пул как у него по умолчанию (256),
+        # иначе HTTPXRequest держит одно соединение и вызовы Bot API идут по очереди
+        Application.builder().token(BOT_TOKEN).request(TimedRequest(connection_pool_size=256))
+        .persistence(SharedPersistence())
+    )
+    if TELEGRAM_API_BASE:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE}/bot").base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+    return builder
+
+
 def build_telegram_application() -> Application:
     """
     Фабрика: создаёт Application со всеми хэндлерами и готовым JobQueue,
@@ -1176,10 +1943,11 @@ def build_telegram_application() -> Application:
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN отсутствует. Укажите его в .env")
 
-    jq = JobQueue()
-    app = Application.builder().token(BOT_TOKEN).job_queue(jq).build()
+    jq = ClusterJobQueue()
+    app = _application_builder().job_queue(jq).build()
 
     # хэндлеры из твоего main()
+    app.add_handler(TypeHandler(Update, _count_update), group=-1)
     app.add_handler(CommandHandler("start", cmd_start_and_schedule))
     app.add_handler(CommandHandler("test", cmd_test))
     app.add_handler(CommandHandler("testdigest", cmd_testdigest))
@@ -1188,6 +1956,8 @@ def build_telegram_application() -> Application:
     app.add_handler(CommandHandler("addreminder", cmd_addreminder))
     app.add_handler(CommandHandler("list", cmd_list))
     app.add_handler(CommandHandler("clearreminders", cmd_clearreminders))
+    app.add_handler(CommandHandler("profile", cmd_profile))
+    app.add_handler(CommandHandler("quota", cmd_quota))
 
     app.add_handler(CallbackQueryHandler(on_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_message))
@@ -1201,10 +1971,11 @@ def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN отсутствует. Укажите его в .env")
     # ЯВНО создаём очередь и отдаём её приложению
-    jq = JobQueue()
+    jq = ClusterJobQueue()
     # 4) Создаём приложение и регистрируем хэндлеры
-    app = Application.builder().token(BOT_TOKEN).job_queue(jq).build()
+    app = _application_builder().job_queue(jq).build()
 
+    app.add_handler(TypeHandler(Update, _count_update), group=-1)
     app.add_handler(CommandHandler("start", cmd_start_and_schedule))
     app.add_handler(CommandHandler("test", cmd_test))
     app.add_handler(CommandHandler("testdigest", cmd_testdigest))
@@ -1213,11 +1984,18 @@ def main():
     app.add_handler(CommandHandler("addreminder", cmd_addreminder))
     app.add_handler(CommandHandler("list", cmd_list))
     app.add_handler(CommandHandler("clearreminders", cmd_clearreminders))
+    app.add_handler(CommandHandler("profile", cmd_profile))
+    app.add_handler(CommandHandler("quota", cmd_quota))
     app.add_handler(CallbackQueryHandler(on_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_message))
 
-    # 5) Запускаем long polling
+    # 5) Запускаем long polling (расписания рассылок — после initialize, как в server.py)
+    app.post_init = _restore_on_init
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
+
+async def _restore_on_init(application: Application) -> None:
+    await restore_schedules(application.job_queue)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,175 @@
+"""
+Офлайн-бенчмарк дайджеста и основных сценариев бота.
+
+Google Calendar/Tasks и Telegram Bot API подменяются локальными заглушками
+(bench/fake_google.py, bench/fake_telegram.py), так что сеть не нужна,
+а нагрузку можно крутить параметрами:
+
+    python bench/digest_bench.py --calendars 10 --events-per-day 6 --latency-ms 40
+    python bench/digest_bench.py --scenarios refresh,edit --iterations 50 --cold
+
+Сценарии:
+  digest        — build_digest_text()
+  guest_digest  — build_guest_digest_text()
+  refresh       — кнопка «Обновить» (on_callback: refresh_digest)
+  edit          — выбор напоминания и новый текст (on_callback: editrem + on_text_message)
+
+Печатает p50/p95/p99 по сценарию и среднее число вызовов на итерацию:
+HTTP-запросов к Google, логических вызовов API (элементы batch считаются
+по одному) и вызовов Bot API.
+"""
+from __future__ import annotations
+
+import sys
+import time
+import asyncio
+import argparse
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import offline  # noqa: E402
+
+SCENARIOS = ("digest", "guest_digest", "refresh", "edit")
+
+
+def _parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scenarios", default=",".join(SCENARIOS))
+    p.add_argument("--iterations", type=int, default=30)
+    p.add_argument("--warmup", type=int, default=2)
+    p.add_argument("--cold", action="store_true", help="сбрасывать кэш Google перед каждой итерацией")
+    p.add_argument("--calendars", type=int, default=5)
+    p.add_argument("--events-per-day", type=int, default=4)
+    p.add_argument("--days", type=int, default=14)
+    p.add_argument("--tasklists", type=int, default=3)
+    p.add_argument("--tasks", type=int, default=30, help="задач в каждом списке")
+    p.add_argument("--page-size", type=int, default=250, help="потолок страницы на стороне Google")
+    p.add_argument("--latency-ms", type=float, default=30, help="задержка Google на HTTP-запрос")
+    p.add_argument("--telegram-latency-ms", type=float, default=5)
+    p.add_argument("--quota", type=float, default=0, help="GCAL_QUOTA_PER_MINUTE; 0 — без лимита")
+    return p.parse_args()
+
+
+class Runner:
+    def __init__(self, args, fake_google, fake_telegram):
+        import app
+        import storage
+
+        self.args = args
+        self.google = fake_google
+        self.telegram = fake_telegram
+        self.app = app
+        self.application = app.build_telegram_application()
+        self._update_id = 0
+        for i in range(3):
+            storage.add_custom_reminder(f"Бенч напоминание {i}", due=None, user_id=offline.ADMIN_ID, share=True)
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def _process(self, payload: dict) -> None:
+        from telegram import Update
+
+        await self.application.process_update(Update.de_json(payload, self.application.bot))
+
+    async def digest(self) -> None:
+        self.app.build_digest_text()
+
+    async def guest_digest(self) -> None:
+        self.app.build_guest_digest_text()
+
+    async def refresh(self) -> None:
+        await self._process(offline.callback_update(self._next_id(), offline.ADMIN_ID, "refresh_digest"))
+
+    async def edit(self) -> None:
+        await self._process(offline.callback_update(self._next_id(), offline.ADMIN_ID, "editrem:0"))
+        uid = self._next_id()
+        await self._process(offline.text_update(uid, offline.ADMIN_ID, f"Бенч напоминание 0 правка {uid}"))
+
+    async def run(self, name: str) -> dict:
+        import gcal_cache
+
+        step = getattr(self, name)
+        timings: list[float] = []
+        google_calls: Counter = Counter()
+        telegram_calls: Counter = Counter()
+        for i in range(self.args.warmup + self.args.iterations):
+            if self.args.cold:
+                gcal_cache.invalidate()
+            self.google.reset_calls()
+            self.telegram.reset_calls()
+            start = time.perf_counter()
+            await step()
+            elapsed = time.perf_counter() - start
+            if i < self.args.warmup:
+                continue
+            timings.append(elapsed * 1000)
+            google_calls.update(self.google.reset_calls())
+            telegram_calls.update(self.telegram.reset_calls())
+        n = self.args.iterations
+        return {
+            "name": name,
+            "p50": offline.percentile(timings, 50),
+            "p95": offline.percentile(timings, 95),
+            "p99": offline.percentile(timings, 99),
+            "google_http": google_calls.pop("http", 0) / n,
+            "google_batches": google_calls.pop("batch", 0) / n,
+            "google_api": {k: v / n for k, v in sorted(google_calls.items())},
+            "telegram": {k: v / n for k, v in sorted(telegram_calls.items())},
+        }
+
+
+def _report(results: list[dict], args) -> None:
+    mode = "cold cache" if args.cold else "warm cache"
+    print(f"\n{args.iterations} итераций, {mode}, Google {args.latency_ms:.0f} мс/запрос, "
+          f"{args.calendars} календарей × {args.events_per_day} событий/день, "
+          f"{args.tasklists} списков × {args.tasks} задач")
+    print(f"{'сценарий':<14} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'Google HTTP':>12} {'batch':>7}")
+    for r in results:
+        print(f"{r['name']:<14} {r['p50']:9.1f} {r['p95']:9.1f} {r['p99']:9.1f} "
+              f"{r['google_http']:12.1f} {r['google_batches']:7.1f}")
+    print("\nвызовы API на итерацию:")
+    for r in results:
+        google = ", ".join(f"{k}={v:g}" for k, v in r["google_api"].items()) or "—"
+        telegram = ", ".join(f"{k}={v:g}" for k, v in r["telegram"].items()) or "—"
+        print(f"  {r['name']}: Google [{google}]; Bot API [{telegram}]")
+    print(offline.quota_summary())
+
+
+async def _main(args) -> None:
+    fake_google, fake_telegram = offline.prepare(
+        google={
+            "calendars": args.calendars, "events_per_day": args.events_per_day, "days": args.days,
+            "tasklists": args.tasklists, "tasks_per_list": args.tasks,
+            "page_size": args.page_size, "latency_ms": args.latency_ms,
+        },
+        telegram_latency_ms=args.telegram_latency_ms,
+        quota_per_minute=args.quota,
+    )
+    runner = Runner(args, fake_google, fake_telegram)
+    await runner.application.initialize()
+    try:
+        results = []
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise SystemExit(f"неизвестный сценарий: {name}")
+            results.append(await runner.run(name))
+        _report(results, args)
+    finally:
+        await runner.application.shutdown()
+        fake_google.stop()
+        fake_telegram.stop()
+
+
+def main() -> None:
+    args = _parse_args()
+    # stdout бота ([digest] ... и т.п.) не мешает отчёту — отчёт печатается в конце
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
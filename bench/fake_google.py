@@ -0,0 +1,350 @@
+"""
+Локальная заглушка Google Calendar v3 и Tasks v1 для офлайн-бенчмарков.
+
+Отвечает ровно на те вызовы, что делает calendar_source:
+calendarList.list (с syncToken), events.list (timeMin/timeMax, страницы),
+tasklists.list, tasks.list (dueMin/dueMax, страницы), batch-запросы обоих API,
+условные запросы (ETag / If-None-Match -> 304), а также events.watch и
+channels.stop. change_calendar() меняет календарь и, как настоящий Google,
+шлёт push-уведомления на адреса открытых каналов — симулятор для gcal_push.
+Данные генерируются детерминированно вокруг «сегодня» в заданной TZ.
+
+calendar_source направляется сюда переменной GOOGLE_API_ROOT=<FakeGoogle.url>.
+"""
+from __future__ import annotations
+
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from zoneinfo import ZoneInfo
+
+
+def _parse_rfc3339(raw: str) -> datetime:
+    dt = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    # голая дата (так бывает в подложенных вручную задачах) — полночь UTC
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class FakeGoogle:
+    """
+    calendars / tasklists — сколько календарей и списков задач;
+    events_per_day — событий в день на календарь, days — горизонт данных;
+    tasks_per_list — задач в каждом списке (часть без due и выполненные);
+    page_size — потолок maxResults на стороне «сервера»;
+    latency_ms — задержка на каждый HTTP-запрос (batch — тоже один запрос).
+    Первые календарь и список задач называются guest_name — для гостевого дайджеста.
+    """
+
+    def __init__(self, *, calendars: int = 5, events_per_day: int = 4, days: int = 14,
+                 tasklists: int = 3, tasks_per_list: int = 30, page_size: int = 250,
+                 latency_ms: float = 0, tz: str = "Europe/Belgrade", guest_name: str = "Гость",
+                 seed: int = 1):
+        self.page_size = page_size
+        self.latency = latency_ms / 1000
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._sync_seq = 0
+        self.channels: dict[str, dict] = {}  # channel id -> {calendar, address, token, resource_id, seq}
+        rnd = random.Random(seed)
+        zone = ZoneInfo(tz)
+        today = datetime.now(zone).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self.calendars = [
+            {"id": f"cal{i}@group.calendar.google.com", "summary": guest_name if i == 0 else f"Календарь {i}"}
+            for i in range(calendars)
+        ]
+        self.events: dict[str, list[dict]] = {}
+        for cal in self.calendars:
+            items = []
+            for day in range(-1, days):
+                base = today + timedelta(days=day)
+                for n in range(events_per_day):
+                    if n == 0 and rnd.random() < 0.2:
+                        d = base.date()
+                        items.append({"summary": f"Весь день {cal['summary']} {d}",
+                                      "start": {"date": d.isoformat()},
+                                      "end": {"date": (d + timedelta(days=1)).isoformat()}})
+                        continue
+                    start = base + timedelta(hours=rnd.randint(7, 20), minutes=rnd.choice((0, 15, 30, 45)))
+                    end = start + timedelta(minutes=rnd.choice((30, 60, 90)))
+                    items.append({"summary": f"Встреча {n} ({cal['summary']})",
+                                  "start": {"dateTime": start.isoformat()},
+                                  "end": {"dateTime": end.isoformat()}})
+            items.sort(key=lambda e: self._event_start(e))
+            self.events[cal["id"]] = items
+
+        self.tasklists = [
+            {"id": f"list{i}", "title": guest_name if i == 0 else f"Список {i}"} for i in range(tasklists)
+        ]
+        self.tasks: dict[str, list[dict]] = {}
+        for lst in self.tasklists:
+            items = []
+            for n in range(tasks_per_list):
+                task = {"title": f"Задача {n} ({lst['title']})", "status": "needsAction"}
+                r = rnd.random()
+                if r < 0.15:
+                    pass  # без срока
+                elif r < 0.25:
+                    task["status"] = "completed"
+                    task["due"] = (today + timedelta(days=rnd.randint(-3, days))).date().isoformat() + "T00:00:00.000Z"
+                else:
+                    due_day = (today + timedelta(days=rnd.randint(-10, days))).date()
+                    task["due"] = due_day.isoformat() + "T00:00:00.000Z"
+                items.append(task)
+            self.tasks[lst["id"]] = items
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    # --- жизненный цикл ---
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "FakeGoogle":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-google", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self) -> Counter:
+        with self._lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.calls[key] += 1
+
+    # --- маршруты ---
+
+    @staticmethod
+    def _event_start(e: dict) -> datetime:
+        s = e["start"]
+        if "dateTime" in s:
+            return _parse_rfc3339(s["dateTime"]).astimezone(timezone.utc)
+        return datetime.fromisoformat(s["date"]).replace(tzinfo=timezone.utc)
+
+    def handle(self, method: str, target: str, headers: dict, body: bytes = b"") -> tuple[int, dict, bytes]:
+        """Один (не batch) запрос: (статус, заголовки, тело)."""
+        parts = urlsplit(target)
+        path = unquote(parts.path).lstrip("/")
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+        if method == "POST" and (m := re.fullmatch(r"calendar/v3/calendars/(.+)/events/watch", path)):
+            self._count("calendar.events.watch")
+            status, body = self._watch(m.group(1), json.loads(body or b"{}"))
+            return status, {"content-type": "application/json"}, json.dumps(body).encode()
+        if method == "POST" and path == "calendar/v3/channels/stop":
+            self._count("calendar.channels.stop")
+            with self._lock:
+                self.channels.pop(json.loads(body or b"{}").get("id"), None)
+            return 204, {}, b""
+
+        if path == "calendar/v3/users/me/calendarList":
+            self._count("calendar.calendarList.list")
+            status, body = self._calendar_list(q)
+        elif m := re.fullmatch(r"calendar/v3/calendars/(.+)/events", path):
+            self._count("calendar.events.list")
+            status, body = self._events(m.group(1), q)
+        elif path == "tasks/v1/users/@me/lists":
+            self._count("tasks.tasklists.list")
+            status, body = 200, self._page("tasks#taskLists", self.tasklists, q)
+        elif m := re.fullmatch(r"tasks/v1/lists/(.+)/tasks", path):
+            self._count("tasks.tasks.list")
+            status, body = self._tasks(m.group(1), q)
+        else:
+            status, body = 404, {"error": {"code": 404, "message": f"unknown path {path}"}}
+
+        if status != 200:
+            return status, {"content-type": "application/json"}, json.dumps(body).encode()
+        etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()[:16] + '"'
+        body["etag"] = etag
+        if headers.get("if-none-match") == etag:
+            return 304, {"etag": etag}, b""
+        return 200, {"content-type": "application/json; charset=UTF-8", "etag": etag}, \
+            json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+    def _page(self, kind: str, items: list, q: dict) -> dict:
+        size = min(int(q.get("maxResults", self.page_size)), self.page_size)
+        offset = int(q.get("pageToken") or 0)
+        body = {"kind": kind, "items": items[offset:offset + size]}
+        if offset + size < len(items):
+            body["nextPageToken"] = str(offset + size)
+        return body
+
+    def _calendar_list(self, q: dict) -> tuple[int, dict]:
+        if q.get("syncToken"):
+            # изменений между прогонами нет — пустая дельта
+            items: list = []
+        else:
+            items = self.calendars
+        body = self._page("calendar#calendarList", items, q)
+        if "nextPageToken" not in body:
+            with self._lock:
+                self._sync_seq += 1
+                body["nextSyncToken"] = f"sync-{self._sync_seq}"
+        return 200, body
+
+    def _events(self, calendar_id: str, q: dict) -> tuple[int, dict]:
+        items = self.events.get(calendar_id)
+        if items is None:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        lo = _parse_rfc3339(q["timeMin"]) if "timeMin" in q else None
+        hi = _parse_rfc3339(q["timeMax"]) if "timeMax" in q else None
+        selected = [
+            e for e in items
+            if (lo is None or self._event_start(e) >= lo) and (hi is None or self._event_start(e) < hi)
+        ]
+        return 200, self._page("calendar#events", selected, q)
+
+    def _tasks(self, tasklist: str, q: dict) -> tuple[int, dict]:
+        items = self.tasks.get(tasklist)
+        if items is None:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        if q.get("showCompleted") == "false":
+            items = [t for t in items if t["status"] != "completed"]
+        lo = _parse_rfc3339(q["dueMin"]) if "dueMin" in q else None
+        hi = _parse_rfc3339(q["dueMax"]) if "dueMax" in q else None
+        if lo or hi:
+            items = [
+                t for t in items if "due" in t
+                and (lo is None or _parse_rfc3339(t["due"]) >= lo)
+                and (hi is None or _parse_rfc3339(t["due"]) < hi)
+            ]
+        return 200, self._page("tasks#tasks", items, q)
+
+    def _watch(self, calendar_id: str, request: dict) -> tuple[int, dict]:
+        if calendar_id not in self.events:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        ttl = int(request.get("params", {}).get("ttl", 604800))
+        channel = {
+            "calendar": calendar_id,
+            "address": request["address"],
+            "token": request.get("token"),
+            "resource_id": uuid.uuid4().hex,
+            "seq": 0,
+        }
+        with self._lock:
+            self.channels[request["id"]] = channel
+        self._notify(request["id"], channel, "sync")
+        return 200, {
+            "kind": "api#channel",
+            "id": request["id"],
+            "resourceId": channel["resource_id"],
+            "resourceUri": f"{self.url}calendar/v3/calendars/{calendar_id}/events",
+            "expiration": str(int((time.time() + ttl) * 1000)),
+        }
+
+    def _notify(self, channel_id: str, channel: dict, state: str) -> None:
+        channel["seq"] += 1
+        headers = {
+            "X-Goog-Channel-ID": channel_id,
+            "X-Goog-Resource-ID": channel["resource_id"],
+            "X-Goog-Resource-State": state,
+            "X-Goog-Message-Number": str(channel["seq"]),
+        }
+        if channel["token"]:
+            headers["X-Goog-Channel-Token"] = channel["token"]
+
+        def _send():
+            try:
+                req = urllib.request.Request(channel["address"], data=b"", method="POST", headers=headers)
+                urllib.request.urlopen(req, timeout=5).close()
+            except Exception as e:
+                print(f"[fake-google] push на {channel['address']} не доставлен: {e}")
+
+        # Google шлёт уведомления асинхронно, не в ответе на watch
+        threading.Thread(target=_send, daemon=True).start()
+
+    def change_calendar(self, calendar_id: str, summary: str = "Новое событие") -> int:
+        """Добавляет событие на сегодня и рассылает push по каналам календаря. Возвращает число уведомлений."""
+        start = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(hours=1)
+        event = {"summary": summary, "start": {"dateTime": start.isoformat()},
+                 "end": {"dateTime": (start + timedelta(hours=1)).isoformat()}}
+        with self._lock:
+            items = self.events[calendar_id]
+            items.append(event)
+            items.sort(key=self._event_start)
+            targets = [(cid, ch) for cid, ch in self.channels.items() if ch["calendar"] == calendar_id]
+        for channel_id, channel in targets:
+            self._notify(channel_id, channel, "exists")
+        return len(targets)
+
+    def handle_batch(self, content_type: str, body: bytes) -> tuple[int, dict, bytes]:
+        self._count("batch")
+        boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+        out = []
+        for part in body.decode("utf-8").split("--" + boundary):
+            if "application/http" not in part:
+                continue
+            content_id = re.search(r"Content-ID: <([^>]+)>", part).group(1)
+            inner = part.split("\r\n\r\n", 1)[1] if "\r\n\r\n" in part else part.split("\n\n", 1)[1]
+            lines = inner.replace("\r\n", "\n").split("\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if not line.strip():
+                    break
+                k, _, v = line.partition(":")
+                headers[k.strip().lower()] = v.strip()
+            status, resp_headers, resp_body = self.handle(method, target, headers)
+            head = "".join(f"{k}: {v}\r\n" for k, v in resp_headers.items())
+            out.append(
+                f"--RESPONSE_BOUNDARY\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} X\r\n{head}\r\n{resp_body.decode('utf-8')}\r\n"
+            )
+        payload = ("".join(out) + "--RESPONSE_BOUNDARY--").encode("utf-8")
+        return 200, {"content-type": "multipart/mixed; boundary=RESPONSE_BOUNDARY"}, payload
+
+
+def _handler_for(fake: FakeGoogle):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status: int, headers: dict, body: bytes) -> None:
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            fake._count("http")
+            if fake.latency:
+                time.sleep(fake.latency)
+            headers = {k.lower(): v for k, v in self.headers.items()}
+            self._reply(*fake.handle("GET", self.path, headers))
+
+        def do_POST(self):
+            fake._count("http")
+            if fake.latency:
+                time.sleep(fake.latency)
+            body = self.rfile.read(int(self.headers.get("content-length", 0)))
+            if urlsplit(self.path).path.lstrip("/") in ("batch", "batch/calendar/v3", "batch/tasks/v1"):
+                self._reply(*fake.handle_batch(self.headers.get("content-type", ""), body))
+            else:
+                headers = {k.lower(): v for k, v in self.headers.items()}
+                self._reply(*fake.handle("POST", self.path, headers, body))
+
+    return Handler
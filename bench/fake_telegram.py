@@ -0,0 +1,103 @@
+"""
+Локальная заглушка Telegram Bot API для офлайн-бенчмарков.
+
+Принимает любые методы (/bot<token>/<method>), считает вызовы и отвечает
+правдоподобно: getMe — бот, методы-флаги — true, остальное — Message
+с текстом запроса. app.py направляется сюда переменной TELEGRAM_API_BASE.
+"""
+from __future__ import annotations
+
+import json
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOOL_METHODS = {
+    "answerCallbackQuery", "deleteMessage", "setWebhook", "deleteWebhook",
+    "setMyCommands", "sendChatAction", "close", "logOut",
+}
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, *, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 1000
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(self))
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegram":
+        threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self) -> Counter:
+        with self._lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def answer(self, method: str, params: dict):
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            message_id = self._message_id
+        if method == "getMe":
+            return BOT_USER
+        if method in BOOL_METHODS:
+            return True
+        try:
+            chat_id = int(params.get("chat_id", 0))
+        except ValueError:
+            chat_id = 0
+        return {
+            "message_id": int(params.get("message_id", message_id)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()}
+    return {}  # multipart (файлы) — параметры не нужны
+
+
+def _handler_for(fake: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            if fake.latency:
+                time.sleep(fake.latency)
+            body = self.rfile.read(int(self.headers.get("content-length", 0)))
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            params = _parse_params(self.headers.get("content-type", ""), body)
+            payload = json.dumps({"ok": True, "result": fake.answer(method, params)}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST
+
+    return Handler
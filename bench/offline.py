@@ -0,0 +1,123 @@
+"""
+Общая обвязка офлайн-бенчмарков: поднимает заглушки Google и Telegram,
+выставляет окружение бота на них и уводит рабочие файлы во временный каталог.
+
+prepare() нужно вызвать ДО `import app` / `import server`: конфиг читается
+из окружения при импорте.
+
+Свой лимит запросов к Google (gcal_quota) в бенчах по умолчанию снят, иначе
+меряется ведро токенов, а не бот; включается через quota_per_minute
+(флаг --quota). quota_summary() — сколько раз запросы упёрлись в лимит.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+
+from fake_google import FakeGoogle
+from fake_telegram import FakeTelegram
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ADMIN_ID = 1001
+GUEST_ID = 1002
+GUEST_NAME = "Гость"
+
+
+# Лимит «без ограничений»: на порядки больше, чем успевает запросить любой бенч
+UNLIMITED_QUOTA = 1_000_000
+
+
+def prepare(*, google: dict | None = None, telegram_latency_ms: float = 0,
+            workdir: str | None = None, quota_per_minute: float = 0) -> tuple[FakeGoogle, FakeTelegram]:
+    fake_google = FakeGoogle(guest_name=GUEST_NAME, tz=os.getenv("TZ", "Europe/Belgrade"), **(google or {})).start()
+    fake_telegram = FakeTelegram(latency_ms=telegram_latency_ms).start()
+
+    workdir = workdir or tempfile.mkdtemp(prefix="organizer-bench-")
+    os.environ.update({
+        "GOOGLE_API_ROOT": fake_google.url,
+        "TELEGRAM_API_BASE": fake_telegram.url,
+        "GCAL_TOKEN_JSON": json.dumps({
+            "token": "bench", "refresh_token": "bench", "client_id": "bench", "client_secret": "bench",
+            "expiry": "2100-01-01T00:00:00Z",  # иначе google-auth пойдёт обновлять токен
+        }),
+        "GCAL_CACHE_PATH": str(Path(workdir) / "gcal_cache.sqlite3"),
+        "BOT_TOKEN": "123456:bench",
+        "ADMIN_ID": str(ADMIN_ID),
+        "GUEST_USER_ID": str(GUEST_ID),
+        "GUEST_CALENDAR_NAME": GUEST_NAME,
+        "GUEST_TASKLIST_NAME": GUEST_NAME,
+        "GCAL_QUOTA_PER_MINUTE": str(quota_per_minute or UNLIMITED_QUOTA),
+    })
+    if not quota_per_minute:
+        os.environ["GCAL_QUOTA_BURST"] = str(UNLIMITED_QUOTA)
+    os.environ.setdefault("TZ", "Europe/Belgrade")
+    # state.sqlite3 и кэши бота создаются в текущем каталоге — не трогаем настоящие
+    os.chdir(workdir)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    return fake_google, fake_telegram
+
+
+def quota_summary() -> str:
+    """Строка для отчёта бенча: упирались ли запросы в лимит gcal_quota."""
+    import gcal_quota
+
+    counts = gcal_quota.events()
+    limit = "без лимита" if gcal_quota.QUOTA_PER_MINUTE >= UNLIMITED_QUOTA else f"{gcal_quota.QUOTA_PER_MINUTE:g}/мин"
+    return (f"квота Google ({limit}): ожидали токен {counts.get('throttled', 0)}, "
+            f"не дождались {counts.get('exhausted', 0)}, 429 {counts.get('rate_limited', 0)}")
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "…",
+            },
+        },
+    }
+
+
+def text_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def command_update(update_id: int, user_id: int, command: str) -> dict:
+    update = text_update(update_id, user_id, command)
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}]
+    return update
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга (без интерполяции)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
@@ -0,0 +1,133 @@
+"""
+Симулятор push-уведомлений Google Calendar для gcal_push.
+
+Два режима:
+
+1) Сквозная офлайн-проверка (заглушка Google + бот под uvicorn):
+
+    python bench/push_simulator.py demo
+
+   Заводит каналы, дважды строит дайджест (второй раз события из кэша,
+   без events.list), меняет один календарь в заглушке — она шлёт push
+   на /gcal/notify — и строит дайджест снова: перезапрашивается только
+   изменённый календарь.
+
+2) Ручное уведомление в работающего бота (локально или на стенде):
+
+    python bench/push_simulator.py send --url http://127.0.0.1:8000/gcal/notify \\
+        --channel-id <id> --token <токен канала> [--state exists]
+
+   Без --channel-id канал (и его токен) ищется по --calendar в реестре
+   из STATE_PATH (shared_state).
+"""
+from __future__ import annotations
+
+import os
+import sys
+import socket
+import asyncio
+import argparse
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def send(url: str, channel_id: str, token: str, state: str, resource_id: str = "", number: int = 1) -> int:
+    headers = {
+        "X-Goog-Channel-ID": channel_id,
+        "X-Goog-Resource-ID": resource_id,
+        "X-Goog-Resource-State": state,
+        "X-Goog-Message-Number": str(number),
+    }
+    if token:
+        headers["X-Goog-Channel-Token"] = token
+    req = urllib.request.Request(url, data=b"", method="POST", headers=headers)
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return resp.status
+
+
+def _cmd_send(args) -> None:
+    channel_id, resource_id, token = args.channel_id, args.resource_id, args.token
+    if not channel_id:
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        import gcal_push
+
+        channels = gcal_push._registry()
+        if args.calendar not in channels:
+            raise SystemExit(f"канала для {args.calendar!r} нет в реестре; есть: {', '.join(channels) or '—'}")
+        channel_id = channels[args.calendar]["id"]
+        resource_id = resource_id or channels[args.calendar]["resource_id"]
+        token = token or channels[args.calendar]["token"]
+    status = send(args.url, channel_id, token, args.state, resource_id, args.number)
+    print(f"{args.state} -> {args.url}: HTTP {status}")
+
+
+async def _demo(args) -> None:
+    import offline
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    os.environ["GCAL_PUSH_ADDRESS"] = f"http://127.0.0.1:{port}/gcal/notify"
+    fake_google, fake_telegram = offline.prepare(google={"calendars": args.calendars, "latency_ms": args.latency_ms})
+
+    import uvicorn
+    import server
+    import app
+    import gcal_push
+
+    srv = uvicorn.Server(uvicorn.Config(server.fastapi_app, host="127.0.0.1", port=port, log_level="warning"))
+    serve_task = asyncio.create_task(srv.serve())
+    while not srv.started:
+        await asyncio.sleep(0.05)
+    loop = asyncio.get_running_loop()
+
+    async def digest(label: str) -> None:
+        fake_google.reset_calls()
+        await loop.run_in_executor(None, app.build_digest_text)
+        calls = fake_google.reset_calls()
+        print(f"{label:<46} events.list={calls.get('calendar.events.list', 0):<3} HTTP={calls.get('http', 0)}")
+
+    try:
+        counts = await loop.run_in_executor(None, gcal_push.ensure_channels)
+        print(f"каналы: {counts}")
+        await asyncio.sleep(0.3)  # sync-уведомления
+        await digest("первый дайджест (холодный кэш)")
+        await digest("второй дайджест (push, без изменений)")
+        changed = fake_google.calendars[-1]["id"]
+        fake_google.change_calendar(changed)
+        await asyncio.sleep(0.3)
+        await digest(f"после изменения {changed}")
+        await digest("ещё раз (снова из кэша)")
+    finally:
+        srv.should_exit = True
+        await serve_task
+        fake_google.stop()
+        fake_telegram.stop()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = p.add_subparsers(dest="cmd", required=True)
+    d = sub.add_parser("demo", help="сквозная проверка на заглушках")
+    d.add_argument("--calendars", type=int, default=4)
+    d.add_argument("--latency-ms", type=float, default=20)
+    s = sub.add_parser("send", help="послать уведомление работающему боту")
+    s.add_argument("--url", required=True)
+    s.add_argument("--channel-id", default="")
+    s.add_argument("--calendar", default="", help="calendarId — найти канал в реестре gcal_push")
+    s.add_argument("--resource-id", default="")
+    s.add_argument("--token", default="", help="по умолчанию — токен канала из реестра")
+    s.add_argument("--state", default="exists", choices=("sync", "exists", "not_exists"))
+    s.add_argument("--number", type=int, default=1)
+    args = p.parse_args()
+
+    if args.cmd == "send":
+        _cmd_send(args)
+        return
+    asyncio.run(_demo(args))
+
+
+if __name__ == "__main__":
+    main()
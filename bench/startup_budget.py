@@ -0,0 +1,142 @@
+"""
+Бенчмарк холодного старта server.py с бюджетом.
+
+Каждый прогон — чистый процесс (python -X importtime), который проходит
+старт до конца, как под uvicorn: `import server`, затем server._on_startup()
+(инициализация бота, восстановление расписаний рассылок) и заведение
+push-каналов Calendar (gcal_push.ensure_channels — в проде это первая
+задача gcal_push_renew). Google и Telegram — локальные заглушки
+(bench/offline.py), в общем хранилище заранее сохранены расписания админа
+и гостя. Первый прогон заводит каналы, следующие находят их в реестре —
+как при рестарте.
+
+Печатает медианы по этапам и самые дорогие модули последнего прогона.
+Код возврата 1, если медиана полного старта превысила бюджет — годится
+как регрессионная проверка в CI или перед деплоем:
+
+    python bench/startup_budget.py --budget-ms 2000 --runs 5
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import offline  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+STAGES = ("import", "startup", "channels")
+MARKER = "startup-budget:"
+
+
+def _child() -> None:
+    """Один старт в этом процессе; длительности этапов — строкой MARKER в stdout."""
+    sys.path.insert(0, str(ROOT))
+    start = time.perf_counter()
+    import server
+    import gcal_push
+
+    imported = time.perf_counter()
+
+    async def _start() -> tuple[float, float]:
+        await server._on_startup()
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, gcal_push.ensure_channels)
+        ready = time.perf_counter()
+        await server._on_shutdown()
+        return started, ready
+
+    started, ready = asyncio.run(_start())
+    timings = {"import": imported - start, "startup": started - imported, "channels": ready - started}
+    print(MARKER + json.dumps({k: v * 1000 for k, v in timings.items()}), flush=True)
+
+
+def _seed_schedules() -> None:
+    """Расписания в общем хранилище: restore_schedules на старте есть что ставить."""
+    import app
+    import storage
+
+    storage.set_chat_id(offline.ADMIN_ID)
+    app._save_schedules(offline.ADMIN_ID)
+
+
+def _run_once() -> tuple[dict[str, float], str]:
+    env = dict(os.environ)
+    env.pop("STARTUP_PROFILE", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(Path(__file__).resolve()), "--child"],
+        env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stdout + proc.stderr)
+        raise SystemExit(f"старт сервера упал с кодом {proc.returncode}")
+    line = next(l for l in proc.stdout.splitlines() if l.startswith(MARKER))
+    return json.loads(line[len(MARKER):]), proc.stderr
+
+
+def _top_modules(importtime_log: str, n: int) -> list[tuple[int, int, str]]:
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            rows.append((int(own), int(cumulative), name.rstrip()))
+        except ValueError:
+            continue
+    return sorted(rows, key=lambda r: r[1], reverse=True)[:n]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "2000")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child()
+        return 0
+
+    fake_google, fake_telegram = offline.prepare()
+    # sync-уведомления новых каналов заглушка Google шлёт сюда; HTTP-сервера в прогоне нет,
+    # а заглушка Telegram отвечает 200 на любой POST
+    os.environ["GCAL_PUSH_ADDRESS"] = f"{fake_telegram.url}/gcal/notify"
+    try:
+        _seed_schedules()
+        runs = []
+        log = ""
+        for _ in range(args.runs):
+            timings, log = _run_once()
+            runs.append(timings)
+    finally:
+        fake_google.stop()
+        fake_telegram.stop()
+
+    totals = [sum(r.values()) for r in runs]
+    median = statistics.median(totals)
+    stages = ", ".join(f"{name} {statistics.median(r[name] for r in runs):.0f} ms" for name in STAGES)
+    print(f"cold start (import server + _on_startup + push-каналы): median {median:.0f} ms, "
+          f"min {min(totals):.0f} ms, max {max(totals):.0f} ms, runs {args.runs}")
+    print(f"по этапам (медианы): {stages}")
+    print("cumulative ms | self ms | module")
+    for own, cumulative, name in _top_modules(log, args.top):
+        print(f"{cumulative / 1000:13.1f} | {own / 1000:7.1f} | {name}")
+
+    if median > args.budget_ms:
+        print(f"FAIL: {median:.0f} ms > бюджет {args.budget_ms:.0f} ms")
+        return 1
+    print(f"OK: {median:.0f} ms <= бюджет {args.budget_ms:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
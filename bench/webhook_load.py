@@ -0,0 +1,209 @@
+"""
+Нагрузочный тест вебхука: синтетические апдейты Telegram в server.fastapi_app.
+
+Bot API и Google подменяются локальными заглушками (см. bench/offline.py),
+поэтому меряется только сам бот. Нагрузка открытая: апдейты уходят с заданной
+частотой независимо от того, успевает ли бот (так видно насыщение),
+а --concurrency ограничивает число одновременных запросов.
+
+    python bench/webhook_load.py --rate 50 --duration 20 --users 20 --refresh-share 0.1
+    python bench/webhook_load.py --transport uvicorn --rate 100
+
+Смесь действий: refresh_digest (доля --refresh-share) против дешёвых —
+меню, настройки, /test, обычный текст. Пользователи — админ и
+--users-1 авторизованных (AUTHORIZED_USER_IDS).
+
+Отчёт: выполненные апдейты в секунду, перцентили задержки ответа вебхука и
+блокировки event loop — сколько суммарно и максимум цикл простоял сверх
+ожидаемого (тикер раз в --lag-interval-ms).
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import socket
+import random
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import offline  # noqa: E402
+
+CHEAP_ACTIONS = ("menu:root", "menu:settings", "/test", "text")
+
+
+def _parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--transport", choices=("inprocess", "uvicorn"), default="inprocess")
+    p.add_argument("--rate", type=float, default=30, help="апдейтов в секунду")
+    p.add_argument("--duration", type=float, default=15, help="секунд подачи нагрузки")
+    p.add_argument("--concurrency", type=int, default=64, help="предел одновременных запросов")
+    p.add_argument("--users", type=int, default=10)
+    p.add_argument("--refresh-share", type=float, default=0.1, help="доля refresh_digest в смеси")
+    p.add_argument("--latency-ms", type=float, default=30, help="задержка Google на HTTP-запрос")
+    p.add_argument("--telegram-latency-ms", type=float, default=20)
+    p.add_argument("--calendars", type=int, default=5)
+    p.add_argument("--quota", type=float, default=0, help="GCAL_QUOTA_PER_MINUTE; 0 — без лимита")
+    p.add_argument("--lag-interval-ms", type=float, default=10)
+    p.add_argument("--stall-ms", type=float, default=50, help="порог, с которого лаг считается блокировкой")
+    p.add_argument("--seed", type=int, default=1)
+    return p.parse_args()
+
+
+class LoopLagMonitor:
+    """Тикер: насколько позже запланированного просыпается корутина."""
+
+    def __init__(self, interval: float, stall: float):
+        self.interval = interval
+        self.stall = stall
+        self.lags: list[float] = []
+        self.blocked = 0.0
+        self.stalls = 0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            self.lags.append(lag)
+            if lag >= self.stall:
+                self.stalls += 1
+                self.blocked += lag
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+
+def _make_update(rnd: random.Random, update_id: int, users: list[int], refresh_share: float) -> tuple[str, dict]:
+    user = rnd.choice(users)
+    if rnd.random() < refresh_share:
+        return "refresh", offline.callback_update(update_id, user, "refresh_digest")
+    action = rnd.choice(CHEAP_ACTIONS)
+    if action == "/test":
+        return "command", offline.command_update(update_id, user, "/test")
+    if action == "text":
+        return "text", offline.text_update(update_id, user, f"просто текст {update_id}")
+    return "callback", offline.callback_update(update_id, user, action)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _main(args) -> None:
+    import httpx
+
+    users = [offline.ADMIN_ID] + [2000 + i for i in range(max(0, args.users - 1))]
+    os.environ["AUTHORIZED_USER_IDS"] = ",".join(str(u) for u in users[1:])
+    os.environ.pop("WEBHOOK_SECRET", None)
+    fake_google, fake_telegram = offline.prepare(
+        google={"calendars": args.calendars, "latency_ms": args.latency_ms},
+        telegram_latency_ms=args.telegram_latency_ms,
+        quota_per_minute=args.quota,
+    )
+    import server
+
+    uvicorn_server = serve_task = None
+    if args.transport == "uvicorn":
+        import uvicorn
+
+        port = _free_port()
+        uvicorn_server = uvicorn.Server(uvicorn.Config(
+            server.fastapi_app, host="127.0.0.1", port=port, log_level="warning", lifespan="on",
+        ))
+        serve_task = asyncio.create_task(uvicorn_server.serve())
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.05)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        await server._on_startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.fastapi_app),
+                                   base_url="http://bench", timeout=120)
+
+    rnd = random.Random(args.seed)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies: dict[str, list[float]] = {}
+    errors = 0
+
+    async def _send(kind: str, payload: dict) -> None:
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                resp = await client.post(server.WEBHOOK_PATH, json=payload)
+                resp.raise_for_status()
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"[load] {kind}: {e!r}")
+                return
+            latencies.setdefault(kind, []).append((time.perf_counter() - start) * 1000)
+
+    monitor = LoopLagMonitor(args.lag_interval_ms / 1000, args.stall_ms / 1000)
+    monitor.start()
+    tasks = []
+    started = time.perf_counter()
+    update_id = 0
+    try:
+        while (now := time.perf_counter()) - started < args.duration:
+            due = started + update_id / args.rate
+            if due > now:
+                await asyncio.sleep(due - now)
+            update_id += 1
+            kind, payload = _make_update(rnd, update_id, users, args.refresh_share)
+            tasks.append(asyncio.create_task(_send(kind, payload)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+    finally:
+        monitor.stop()
+        await client.aclose()
+        if uvicorn_server is not None:
+            uvicorn_server.should_exit = True
+            await serve_task
+        else:
+            await server._on_shutdown()
+        fake_google.stop()
+        fake_telegram.stop()
+
+    _report(args, update_id, wall, latencies, errors, monitor, fake_google, fake_telegram)
+
+
+def _report(args, sent, wall, latencies, errors, monitor, fake_google, fake_telegram) -> None:
+    done = sum(len(v) for v in latencies.values())
+    everything = [x for v in latencies.values() for x in v]
+    print(f"\n{args.transport}: {sent} апдейтов за {wall:.1f} с при целевых {args.rate:g}/с, "
+          f"{args.users} пользователей, refresh {args.refresh_share:.0%}")
+    print(f"выполнено: {done / wall:.1f} апдейтов/с, ошибок: {errors}")
+    print(f"{'тип':<10} {'n':>6} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for kind, values in sorted(latencies.items()) + [("всего", everything)]:
+        print(f"{kind:<10} {len(values):6d} {offline.percentile(values, 50):9.1f} "
+              f"{offline.percentile(values, 95):9.1f} {offline.percentile(values, 99):9.1f} "
+              f"{max(values, default=0):9.1f}")
+    lag_ms = [x * 1000 for x in monitor.lags]
+    print(f"event loop: лаг p50 {offline.percentile(lag_ms, 50):.1f} мс, p99 {offline.percentile(lag_ms, 99):.1f} мс, "
+          f"max {max(lag_ms, default=0):.1f} мс; блокировок ≥{args.stall_ms:g} мс: {monitor.stalls}, "
+          f"суммарно {monitor.blocked:.2f} с ({monitor.blocked / wall:.1%} времени)")
+    google = fake_google.reset_calls()
+    telegram = fake_telegram.reset_calls()
+    print(f"Google: {google.get('http', 0)} HTTP-запросов; Bot API: {sum(telegram.values())} вызовов")
+    print(offline.quota_summary())
+
+
+def main() -> None:
+    args = _parse_args()
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
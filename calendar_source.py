@@ -2,17 +2,36 @@ from __future__ import annotations
 
 import os
 import json
+import time
 import base64
+import logging
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
+from datetime import timedelta
 from pathlib import Path
-from typing import List, Dict
-from datetime import datetime, timedelta, date
-from zoneinfo import ZoneInfo
+from typing import List, Dict, Iterable, Iterator, NamedTuple, TYPE_CHECKING
 
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+import gcal_cache
+import gcal_policy
+import gcal_push
+import gcal_quota
+import gcal_time
+import gcal_transport
+import metrics
+import tracing
+
+log = logging.getLogger(__name__)
+
+# Google-стек (googleapiclient, google.auth, httplib2) импортируем лениво:
+# он тяжёлый, а server.py должен отвечать на /healthz и принимать вебхуки сразу.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 
 TOKEN_FILE = "token.json"
+# Свой корень API вместо googleapis.com (локальная заглушка из bench/, прокси)
+API_ROOT = os.getenv("GOOGLE_API_ROOT", "")
 SCOPES = [
     "https://www.googleapis.com/auth/calendar.readonly",
     "https://www.googleapis.com/auth/tasks.readonly",
@@ -20,6 +39,8 @@ SCOPES = [
 
 
 def _load_credentials() -> Credentials:
+    from google.oauth2.credentials import Credentials
+
     b64 = os.getenv("GCAL_TOKEN_B64")
     if b64:
         info = json.loads(base64.b64decode(b64).decode("utf-8"))
@@ -36,22 +57,409 @@ def _load_credentials() -> Credentials:
     raise RuntimeError("Нет GCAL_TOKEN_B64/GCAL_TOKEN_JSON и не найден token.json")
 
 
-def _list_calendars(service) -> Dict[str, str]:
+# --- Клиенты Google: собираем один раз на процесс ---
+
+_services: dict = {}
+_services_lock = threading.Lock()
+_credentials: Credentials | None = None
+
+
+def _service(name: str, version: str):
     """
-    Возвращает словарь {calendarId: summary} для всех календарей аккаунта.
+    Клиент API name/version. Discovery-документ берём из статической копии,
+    которая поставляется с google-api-python-client (без сети), парсим его
+    один раз и переиспользуем клиент и учётные данные между вызовами —
+    токен обновляется сам, когда истечёт.
+    """
+    global _credentials
+    with _services_lock:
+        svc = _services.get((name, version))
+        if svc is None:
+            from googleapiclient.discovery import build_from_document
+            from googleapiclient.discovery_cache import get_static_doc
+
+            doc = get_static_doc(name, version)
+            if doc is None:
+                raise RuntimeError(f"Нет статического discovery-документа для {name} {version}")
+            if API_ROOT:
+                # batch-URI googleapiclient строит из rootUrl, поэтому подменяем в документе
+                doc = json.loads(doc)
+                doc["rootUrl"] = API_ROOT
+                doc["baseUrl"] = API_ROOT + doc.get("servicePath", "")
+            if _credentials is None:
+                _credentials = _load_credentials()
+            svc = build_from_document(doc, credentials=_credentials)
+            _services[(name, version)] = svc
+    return svc
+
+
+def _run(request, methods: list[str] | None = None):
+    """
+    Выполняет HttpRequest/BatchHttpRequest на соединении из общего пула
+    (keep-alive, таймауты — см. gcal_transport) по политике gcal_policy:
+    дедлайн, повторы 429/5xx с джиттером, circuit breaker.
+    429 и 403 rateLimitExceeded вдобавок снижают темп в gcal_quota.
+    Перед отправкой берёт токены квоты (gcal_quota) — по одному на запрос,
+    для batch это methods его элементов.
+    """
+    tries = 0
+
+    def _attempt(timeout: float):
+        nonlocal tries
+        tries += 1
+        if tries > 1:
+            gcal_quota.retried(methods)
+        try:
+            with gcal_transport.authorized(_credentials, timeout=timeout) as http:
+                result = request.execute(http=http)
+        except Exception as e:
+            if gcal_policy.is_rate_limited(e):
+                gcal_quota.rate_limited()
+            raise
+        return result
+
+    # у BatchHttpRequest нет methodId: методы его элементов передаёт _execute_batch
+    method = getattr(request, "methodId", None)
+    if methods is None:
+        methods = [method] if method else []
+    gcal_quota.acquire(methods)
+    for name in methods:
+        metrics.GOOGLE_REQUESTS.inc(method=name)
+    with metrics.GOOGLE_SECONDS.time(method=method or "batch"), tracing.span("google", method=method or "batch"):
+        return gcal_policy.call(_attempt)
+
+
+def _calendar_service():
+    return _service("calendar", "v3")
+
+
+def warm_up() -> None:
+    """Прогрев клиентов в фоне после старта сервера. Ошибки не критичны."""
+    try:
+        _calendar_service()
+        _tasks_service()
+    except Exception:
+        pass
+
+
+def _http_status(exc: Exception) -> int | None:
+    """HTTP-статус из googleapiclient.errors.HttpError (или None для прочих ошибок)."""
+    from googleapiclient.errors import HttpError
+
+    if isinstance(exc, HttpError):
+        return exc.resp.status
+    return None
+
+
+# --- Частичные ответы (fields=) и размеры страниц ---
+# Код читает только id/название и start/end/due, поэтому просим у Google
+# ровно эти поля: без attendees, description, conferenceData и т.п.
+# etag нужен для условных запросов (см. _execute_cached).
+
+EVENT_FIELDS = "summary,start(date,dateTime),end(date,dateTime)"
+TASK_FIELDS = "title,due"
+
+FIELDS_CALENDAR_LIST = "etag,nextPageToken,nextSyncToken,items(id,summary,deleted,hidden)"
+FIELDS_EVENTS = f"etag,nextPageToken,items({EVENT_FIELDS})"
+FIELDS_TASKLISTS = "etag,nextPageToken,items(id,title)"
+FIELDS_TASKS = f"etag,nextPageToken,items({TASK_FIELDS})"
+
+# Календарей и списков задач обычно единицы — одна страница на всё.
+# События после проекции весят мало, поэтому страница крупнее дефолтных 250.
+PAGE_SIZE_CALENDAR_LIST = 250
+PAGE_SIZE_EVENTS = 500
+PAGE_SIZE_TASKLISTS = 100
+PAGE_SIZE_TASKS = 100
+
+# Запас dueMin/dueMax вокруг окна задач (смещение зоны + due «без времени» в 00:00 UTC)
+TASKS_DUE_SLACK = timedelta(days=1)
+
+
+# --- Кэш ответов Google (переживает рестарты, см. gcal_cache) ---
+
+# Сколько секунд считаем свежими списки календарей/тасклистов без похода в Google
+META_TTL = int(os.getenv("GCAL_CACHE_META_TTL", "600"))
+CALENDAR_LIST_KEY = "calendarList"
+# Предохранитель на один list-вызов (все страницы вместе)
+MAX_ITEMS = int(os.getenv("GCAL_MAX_ITEMS", "5000"))
+# Сколько запросов класть в один batch (у Calendar API предел — 50)
+BATCH_SIZE = max(1, int(os.getenv("GCAL_BATCH_SIZE", "50")))
+
+
+_fallback = threading.local()
+
+
+@contextmanager
+def cache_fallbacks() -> Iterator[list[float | None]]:
+    """
+    Собирает stored_at записей кэша, которые внутри блока (в этом потоке)
+    отданы вместо ответа Google: сбой, открытый breaker, исчерпанная квота.
+    None — ресурс (календарь, список задач) пропущен: данных о нём нет вовсе.
+    Пустой список — все данные свежие.
+    """
+    prev = getattr(_fallback, "served", None)
+    served: list[float | None] = []
+    _fallback.served = served
+    try:
+        yield served
+    finally:
+        _fallback.served = prev
+
+
+def _note_fallback(stored_at: float | None) -> None:
+    served = getattr(_fallback, "served", None)
+    if served is not None:
+        served.append(stored_at)
+
+
+def _served_stale(entry: gcal_cache.CacheEntry, exc: Exception) -> None:
+    if isinstance(exc, gcal_quota.QuotaExhausted):
+        gcal_quota.served_from_cache()
+        metrics.GCAL_CACHE_LOOKUPS.inc(result="quota")
+    else:
+        metrics.GCAL_CACHE_LOOKUPS.inc(result="stale")
+    _note_fallback(entry.stored_at)
+
+
+def _prepare_cached(request, max_age: float):
+    """
+    Готовит запрос к выполнению через кэш.
+    Возвращает (payload, None), если свежая запись есть и сеть не нужна,
+    иначе (None, finish), где finish(response, exception) кладёт ответ в кэш
+    (или достаёт его оттуда на 304) и возвращает итоговый payload.
+    """
+    key = request.uri
+    entry = gcal_cache.get(key)
+    if entry and max_age and time.time() - entry.stored_at < max_age:
+        metrics.GCAL_CACHE_LOOKUPS.inc(result="fresh")
+        return entry.payload, None
+
+    if entry and entry.etag:
+        request.headers["If-None-Match"] = entry.etag
+
+    # ETag берём из заголовка ответа, если он есть
+    captured: dict = {}
+    postproc = request.postproc
+
+    def _capture(resp, content):
+        captured["etag"] = resp.get("etag")
+        return postproc(resp, content)
+
+    request.postproc = _capture
+
+    def finish(resp: dict | None, exc: Exception | None) -> dict:
+        if exc is not None:
+            if entry and _http_status(exc) == 304:
+                metrics.GCAL_CACHE_LOOKUPS.inc(result="revalidated")
+                gcal_cache.touch(key)
+                return entry.payload
+            if entry and gcal_policy.is_transient(exc):
+                # Google болеет или своя квота кончилась — лучше вчерашние данные, чем упавший дайджест
+                print(f"[gcal] отдаём кэш вместо ответа Google: {exc}")
+                _served_stale(entry, exc)
+                return entry.payload
+            raise exc
+        metrics.GCAL_CACHE_LOOKUPS.inc(result="miss")
+        gcal_cache.put(key, resp, etag=captured.get("etag") or resp.get("etag"))
+        return resp
+
+    return None, finish
+
+
+def _execute_cached(request, *, max_age: float = 0) -> dict:
+    """
+    Выполняет запрос googleapiclient через персистентный кэш.
+    • запись моложе max_age секунд отдаётся без сети;
+    • иначе запрос уходит с If-None-Match, и на 304 возвращаем кэш.
+    Ключ — URI запроса (все параметры, включая pageToken).
+    """
+    payload, finish = _prepare_cached(request, max_age)
+    if finish is None:
+        return payload
+    try:
+        resp = _run(request)
+    except Exception as e:
+        return finish(None, e)
+    return finish(resp, None)
+
+
+def _execute_batch(service, requests: list, *, max_age: float = 0) -> list:
+    """
+    Выполняет запросы одним batch-вызовом Google (один HTTP round trip).
+    Возвращает ответы в исходном порядке; на месте упавшего элемента — исключение.
+    """
+    results: list = [None] * len(requests)
+    finishers: dict = {}
+
+    def _on_item(request_id, response, exception):
+        if exception is not None and gcal_policy.is_rate_limited(exception):
+            gcal_quota.rate_limited()
+        try:
+            results[int(request_id)] = finishers[request_id](response, exception)
+        except Exception as e:
+            results[int(request_id)] = e
+
+    batch = service.new_batch_http_request(callback=_on_item)
+    methods: list[str] = []
+    for i, request in enumerate(requests):
+        payload, finish = _prepare_cached(request, max_age)
+        if finish is None:
+            results[i] = payload
+            continue
+        finishers[str(i)] = finish
+        methods.append(request.methodId)
+        batch.add(request, request_id=str(i))
+    if not finishers:
+        return results
+    try:
+        _run(batch, methods)
+    except Exception as e:
+        # batch не ушёл целиком (квота, breaker, сеть) — каждый элемент
+        # решает сам, как с одиночным запросом: кэш или ошибка
+        for request_id, finish in finishers.items():
+            try:
+                results[int(request_id)] = finish(None, e)
+            except Exception as err:
+                results[int(request_id)] = err
+    return results
+
+
+# --- Постраничное чтение list-вызовов ---
+
+def _iter_pages(list_method, *, cached: bool = True, max_age: float = 0, **params) -> Iterator[dict]:
+    """
+    Генератор страниц list-вызова (service.events().list и т.п.) с учётом nextPageToken.
+    Следующая страница запрашивается только когда потребитель дочитал текущую.
     """
-    result: Dict[str, str] = {}
     page_token = None
     while True:
-        resp = service.calendarList().list(pageToken=page_token).execute()
-        for item in resp.get("items", []):
-            cid = item.get("id")
-            name = item.get("summary", "")
-            if cid:
-                result[cid] = name
+        request = list_method(pageToken=page_token, **params)
+        resp = _execute_cached(request, max_age=max_age) if cached else _run(request)
+        yield resp
         page_token = resp.get("nextPageToken")
         if not page_token:
-            break
+            return
+
+
+def _iter_items(list_method, *, max_items: int = MAX_ITEMS, max_age: float = 0, **params) -> Iterator[dict]:
+    """Поток элементов items по всем страницам, не больше max_items."""
+    count = 0
+    for resp in _iter_pages(list_method, max_age=max_age, **params):
+        for item in resp.get("items", []):
+            if count >= max_items:
+                source = params.get("calendarId") or params.get("tasklist") or ""
+                print(f"[gcal] список {source} обрезан на {max_items} элементах")
+                return
+            count += 1
+            yield item
+
+
+def _iter_pages_many(service, make_request, keys: List[str], *, max_age: float = 0,
+                     stop: set | None = None) -> Iterator[tuple[str, dict]]:
+    """
+    Страницы одного list-вызова сразу для нескольких ресурсов (календарей, списков задач).
+    make_request(key, page_token) строит запрос. Первые страницы всех keys уходят
+    batch-запросами по BATCH_SIZE, продолжения (nextPageToken) — следующим раундом.
+    Отдаёт пары (key, страница), т.е. ответы разложены обратно по ресурсам.
+    Ошибка отдельного ресурса не роняет остальные, но попадает в cache_fallbacks()
+    как пропуск — дайджест пометит раздел неполным; если упало всё — пробрасываем.
+    Ключи из stop больше не дочитываются.
+    """
+    pending: list[tuple[str, str | None]] = [(key, None) for key in keys]
+    while pending:
+        next_round: list[tuple[str, str | None]] = []
+        for i in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[i:i + BATCH_SIZE]
+            requests = [make_request(key, token) for key, token in chunk]
+            if len(requests) == 1:
+                try:
+                    results = [_execute_cached(requests[0], max_age=max_age)]
+                except Exception as e:
+                    results = [e]
+            else:
+                results = _execute_batch(service, requests, max_age=max_age)
+
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors and len(errors) == len(results):
+                raise errors[0]
+            for (key, _), resp in zip(chunk, results):
+                if isinstance(resp, Exception):
+                    log.warning("[gcal] %s: пропускаем, ошибка %s", key, resp)
+                    _note_fallback(None)
+                    continue
+                yield key, resp
+                token = resp.get("nextPageToken")
+                if token and not (stop and key in stop):
+                    next_round.append((key, token))
+        pending = next_round
+
+
+def _iter_items_many(service, make_request, keys: List[str], *, max_age: float = 0,
+                     max_items: int = MAX_ITEMS) -> Iterator[dict]:
+    """Поток items для нескольких ресурсов через batch, не больше max_items на ресурс."""
+    counts = dict.fromkeys(keys, 0)
+    stop: set = set()
+    for key, resp in _iter_pages_many(service, make_request, keys, max_age=max_age, stop=stop):
+        if key in stop:
+            continue
+        for item in resp.get("items", []):
+            if counts[key] >= max_items:
+                print(f"[gcal] список {key} обрезан на {max_items} элементах")
+                stop.add(key)
+                break
+            counts[key] += 1
+            yield item
+
+
+def _sync_calendar_list(service, known: Dict[str, str], sync_token: str | None) -> tuple[Dict[str, str], str | None]:
+    """Полная (sync_token=None) или инкрементальная синхронизация списка календарей."""
+    result = dict(known)
+    resp: dict = {}
+    for resp in _iter_pages(
+        service.calendarList().list,
+        cached=False,
+        syncToken=sync_token,
+        maxResults=PAGE_SIZE_CALENDAR_LIST,
+        fields=FIELDS_CALENDAR_LIST,
+    ):
+        for item in resp.get("items", []):
+            cid = item.get("id")
+            if not cid:
+                continue
+            # в инкрементальном ответе приходят и удалённые/скрытые записи
+            if item.get("deleted") or item.get("hidden"):
+                result.pop(cid, None)
+            else:
+                result[cid] = item.get("summary", "")
+    return result, resp.get("nextSyncToken")
+
+
+def _list_calendars(service) -> Dict[str, str]:
+    """
+    Возвращает словарь {calendarId: summary} для всех календарей аккаунта.
+    Список хранится в кэше вместе с nextSyncToken: в пределах META_TTL
+    отдаём его без сети, дальше подтягиваем только изменения.
+    """
+    entry = gcal_cache.get(CALENDAR_LIST_KEY)
+    if entry and time.time() - entry.stored_at < META_TTL:
+        metrics.GCAL_CACHE_LOOKUPS.inc(result="fresh")
+        return dict(entry.payload)
+
+    sync_token = entry.sync_token if entry else None
+    known = entry.payload if entry and sync_token else {}
+    try:
+        result, next_sync = _sync_calendar_list(service, known, sync_token)
+    except Exception as e:
+        if entry and gcal_policy.is_transient(e):
+            print(f"[gcal] отдаём кэш списка календарей: {e}")
+            _served_stale(entry, e)
+            return dict(entry.payload)
+        # 410 Gone — токен протух, делаем полную синхронизацию
+        if _http_status(e) != 410 or not sync_token:
+            raise
+        result, next_sync = _sync_calendar_list(service, {}, None)
+    metrics.GCAL_CACHE_LOOKUPS.inc(result="synced")
+    gcal_cache.put(CALENDAR_LIST_KEY, result, sync_token=next_sync)
     return result
 
 
@@ -85,374 +493,284 @@ def _tasklist_id_by_name(service, target_name: str) -> str | None:
     if not target_name:
         return None
     target = target_name.strip().lower()
-    for lst in _list_tasklists(service):
+    for lst in _iter_tasklists(service):
         name = (lst.get("title") or "").strip().lower()
         if name == target:
             return lst.get("id")
     return None
 
-def _sort_key_for_event(e: dict, tz: ZoneInfo) -> datetime:
-    """Дата/время начала для сортировки."""
-    s = e.get("start", {})
-    s_raw = s.get("dateTime") or s.get("date")
-    if not s_raw:
-        return datetime.max.replace(tzinfo=tz)
-    if "T" in s_raw:
-        try:
-            return datetime.fromisoformat(s_raw.replace("Z", "+00:00")).astimezone(tz)
-        except Exception:
-            return datetime.max.replace(tzinfo=tz)
-    try:
-        d = date.fromisoformat(s_raw)
-        return datetime(d.year, d.month, d.day, 0, 0, tzinfo=tz)
-    except Exception:
-        return datetime.max.replace(tzinfo=tz)
+# --- Push-каналы Calendar (events.watch), логика продления — в gcal_push ---
+
+def effective_calendar_ids() -> List[str]:
+    return _effective_calendar_ids(_calendar_service())
 
 
-def _collect_events(service, calendar_ids: List[str], time_min_iso: str, time_max_iso: str) -> List[dict]:
-    items: List[dict] = []
-    for cid in calendar_ids:
-        resp = service.events().list(
+def watch_calendar(calendar_id: str, channel_id: str, address: str, token: str, ttl: int) -> dict:
+    """Открывает канал уведомлений об изменениях событий календаря."""
+    body = {"id": channel_id, "type": "web_hook", "address": address, "params": {"ttl": str(int(ttl))}}
+    if token:
+        body["token"] = token
+    return _run(_calendar_service().events().watch(calendarId=calendar_id, body=body))
+
+
+def stop_channel(channel_id: str, resource_id: str) -> None:
+    _run(_calendar_service().channels().stop(body={"id": channel_id, "resourceId": resource_id}))
+
+
+def invalidate_calendar(calendar_id: str) -> int:
+    """Сбрасывает закэшированные страницы events.list одного календаря (все окна)."""
+    # ключ кэша — URI запроса; префикс берём из того же построителя URI
+    uri = _calendar_service().events().list(calendarId=calendar_id).uri
+    return gcal_cache.invalidate(uri.split("?", 1)[0] + "?")
+
+
+def _iter_events(service, calendar_ids: List[str], time_min_iso: str, time_max_iso: str) -> Iterator[dict]:
+    """
+    События всех календарей окна — потоком, со всеми страницами, через batch.
+    Календари с живым push-каналом читаются из кэша (его сбросит уведомление),
+    остальные ревалидируются по ETag.
+    """
+    def _request(cid: str, page_token: str | None):
+        return service.events().list(
             calendarId=cid,
             timeMin=time_min_iso,
             timeMax=time_max_iso,
             singleEvents=True,
             orderBy="startTime",
-        ).execute()
-        items.extend(resp.get("items", []))
-    return items
-
-def _is_all_day_due(due: str) -> bool:
-    """
-    True, если due указывает на «целый день».
-    Правило: либо нет 'T' вообще (просто дата), либо время в UTC ровно 00:00:00.
-    """
-    try:
-        if "T" not in due:
-            return True
-        dt_utc = datetime.fromisoformat(due.replace("Z", "+00:00"))
-        return dt_utc.hour == 0 and dt_utc.minute == 0 and dt_utc.second == 0
-    except Exception:
-        return False
-
-
-def fetch_today_events(tz_name: str) -> List[str]:
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-    start = datetime(now.year, now.month, now.day, 0, 0, tzinfo=tz)
-    end = start + timedelta(days=1)
-
-    time_min = start.astimezone(ZoneInfo("UTC")).isoformat()
-    time_max = end.astimezone(ZoneInfo("UTC")).isoformat()
+            maxResults=PAGE_SIZE_EVENTS,
+            pageToken=page_token,
+            fields=FIELDS_EVENTS,
+        )
 
-    creds = _load_credentials()
-    service = build("calendar", "v3", credentials=creds)
+    watched = [cid for cid in calendar_ids if gcal_push.is_watched(cid)]
+    polled = [cid for cid in calendar_ids if cid not in watched]
+    if watched:
+        yield from _iter_items_many(service, _request, watched, max_age=gcal_push.PUSH_MAX_AGE)
+    if polled:
+        yield from _iter_items_many(service, _request, polled)
 
-    cids = _effective_calendar_ids(service)
-    items = _collect_events(service, cids, time_min, time_max)
-    items.sort(key=lambda e: _sort_key_for_event(e, tz))
 
-    out: List[str] = []
-    for e in items:
-        title = e.get("summary", "(без названия)")
-        start_raw = e["start"].get("dateTime") or e["start"].get("date")
-        end_raw = e["end"].get("dateTime") or e["end"].get("date")
+# --- Google Tasks ---
 
-        if start_raw and "T" in start_raw:
-            st = datetime.fromisoformat(start_raw.replace("Z", "+00:00")).astimezone(tz)
-            en = datetime.fromisoformat(end_raw.replace("Z", "+00:00")).astimezone(tz)
-            out.append(f"{st:%H:%M}–{en:%H:%M} {title}")
-        else:
-            out.append(f" {title}")
-    return out
+def _tasks_service():
+    return _service("tasks", "v1")
+
+def _iter_tasklists(service) -> Iterator[dict]:
+    return _iter_items(
+        service.tasklists().list,
+        max_age=META_TTL,
+        maxResults=PAGE_SIZE_TASKLISTS,
+        fields=FIELDS_TASKLISTS,
+    )
+
+def _iter_tasks_all(service, tasklist_ids: List[str], due_min: str | None = None,
+                    due_max: str | None = None) -> Iterator[dict]:
+    """Забираем невыполненные задачи из списков. dueMin/dueMax (если заданы) —
+    грубое окно на стороне Google, с запасом (см. _tasks_time_window_utc);
+    точную обрезку по локальному дню делает вызывающий — так надёжно с TZ
+    и разными форматами due. Списки запрашиваются пачкой через batch."""
+    def _request(tasklist_id: str, page_token: str | None):
+        return service.tasks().list(
+            tasklist=tasklist_id,
+            showCompleted=False,
+            showDeleted=False,
+            showHidden=False,
+            dueMin=due_min,
+            dueMax=due_max,
+            maxResults=PAGE_SIZE_TASKS,
+            pageToken=page_token,
+            fields=FIELDS_TASKS,
+        )
 
+    return _iter_items_many(service, _request, tasklist_ids)
 
-def fetch_events_next_days(tz_name: str, start_offset_days: int, end_offset_days: int) -> List[str]:
+def _tasks_time_window_utc(tz_name: str, start_day_offset: int, end_day_offset: int) -> tuple[str, str]:
     """
-    События календарей в окне [сегодня+start_offset_days, сегодня+end_offset_days] включительно.
+    Возвращает (dueMin, dueMax) в RFC3339 (UTC, с Z) для окна «сегодня+offset…»,
+    расширенные на TASKS_DUE_SLACK с каждой стороны: due «без времени» Google
+    хранит как 00:00 UTC, а локальный день сдвинут от UTC до ±14 ч — узкое
+    окно теряло бы такие задачи на краях. Лишнее отрезает локальный фильтр.
+    """
+    start_local = gcal_time.local_midnight(tz_name, start_day_offset) - TASKS_DUE_SLACK
+    end_local = gcal_time.local_midnight(tz_name, end_day_offset + 1) + TASKS_DUE_SLACK
+    return (gcal_time.utc_iso(start_local).replace("+00:00", "Z"),
+            gcal_time.utc_iso(end_local).replace("+00:00", "Z"))
+
+
+# --- Единый конвейер выборки ---
+#
+# Все fetch_* собраны из одних стадий:
+#   источник (все календари / один по имени, все списки / один) → окно
+#   → поток страниц (batch + gcal_cache) → разбор времени (gcal_time, с кэшем)
+#   → фильтр по окну → выходная стадия (строки для текста или DigestItem).
+# Выходная стадия — функция строки _Row -> (ключ сортировки, значение) или None.
+
+class _Row(NamedTuple):
+    raw: dict                        # событие или задача как пришли из API
+    start: gcal_time.Stamp | None    # начало события / due задачи
+    end: gcal_time.Stamp | None      # конец события (у задач None)
+
+
+def _window(tz_name: str, start_offset_days: int, end_offset_days: int) -> tuple[str, str]:
+    """[сегодня+start, сегодня+end+1) в UTC ISO — timeMin/timeMax для events.list."""
+    start = gcal_time.local_midnight(tz_name, start_offset_days)
+    end_next = gcal_time.local_midnight(tz_name, end_offset_days + 1)
+    return gcal_time.utc_iso(start), gcal_time.utc_iso(end_next)
+
+
+def _event_rows(tz_name: str, start_offset_days: int, end_offset_days: int,
+                calendar_name: str | None = None) -> Iterator[_Row]:
+    """События окна; calendar_name=None — все используемые календари, иначе один по имени."""
+    service = _calendar_service()
+    if calendar_name is None:
+        cids = _effective_calendar_ids(service)
+    else:
+        cid = _calendar_id_by_name(service, calendar_name)
+        cids = [cid] if cid else []
+    if not cids:
+        return
+    for e in _iter_events(service, cids, *_window(tz_name, start_offset_days, end_offset_days)):
+        start, end = e.get("start", {}), e.get("end", {})
+        s_raw = start.get("dateTime") or start.get("date")
+        e_raw = end.get("dateTime") or end.get("date")
+        yield _Row(e,
+                   gcal_time.event_time(s_raw, tz_name) if s_raw else None,
+                   gcal_time.event_time(e_raw, tz_name) if e_raw else None)
+
+
+def _task_rows(tz_name: str, start_offset_days: int, end_offset_days: int,
+               list_name: str | None = None) -> Iterator[_Row]:
+    """
+    Невыполненные задачи, чей due (в локальном дне) попадает в окно включительно;
+    list_name=None — все списки, иначе один по имени.
     """
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-    day0 = datetime(now.year, now.month, now.day, 0, 0, tzinfo=tz)
-
-    start = day0 + timedelta(days=start_offset_days)
-    end_next = day0 + timedelta(days=end_offset_days + 1)
-
-    time_min = start.astimezone(ZoneInfo("UTC")).isoformat()
-    time_max = end_next.astimezone(ZoneInfo("UTC")).isoformat()
-
-    creds = _load_credentials()
-    service = build("calendar", "v3", credentials=creds)
-
-    cids = _effective_calendar_ids(service)
-    items = _collect_events(service, cids, time_min, time_max)
-    items.sort(key=lambda e: _sort_key_for_event(e, tz))
-
-    out: List[str] = []
-    for e in items:
-        title = e.get("summary", "(без названия)")
-        start_raw = e["start"].get("dateTime") or e["start"].get("date")
-        end_raw = e["end"].get("dateTime") or e["end"].get("date")
-
-        if start_raw and "T" in start_raw:
-            st = datetime.fromisoformat(start_raw.replace("Z", "+00:00")).astimezone(tz)
-            en = datetime.fromisoformat(end_raw.replace("Z", "+00:00")).astimezone(tz)
-            out.append(f"{st:%d.%m} {st:%H:%M}–{en:%H:%M} {title}")
-        else:
-            try:
-                d = date.fromisoformat(start_raw) if start_raw else None
-                if d:
-                    out.append(f"{d:%d.%m} {title}")
-                else:
-                    out.append(f" {title}")
-            except Exception:
-                out.append(f" {title}")
-    return out
-
-def fetch_events_struct(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[dict]:
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-    day0 = datetime(now.year, now.month, now.day, 0, 0, tzinfo=tz)
-    start, end_next = day0 + timedelta(days=start_offset_days), day0 + timedelta(days=end_offset_days + 1)
-    service = build("calendar", "v3", credentials=_load_credentials())
-    cids = _effective_calendar_ids(service)
-    items = _collect_events(service, cids, start.astimezone(ZoneInfo("UTC")).isoformat(), end_next.astimezone(ZoneInfo("UTC")).isoformat())
-    items.sort(key=lambda e: _sort_key_for_event(e, tz))
-    out = []
-    for e in items:
-        title = (e.get("summary") or "(без названия)").strip()
-        s = e["start"].get("dateTime") or e["start"].get("date")
-        if s and "T" in s:
-            st = datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(tz)
-            out.append({"date": st.date(), "title": title, "time": st.strftime("%H:%M")})
-        else:
-            d = date.fromisoformat(s) if s else None
-            if d:
-                out.append({"date": d, "title": title, "time": ""})
-    return out
-
-def fetch_tasks_struct(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[dict]:
-    tz = ZoneInfo(tz_name)
-    today = datetime.now(tz).date()
-    start_day, end_day = today + timedelta(days=start_offset_days), today + timedelta(days=end_offset_days)
     service = _tasks_service()
+    if list_name is None:
+        tasklist_ids = [lst["id"] for lst in _iter_tasklists(service)]
+    else:
+        tid = _tasklist_id_by_name(service, list_name)
+        tasklist_ids = [tid] if tid else []
+    if not tasklist_ids:
+        return
+    due_min, due_max = _tasks_time_window_utc(tz_name, start_offset_days, end_offset_days)
+    today = gcal_time.local_midnight(tz_name).date().toordinal()
+    lo, hi = today + start_offset_days, today + end_offset_days
+    for t in _iter_tasks_all(service, tasklist_ids, due_min, due_max):
+        due_raw = t.get("due")
+        st = gcal_time.task_due(due_raw, tz_name) if due_raw else None
+        if st is not None and lo <= st.ordinal <= hi:
+            yield _Row(t, st, None)
+
+
+def _collect(rows: Iterable[_Row], stage) -> list:
+    """Прогоняет поток через выходную стадию и сортирует по её ключу."""
     out = []
+    for row in rows:
+        res = stage(row)
+        if res is not None:
+            out.append(res)
+    out.sort(key=itemgetter(0))
+    return [value for _, value in out]
 
-    for lst in _list_tasklists(service):
-        tasks = _list_tasks_all(service, lst["id"])
-        tasks = _filter_tasks_by_window(tasks, tz, start_day, end_day)
 
-        for t in tasks:
-            title = (t.get("title") or "").strip() or "(без названия)"
-            due = t.get("due")
-            if not due:
-                continue
+def _start_key(st: gcal_time.Stamp | None) -> int:
+    return st.key if st else gcal_time.KEY_MAX
 
-            try:
-                # 1) Без 'T' -> просто дата (целый день)
-                if "T" not in due:
-                    d = date.fromisoformat(due)
-                    out.append({"date": d, "title": title, "time": ""})
-                    continue
 
-                # 2) Есть 'T' -> парсим как UTC и переводим в локаль
-                dt_utc = datetime.fromisoformat(due.replace("Z", "+00:00"))
-
-                # Если время ровно 00:00:00 UTC — трактуем как целодневную задачу (без времени)
-                if dt_utc.hour == 0 and dt_utc.minute == 0 and dt_utc.second == 0:
-                    d_local = dt_utc.astimezone(tz).date()
-                    out.append({"date": d_local, "title": title, "time": ""})
-                else:
-                    dt_local = dt_utc.astimezone(tz)
-                    out.append({"date": dt_local.date(), "title": title, "time": dt_local.strftime("%H:%M")})
-            except Exception:
-                # Если что-то пошло не так с парсингом — пропускаем такую задачу
-                continue
+# выходные стадии
 
-    return sorted(out, key=lambda x: (x["date"], x["time"] or "99:99"))
+def _event_line(row: _Row):
+    """«HH:MM–HH:MM Название» или « Название» для целого дня."""
+    st, en = row.start, row.end
+    title = row.raw.get("summary", "(без названия)")
+    if st and not st.all_day:
+        return _start_key(st), f"{st.hhmm}–{en.hhmm if en else ''} {title}"
+    return _start_key(st), f" {title}"
 
 
-# --- Google Tasks ---
+def _event_dated_line(row: _Row):
+    """«дд.мм HH:MM–HH:MM Название» / «дд.мм Название»."""
+    st, en = row.start, row.end
+    title = row.raw.get("summary", "(без названия)")
+    if st and not st.all_day:
+        return _start_key(st), f"{st.date:%d.%m} {st.hhmm}–{en.hhmm if en else ''} {title}"
+    if st:
+        return _start_key(st), f"{st.date:%d.%m} {title}"
+    return _start_key(st), f" {title}"
 
-def _tasks_service():
-    creds = _load_credentials()
-    return build("tasks", "v1", credentials=creds)
 
-def _list_tasklists(service) -> list[dict]:
-    items = []
-    page_token = None
-    while True:
-        resp = service.tasklists().list(maxResults=100, pageToken=page_token).execute()
-        items.extend(resp.get("items", []))
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
-    return items
+def _event_item(row: _Row):
+    if row.start is None:
+        return None
+    item = gcal_time.digest_item(row.start, (row.raw.get("summary") or "(без названия)").strip())
+    return item.key, item
 
-def _list_tasks_all(service, tasklist_id: str) -> list[dict]:
-    """Забираем все невыполненные задачи из списка (без dueMin/dueMax),
-    дальше фильтруем сами — так надёжнее с TZ и разными форматами due."""
-    items = []
-    page_token = None
-    while True:
-        resp = service.tasks().list(
-            tasklist=tasklist_id,
-            showCompleted=False,
-            showDeleted=False,
-            showHidden=False,
-            maxResults=100,
-            pageToken=page_token,
-        ).execute()
-        items.extend(resp.get("items", []))
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
-    return items
 
-def _filter_tasks_by_window(tasks: list[dict], tz: ZoneInfo, start_local_day: date, end_local_day: date) -> list[dict]:
-    """Оставляем задачи, чей due-переведённый-в-локаль день попадает в [start..end] включительно."""
-    kept = []
-    for t in tasks:
-        due_raw = t.get("due")
-        if not due_raw:
-            continue
-        try:
-            if "T" in due_raw:
-                # RFC3339 c временем — переводим в TZ и берём .date()
-                dt = datetime.fromisoformat(due_raw.replace("Z", "+00:00")).astimezone(tz)
-                d = dt.date()
-            else:
-                # Только дата
-                d = date.fromisoformat(due_raw)
-        except Exception:
-            continue
-        if start_local_day <= d <= end_local_day:
-            kept.append(t)
-    return kept
+def _task_title(t: dict) -> str:
+    return (t.get("title") or "").strip() or "(без названия)"
 
 
-def _format_tasks_lines(tasks: list[dict], tz: ZoneInfo) -> list[str]:
+def _task_line(row: _Row):
     """
-    Делает «красивые» строки по образцу календаря:
+    Строки по образцу календаря, по порядку дат:
       • 07.11 14:30 [Задача] Название
       • 07.11 [Задача] Название
     """
-    out: list[str] = []
-    for t in tasks:
-        title = (t.get("title") or "").strip() or "(без названия)"
-        due_raw = t.get("due")
-        if not due_raw:
-            continue
-        try:
-            if _is_all_day_due(due_raw):
-                # день без времени
-                if "T" in due_raw:
-                    d = datetime.fromisoformat(due_raw.replace("Z", "+00:00")).astimezone(tz).date()
-                else:
-                    d = date.fromisoformat(due_raw)
-                out.append(f"{d:%d.%m} [Задача] {title}")
-            else:
-                dt = datetime.fromisoformat(due_raw.replace("Z", "+00:00")).astimezone(tz)
-                out.append(f"{dt:%d.%m} {dt:%H:%M} [Задача] {title}")
-        except Exception:
-            out.append(f"[Задача] {title}")
-    return out
+    st = row.start
+    if st.all_day:
+        line = f"{st.date:%d.%m} [Задача] {_task_title(row.raw)}"
+    else:
+        line = f"{st.date:%d.%m} {st.hhmm} [Задача] {_task_title(row.raw)}"
+    return (st.day_end_key, line), line
 
 
-def _tasks_time_window_utc(tz_name: str, start_day_offset: int, end_day_offset: int) -> tuple[str, str]:
+def _task_item(row: _Row):
+    """Элемент дайджеста: по дню, внутри дня — со временем раньше целодневных."""
+    item = gcal_time.digest_item(row.start, _task_title(row.raw))
+    return item.key, item
+
+
+# --- публичные выборки ---
+
+@tracing.traced()
+def fetch_today_events(tz_name: str) -> List[str]:
+    return _collect(_event_rows(tz_name, 0, 0), _event_line)
+
+
+@tracing.traced()
+def fetch_events_next_days(tz_name: str, start_offset_days: int, end_offset_days: int) -> List[str]:
     """
-    Возвращает (dueMin, dueMax) в RFC3339 (UTC, с Z) для окна «сегодня+offset…».
+    События календарей в окне [сегодня+start_offset_days, сегодня+end_offset_days] включительно.
     """
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-    start_local = datetime(now.year, now.month, now.day, 0, 0, 0, tzinfo=tz) + timedelta(days=start_day_offset)
-    end_local   = datetime(now.year, now.month, now.day, 0, 0, 0, tzinfo=tz) + timedelta(days=end_day_offset + 1)
-    start_utc = start_local.astimezone(ZoneInfo("UTC")).isoformat().replace("+00:00", "Z")
-    end_utc   = end_local.astimezone(ZoneInfo("UTC")).isoformat().replace("+00:00", "Z")
-    return start_utc, end_utc
+    return _collect(_event_rows(tz_name, start_offset_days, end_offset_days), _event_dated_line)
+
+
+@tracing.traced()
+def fetch_events_struct(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[gcal_time.DigestItem]:
+    return _collect(_event_rows(tz_name, start_offset_days, end_offset_days), _event_item)
+
 
+@tracing.traced()
+def fetch_events_struct_for_calendar(tz_name: str, start_offset_days: int, end_offset_days: int, calendar_name: str) -> list[gcal_time.DigestItem]:
+    rows = _event_rows(tz_name, start_offset_days, end_offset_days, calendar_name=calendar_name or "")
+    return _collect(rows, _event_item)
+
+
+@tracing.traced()
 def fetch_tasks_today(tz_name: str) -> list[str]:
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz).date()
-    service = _tasks_service()
-    lines: list[str] = []
-    for lst in _list_tasklists(service):
-        tasks = _list_tasks_all(service, lst["id"])
-        tasks = _filter_tasks_by_window(tasks, tz, now, now)
-        lines.extend(_format_tasks_lines(tasks, tz))
-    return sorted(lines)
+    return _collect(_task_rows(tz_name, 0, 0), _task_line)
 
-def fetch_tasks_next_days(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[str]:
-    tz = ZoneInfo(tz_name)
-    today = datetime.now(tz).date()
-    start_day = today + timedelta(days=start_offset_days)
-    end_day   = today + timedelta(days=end_offset_days)
-    service = _tasks_service()
-    lines: list[str] = []
-    for lst in _list_tasklists(service):
-        tasks = _list_tasks_all(service, lst["id"])
-        tasks = _filter_tasks_by_window(tasks, tz, start_day, end_day)
-        lines.extend(_format_tasks_lines(tasks, tz))
-    return sorted(lines)
-
-def fetch_events_struct_for_calendar(tz_name: str, start_offset_days: int, end_offset_days: int, calendar_name: str) -> list[dict]:
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-    day0 = datetime(now.year, now.month, now.day, 0, 0, tzinfo=tz)
-    start, end_next = day0 + timedelta(days=start_offset_days), day0 + timedelta(days=end_offset_days + 1)
-
-    service = build("calendar", "v3", credentials=_load_credentials())
-    cid = _calendar_id_by_name(service, calendar_name)
-    if not cid:
-        return []
-
-    items = _collect_events(service, [cid], start.astimezone(ZoneInfo("UTC")).isoformat(),
-                            end_next.astimezone(ZoneInfo("UTC")).isoformat())
-    items.sort(key=lambda e: _sort_key_for_event(e, tz))
 
-    out = []
-    for e in items:
-        title = (e.get("summary") or "(без названия)").strip()
-        s = e["start"].get("dateTime") or e["start"].get("date")
-        if s and "T" in s:
-            st = datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(tz)
-            out.append({"date": st.date(), "title": title, "time": st.strftime("%H:%M")})
-        else:
-            d = date.fromisoformat(s) if s else None
-            if d:
-                out.append({"date": d, "title": title, "time": ""})
-    return out
-
-def fetch_tasks_struct_for_list(tz_name: str, start_offset_days: int, end_offset_days: int, list_name: str) -> list[dict]:
-    tz = ZoneInfo(tz_name)
-    today = datetime.now(tz).date()
-    start_day, end_day = today + timedelta(days=start_offset_days), today + timedelta(days=end_offset_days)
+@tracing.traced()
+def fetch_tasks_next_days(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[str]:
+    return _collect(_task_rows(tz_name, start_offset_days, end_offset_days), _task_line)
 
-    service = _tasks_service()
-    tid = _tasklist_id_by_name(service, list_name)
-    if not tid:
-        return []
 
-    tasks = _list_tasks_all(service, tid)
-    tasks = _filter_tasks_by_window(tasks, tz, start_day, end_day)
+@tracing.traced()
+def fetch_tasks_struct(tz_name: str, start_offset_days: int, end_offset_days: int) -> list[gcal_time.DigestItem]:
+    return _collect(_task_rows(tz_name, start_offset_days, end_offset_days), _task_item)
 
-    out = []
-    for t in tasks:
-        title = (t.get("title") or "").strip() or "(без названия)"
-        due = t.get("due")
-        if not due:
-            continue
 
-        if _is_all_day_due(due):
-            # целодневная задача: дата без времени
-            if "T" in due:
-                d = datetime.fromisoformat(due.replace("Z", "+00:00")).astimezone(tz).date()
-            else:
-                d = date.fromisoformat(due)
-            out.append({"date": d, "title": title, "time": ""})
-        else:
-            # задача со временем
-            dt = datetime.fromisoformat(due.replace("Z", "+00:00")).astimezone(tz)
-            out.append({"date": dt.date(), "title": title, "time": dt.strftime("%H:%M")})
-
-    return sorted(out, key=lambda x: (x["date"], x["time"] or "99:99"))
\ No newline at end of file
+@tracing.traced()
+def fetch_tasks_struct_for_list(tz_name: str, start_offset_days: int, end_offset_days: int, list_name: str) -> list[gcal_time.DigestItem]:
+    return _collect(_task_rows(tz_name, start_offset_days, end_offset_days, list_name=list_name or ""), _task_item)
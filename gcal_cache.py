@@ -0,0 +1,134 @@
+"""
+Персистентный кэш ответов Google Calendar/Tasks.
+
+Хранится в отдельном SQLite-файле GCAL_CACHE_PATH (gcal_cache.sqlite3) и переживает рестарты
+процесса (redeploy). Это кэш, а не общее состояние (shared_state): записи можно
+вытеснить или сбросить в любой момент — всё нужное перечитается из Google.
+Воркеры одного хоста открывают один и тот же файл, поэтому сброс виден всем. Соединение открывается лениво — при первом обращении.
+Записи сжимаются zlib, объём ограничен по количеству и байтам,
+при переполнении вытесняются давно не использованные (LRU).
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+import metrics
+
+CACHE_PATH = Path(os.getenv("GCAL_CACHE_PATH", "gcal_cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("GCAL_CACHE_MAX_ENTRIES", "2000"))
+CACHE_MAX_BYTES = int(os.getenv("GCAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+class CacheEntry(NamedTuple):
+    payload: dict
+    etag: str | None
+    sync_token: str | None
+    stored_at: float
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(str(CACHE_PATH), check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " sync_token TEXT,"
+            " payload BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_used_at ON entries(used_at)")
+        _conn = conn
+    return _conn
+
+
+def get(key: str) -> CacheEntry | None:
+    with _lock:
+        db = _db()
+        row = db.execute(
+            "SELECT payload, etag, sync_token, stored_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (time.time(), key))
+    try:
+        payload = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+    except Exception:
+        # битая запись — считаем промахом
+        return None
+    return CacheEntry(payload, row[1], row[2], row[3])
+
+
+def put(key: str, payload: dict, *, etag: str | None = None, sync_token: str | None = None) -> None:
+    blob = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, etag, sync_token, payload, size, stored_at, used_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, etag, sync_token, blob, len(blob), now, now),
+        )
+        _evict(db)
+
+
+def touch(key: str) -> None:
+    """Продлевает свежесть записи (например, после ответа 304 Not Modified)."""
+    with _lock:
+        now = time.time()
+        _db().execute("UPDATE entries SET stored_at = ?, used_at = ? WHERE key = ?", (now, now, key))
+
+
+def invalidate(prefix: str = "") -> int:
+    """Удаляет записи, чей ключ начинается с prefix (пустой prefix — всё)."""
+    with _lock:
+        cur = _db().execute("DELETE FROM entries WHERE key LIKE ? ESCAPE '\\'", (_like_prefix(prefix),))
+        return cur.rowcount
+
+
+def stats() -> dict:
+    with _lock:
+        count, size = _db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    return {"entries": count, "bytes": size}
+
+
+def _stats_gauge() -> dict:
+    # не открываем файл кэша ради метрик, если им ещё никто не пользовался
+    if _conn is None:
+        return {}
+    return {(("stat", k),): v for k, v in stats().items()}
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _evict(db: sqlite3.Connection) -> None:
+    """Вытесняет самые старые по использованию записи, пока не влезем в лимиты."""
+    count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    if count <= CACHE_MAX_ENTRIES and size <= CACHE_MAX_BYTES:
+        return
+    for key, item_size in db.execute("SELECT key, size FROM entries ORDER BY used_at ASC").fetchall():
+        if count <= CACHE_MAX_ENTRIES and size <= CACHE_MAX_BYTES:
+            break
+        db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        count -= 1
+        size -= item_size
+
+
+metrics.Gauge("organizer_gcal_cache", "Персистентный кэш Google: entries, bytes", _stats_gauge)
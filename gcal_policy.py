@@ -0,0 +1,193 @@
+"""
+Политика вызовов Google: дедлайны, повторы с джиттером и circuit breaker.
+
+• Каждый вызов укладывается в дедлайн (GCAL_CALL_DEADLINE), а вокруг целого
+  дайджеста можно задать общий бюджет через `with deadline(секунды):`.
+• 429/5xx, 403 rateLimitExceeded/userRateLimitExceeded и сетевые сбои повторяются с экспоненциальной задержкой
+  (full jitter), не дольше оставшегося дедлайна; Retry-After учитывается.
+• После GCAL_BREAKER_THRESHOLD неудач подряд breaker открывается на
+  GCAL_BREAKER_COOLDOWN секунд: вызовы сразу падают с GoogleUnavailable,
+  а calendar_source в этом случае отдаёт последние данные из кэша.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+CALL_DEADLINE = float(os.getenv("GCAL_CALL_DEADLINE", "20"))
+MAX_ATTEMPTS = max(1, int(os.getenv("GCAL_MAX_ATTEMPTS", "4")))
+BACKOFF_BASE = float(os.getenv("GCAL_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("GCAL_BACKOFF_MAX", "8"))
+BREAKER_THRESHOLD = max(1, int(os.getenv("GCAL_BREAKER_THRESHOLD", "5")))
+BREAKER_COOLDOWN = float(os.getenv("GCAL_BREAKER_COOLDOWN", "60"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# 403 с такими reason (домен usageLimits) — тот же 429: Google ограничивает темп, а не доступ
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class GoogleUnavailable(RuntimeError):
+    """Google сейчас не опрашиваем: открыт breaker или вышел дедлайн."""
+
+
+class CircuitBreaker:
+    """closed → (threshold неудач) → open → (cooldown) → half-open: одна пробная попытка."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+metrics.Gauge(
+    "organizer_google_breaker_state",
+    "Circuit breaker Google: 1 для текущего состояния",
+    lambda: {(("state", breaker.state),): 1},
+)
+_local = threading.local()
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Общий бюджет времени на все вызовы Google внутри блока (в этом потоке)."""
+    prev = getattr(_local, "deadline", None)
+    new = time.monotonic() + seconds
+    _local.deadline = new if prev is None else min(prev, new)
+    try:
+        yield
+    finally:
+        _local.deadline = prev
+
+
+def remaining() -> float:
+    """Сколько секунд осталось на очередной вызов с учётом общего бюджета."""
+    left = CALL_DEADLINE
+    outer = getattr(_local, "deadline", None)
+    if outer is not None:
+        left = min(left, outer - time.monotonic())
+    return left
+
+
+def _status(exc: Exception) -> int | None:
+    # HttpError googleapiclient хранит ответ httplib2 в .resp
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+
+def _reasons(exc: Exception) -> set[str]:
+    # тело HttpError: {"error": {"errors": [{"domain": "usageLimits", "reason": ...}], ...}}
+    try:
+        errors = json.loads(getattr(exc, "content", None))["error"].get("errors", [])
+        return {e.get("reason") for e in errors}
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return set()
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    """Google просит сбавить темп: 429 или 403 rateLimitExceeded/userRateLimitExceeded."""
+    status = _status(exc)
+    return status == 429 or (status == 403 and bool(_reasons(exc) & RATE_LIMIT_REASONS))
+
+
+def is_transient(exc: Exception) -> bool:
+    """Временный сбой, при котором имеет смысл повторить или отдать кэш."""
+    if isinstance(exc, (GoogleUnavailable, TimeoutError, OSError)):
+        return True
+    status = _status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or is_rate_limited(exc)
+    # httplib2 (ServerNotFoundError и пр.) — сетевые ошибки без HTTP-статуса
+    return type(exc).__module__.startswith("httplib2")
+
+
+def _retry_after(exc: Exception) -> float:
+    resp = getattr(exc, "resp", None)
+    try:
+        return float(resp.get("retry-after", 0)) if resp is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def call(attempt: Callable[[float], T]) -> T:
+    """
+    Выполняет attempt(timeout) по политике: дедлайн, повторы, breaker.
+    attempt получает оставшееся время в секундах — его стоит отдать как таймаут сокета.
+    """
+    budget = remaining()
+    if budget <= 0:
+        # общий бюджет исчерпан — Google тут ни при чём, breaker не трогаем
+        raise GoogleUnavailable("Исчерпан бюджет времени на запросы к Google")
+    if not breaker.allow():
+        raise GoogleUnavailable("Google временно недоступен (circuit breaker открыт)")
+
+    end = time.monotonic() + budget
+    tries = 0
+    while True:
+        left = end - time.monotonic()
+        if left <= 0:
+            breaker.record_failure()
+            raise GoogleUnavailable("Истёк дедлайн запроса к Google")
+        try:
+            result = attempt(left)
+        except Exception as e:
+            if not is_transient(e):
+                # 304/4xx — Google ответил, сервис жив; прочее считаем сбоем
+                if _status(e) is not None:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                raise
+            tries += 1
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (tries - 1)))
+            delay = max(delay, _retry_after(e))
+            if tries >= MAX_ATTEMPTS or time.monotonic() + delay >= end:
+                breaker.record_failure()
+                raise
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
@@ -0,0 +1,156 @@
+"""
+Push-уведомления Google Calendar (events.watch) вместо опроса на каждый клик.
+
+На каждый используемый календарь заводится канал: Google шлёт POST на
+GCAL_PUSH_ADDRESS, когда в календаре что-то меняется. Пока канал жив,
+события этого календаря отдаются из кэша без похода в Google (не дольше
+GCAL_PUSH_MAX_AGE — страховка на потерянные уведомления), а уведомление
+сбрасывает кэш только этого календаря. Новый канал тоже сбрасывает кэш
+календаря: записи, полученные до подписки, могли пропустить изменения,
+о которых уведомлений уже не будет. Каналы живут GCAL_PUSH_TTL и
+продлеваются заранее фоновой задачей; реестр каналов лежит в shared_state
+(не в gcal_cache: оттуда его могли бы вытеснить, и живые каналы потерялись бы)
+и переживает рестарты. Google Tasks push не поддерживает — задачи по-прежнему
+ревалидируются по ETag.
+
+У каждого канала свой случайный токен (X-Goog-Channel-Token), он хранится
+в реестре; уведомление без верного токена отклоняется, а с выключенным push
+маршрут отвечает 404 — иначе поддельные POST сбрасывали бы кэш.
+
+Уведомление может прийти на любой воркер: реестр читается из shared_state
+при каждом обращении, а кэш, который сбрасывается, — общий файл gcal_cache,
+его видят все процессы хоста.
+"""
+from __future__ import annotations
+
+import os
+import time
+import uuid
+import secrets
+
+import metrics
+import shared_state
+
+ADDRESS = os.getenv("GCAL_PUSH_ADDRESS", "")  # публичный HTTPS-адрес маршрута NOTIFY_PATH
+NOTIFY_PATH = os.getenv("GCAL_PUSH_PATH", "/gcal/notify")
+CHANNEL_TTL = int(os.getenv("GCAL_PUSH_TTL", str(7 * 24 * 3600)))
+RENEW_BEFORE = int(os.getenv("GCAL_PUSH_RENEW_BEFORE", str(6 * 3600)))
+RENEW_INTERVAL = int(os.getenv("GCAL_PUSH_RENEW_INTERVAL", "3600"))
+PUSH_MAX_AGE = int(os.getenv("GCAL_PUSH_MAX_AGE", str(6 * 3600)))
+
+ENABLED = bool(ADDRESS)
+REGISTRY_KEY = "push:channels"
+
+
+def _registry() -> dict[str, dict]:
+    """
+    calendarId -> {"id", "resource_id", "expiration", "token"}. Читается из shared_state
+    при каждом обращении: каналы продлевает один инстанс (аренда gcal_push_renew),
+    а уведомления и выборки приходят на любой.
+    """
+    return shared_state.backend().get(REGISTRY_KEY) or {}
+
+
+def is_watched(calendar_id: str) -> bool:
+    """Есть ли живой канал: тогда кэш событий календаря считаем актуальным."""
+    if not ENABLED:
+        return False
+    channel = _registry().get(calendar_id)
+    return bool(channel) and channel["expiration"] > time.time()
+
+
+def ensure_channels() -> dict:
+    """
+    Заводит каналы для всех используемых календарей и продлевает те, что истекут
+    в ближайшие RENEW_BEFORE секунд; каналы выбывших календарей останавливает.
+    Блокирующая (ходит в Google) — из async-кода вызывать через executor.
+    """
+    import calendar_source
+
+    if not ENABLED:
+        return {}
+    wanted = set(calendar_source.effective_calendar_ids())
+    now = time.time()
+    counts = {"created": 0, "renewed": 0, "stopped": 0, "failed": 0}
+    current = _registry()
+    newly_watched: list[str] = []
+
+    for cid in sorted(wanted):
+        old = current.get(cid)
+        if old and old["expiration"] - now > RENEW_BEFORE:
+            continue
+        token = secrets.token_urlsafe(32)
+        try:
+            resp = calendar_source.watch_calendar(cid, str(uuid.uuid4()), ADDRESS, token, CHANNEL_TTL)
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"[push] не удалось подписаться на {cid}: {e}")
+            continue
+        current[cid] = {
+            "id": resp["id"],
+            "resource_id": resp.get("resourceId", ""),
+            "expiration": int(resp.get("expiration", (now + CHANNEL_TTL) * 1000)) / 1000,
+            "token": token,
+        }
+        counts["renewed" if old else "created"] += 1
+        if old:
+            _stop_quietly(old)
+        if not old or old["expiration"] <= now:
+            newly_watched.append(cid)
+
+    for cid in set(current) - wanted:
+        _stop_quietly(current.pop(cid))
+        counts["stopped"] += 1
+
+    shared_state.backend().set(REGISTRY_KEY, current)
+    # кэш до подписки не прикрыт уведомлениями — иначе он считался бы свежим PUSH_MAX_AGE
+    for cid in newly_watched:
+        calendar_source.invalidate_calendar(cid)
+    if any(counts.values()):
+        print(f"[push] каналы: {counts}")
+    return counts
+
+
+def _stop_quietly(channel: dict) -> None:
+    import calendar_source
+
+    try:
+        calendar_source.stop_channel(channel["id"], channel["resource_id"])
+    except Exception as e:
+        # канал всё равно истечёт сам
+        print(f"[push] не удалось остановить канал {channel['id']}: {e}")
+
+
+def check_token(channel_id: str, token: str | None, resource_state: str) -> bool:
+    """
+    Токен уведомления совпадает с токеном канала из реестра. sync пропускаем
+    без проверки: он может прийти раньше, чем канал попадёт в реестр,
+    и ничего не сбрасывает.
+    """
+    if resource_state == "sync":
+        return True
+    channel = next((ch for ch in _registry().values() if ch["id"] == channel_id), None)
+    if channel is None:
+        return False
+    return secrets.compare_digest((token or "").encode(), channel["token"].encode())
+
+
+def handle_notification(channel_id: str, resource_state: str) -> str | None:
+    """
+    Обрабатывает уведомление Google. Возвращает calendarId, чей кэш сброшен,
+    или None (sync-подтверждение канала, чужой/устаревший канал).
+    """
+    import calendar_source
+
+    metrics.GCAL_PUSH_NOTIFICATIONS.inc(state=resource_state or "unknown")
+    if resource_state == "sync":
+        # первое сообщение канала: подписка подтверждена (может прийти раньше,
+        # чем ensure_channels сохранит канал в реестр)
+        return None
+    cid = next((c for c, ch in _registry().items() if ch["id"] == channel_id), None)
+    if cid is None:
+        print(f"[push] уведомление по неизвестному каналу {channel_id}")
+        return None
+    dropped = calendar_source.invalidate_calendar(cid)
+    print(f"[push] {cid}: {resource_state}, сброшено записей кэша: {dropped}")
+    return cid
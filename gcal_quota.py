@@ -0,0 +1,205 @@
+"""
+Учёт квоты Google API и адаптивное ограничение темпа запросов.
+
+• Каждый HTTP-запрос к Calendar/Tasks (элемент batch — тоже отдельный запрос,
+  так его считает и Google) списывает токен из общего для всех потоков
+  token bucket: GCAL_QUOTA_PER_MINUTE в минуту, всплеск до GCAL_QUOTA_BURST.
+  Нет токена — ждём, но не дольше GCAL_QUOTA_MAX_WAIT и оставшегося дедлайна
+  gcal_policy; не дождались — QuotaExhausted, и calendar_source отдаёт кэш.
+• Ответ 429 (или 403 rateLimitExceeded) вдвое снижает темп (не ниже
+  GCAL_QUOTA_MIN_SHARE от заданного); обратно к полному он растёт линейно
+  со временем — от минимума до 100% за GCAL_QUOTA_RECOVERY секунд.
+• Кэш вместо Google — только когда токена так и не дождались: разделы
+  дайджеста из такого кэша помечаются как не успевшие обновиться.
+  Всплеска по умолчанию хватает на полный дайджест (~30 календарей и
+  10 списков задач), чтобы одна сборка не упиралась в собственный лимит.
+• Запросы считаются по методам API поминутно за последний час — см. report()
+  и команду /quota.
+
+Квота Google считается на пользователя по всем процессам, а ведро — своё у
+каждого процесса: при нескольких воркерах делите GCAL_QUOTA_PER_MINUTE на их число.
+"""
+from __future__ import annotations
+
+import os
+import time
+import threading
+from collections import Counter, deque
+from typing import Iterable
+
+import metrics
+import gcal_policy
+
+QUOTA_PER_MINUTE = max(1.0, float(os.getenv("GCAL_QUOTA_PER_MINUTE", "300")))
+# Не меньше запросов одного дайджеста: 3 окна × (календари + списки задач) + метаданные
+QUOTA_BURST = max(1.0, float(os.getenv("GCAL_QUOTA_BURST", "200")))
+MAX_WAIT = float(os.getenv("GCAL_QUOTA_MAX_WAIT", "5"))
+MIN_SHARE = min(1.0, max(0.01, float(os.getenv("GCAL_QUOTA_MIN_SHARE", "0.1"))))
+# За сколько секунд темп возвращается с минимума до полного после 429
+RECOVERY_SECONDS = max(1.0, float(os.getenv("GCAL_QUOTA_RECOVERY", "300")))
+
+HISTORY_MINUTES = 60
+
+
+class QuotaExhausted(gcal_policy.GoogleUnavailable):
+    """Свой лимит запросов к Google исчерпан — вместо сети отдаём кэш."""
+
+
+class TokenBucket:
+    """
+    Ведро токенов с пополнением rate/сек, общее для всех потоков.
+    Запрос на n токенов больше ёмкости не ждёт вечно: достаточно полного
+    ведра, остаток уходит в долг и гасится пополнением.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.share = 1.0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate * self.share)
+        if self.share < 1.0:
+            # после 429 темп восстанавливается со временем, а не по успешным запросам:
+            # пока он снижен, запросов может не быть вовсе
+            self.share = min(1.0, self.share + elapsed * (1.0 - MIN_SHARE) / RECOVERY_SECONDS)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def take(self, n: float, timeout: float) -> bool:
+        """Списывает n токенов, ожидая пополнения не дольше timeout секунд."""
+        end = time.monotonic() + max(0.0, timeout)
+        need = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= need:
+                    self._tokens -= n
+                    return True
+                wait = (need - self._tokens) / (self.rate * self.share)
+            if now + wait > end:
+                return False
+            time.sleep(wait)
+
+    def spend(self, n: float) -> None:
+        """Списывает n токенов без ожидания (повторы уже отправленных запросов)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= n
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.share = max(MIN_SHARE, self.share / 2)
+
+    @property
+    def current_share(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.share
+
+
+bucket = TokenBucket(QUOTA_PER_MINUTE / 60, QUOTA_BURST)
+
+_lock = threading.Lock()
+# (минута, Counter по методам) за последний час; старые минуты выпадают сами
+_history: deque[tuple[int, Counter]] = deque(maxlen=HISTORY_MINUTES)
+_events: Counter = Counter()  # throttled, exhausted, rate_limited, served_from_cache
+
+
+def _record(methods: Iterable[str]) -> None:
+    minute = int(time.time() // 60)
+    with _lock:
+        if not _history or _history[-1][0] != minute:
+            _history.append((minute, Counter()))
+        _history[-1][1].update(methods)
+
+
+def _note(event: str) -> None:
+    with _lock:
+        _events[event] += 1
+    metrics.GOOGLE_QUOTA_EVENTS.inc(event=event)
+
+
+def acquire(methods: list[str]) -> None:
+    """Токены на запросы methods (по одному на метод) — или QuotaExhausted."""
+    n = len(methods)
+    if not n:
+        return
+    if not bucket.take(n, 0):
+        _note("throttled")
+        timeout = min(MAX_WAIT, gcal_policy.remaining())
+        if not bucket.take(n, timeout):
+            _note("exhausted")
+            raise QuotaExhausted(f"Исчерпан лимит запросов к Google ({QUOTA_PER_MINUTE:g}/мин)")
+    _record(methods)
+
+
+def retried(methods: list[str]) -> None:
+    """Повтор уже допущенных запросов: Google считает его в квоту, ждать поздно."""
+    bucket.spend(len(methods))
+    _record(methods)
+
+
+def rate_limited() -> None:
+    """Google ответил 429 или 403 rateLimitExceeded — снижаем темп."""
+    _note("rate_limited")
+    bucket.slow_down()
+
+
+def served_from_cache() -> None:
+    _note("served_from_cache")
+
+
+def events() -> dict[str, int]:
+    """Счётчики событий квоты: throttled, exhausted, rate_limited, served_from_cache."""
+    with _lock:
+        return dict(_events)
+
+
+def usage(minutes: int = 1) -> Counter:
+    """Запросы по методам за последние minutes минут (включая текущую)."""
+    since = int(time.time() // 60) - minutes + 1
+    total: Counter = Counter()
+    with _lock:
+        for minute, counts in _history:
+            if minute >= since:
+                total.update(counts)
+    return total
+
+
+def report() -> str:
+    """Сводка для /quota."""
+    last_minute = usage(1)
+    last_hour = usage(HISTORY_MINUTES)
+    counts = events()
+    lines = [
+        f"Лимит: {QUOTA_PER_MINUTE:g}/мин, всплеск {QUOTA_BURST:g}",
+        f"Текущий темп: {bucket.current_share * 100:.0f}% лимита, токенов: {bucket.tokens:.1f}",
+        f"За минуту: {sum(last_minute.values())}, за час: {sum(last_hour.values())}",
+    ]
+    for method, count in last_hour.most_common():
+        lines.append(f"• {method}: {last_minute.get(method, 0)}/мин, {count}/час")
+    lines.append(
+        f"Ожидали токен: {counts.get('throttled', 0)}, не дождались: {counts.get('exhausted', 0)}, "
+        f"429 от Google: {counts.get('rate_limited', 0)}, "
+        f"кэш вместо запроса: {counts.get('served_from_cache', 0)}"
+    )
+    return "\n".join(lines)
+
+
+metrics.Gauge(
+    "organizer_google_quota",
+    "Квота Google: tokens — остаток в ведре, share — доля лимита после 429",
+    lambda: {(("stat", "tokens"),): bucket.tokens, (("stat", "share"),): bucket.current_share},
+)
@@ -0,0 +1,111 @@
+"""
+Разбор времени из ответов Google: один раз и в компактную запись.
+
+Строки start.dateTime / start.date / due разбираются с мемоизацией
+(одни и те же события приходят в окна «сегодня/неделя/месяц» и при каждом
+обновлении) в Stamp: локальный день (ordinal), минута дня и флаг
+«целый день». Сортировка и раскладка по окнам идут по целым числам,
+ZoneInfo создаётся один раз на имя зоны.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+UTC = timezone.utc
+MINUTES_PER_DAY = 1440
+# ключ для нераспознанных значений — после всего остального
+KEY_MAX = date.max.toordinal() * MINUTES_PER_DAY
+
+
+@lru_cache(maxsize=None)
+def zone(tz_name: str) -> ZoneInfo:
+    return ZoneInfo(tz_name)
+
+
+class Stamp(NamedTuple):
+    ordinal: int   # локальная дата, date.toordinal()
+    minute: int    # минута дня 0..1439 (0 для целого дня)
+    all_day: bool
+
+    @property
+    def date(self) -> date:
+        return date.fromordinal(self.ordinal)
+
+    @property
+    def hhmm(self) -> str:
+        """«HH:MM» или пустая строка для целого дня."""
+        return "" if self.all_day else f"{self.minute // 60:02d}:{self.minute % 60:02d}"
+
+    @property
+    def key(self) -> int:
+        """Целочисленный ключ сортировки: целый день — в 00:00 своего дня."""
+        return self.ordinal * MINUTES_PER_DAY + self.minute
+
+    @property
+    def day_end_key(self) -> int:
+        """Ключ, где целый день идёт после всего со временем (порядок дайджеста)."""
+        return self.ordinal * (MINUTES_PER_DAY + 1) + (MINUTES_PER_DAY if self.all_day else self.minute)
+
+
+def _from_datetime(dt: datetime, tz: ZoneInfo, all_day: bool) -> Stamp:
+    local = dt.astimezone(tz)
+    return Stamp(local.toordinal(), 0 if all_day else local.hour * 60 + local.minute, all_day)
+
+
+@lru_cache(maxsize=16384)
+def event_time(raw: str, tz_name: str) -> Stamp | None:
+    """start/end события: dateTime (RFC3339) или date (целый день). None — не разобрали."""
+    try:
+        if "T" in raw:
+            return _from_datetime(datetime.fromisoformat(raw.replace("Z", "+00:00")), zone(tz_name), False)
+        return Stamp(date.fromisoformat(raw).toordinal(), 0, True)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=16384)
+def task_due(raw: str, tz_name: str) -> Stamp | None:
+    """
+    due задачи. Целый день — если времени нет вовсе или оно ровно 00:00:00 UTC
+    (так Google Tasks хранит срок без времени).
+    """
+    try:
+        if "T" not in raw:
+            return Stamp(date.fromisoformat(raw).toordinal(), 0, True)
+        dt = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        utc = dt.astimezone(UTC)
+        all_day = utc.hour == 0 and utc.minute == 0 and utc.second == 0
+        return _from_datetime(dt, zone(tz_name), all_day)
+    except ValueError:
+        return None
+
+
+def local_midnight(tz_name: str, offset_days: int = 0) -> datetime:
+    """Начало дня «сегодня + offset_days» в зоне tz_name."""
+    tz = zone(tz_name)
+    now = datetime.now(tz)
+    return datetime(now.year, now.month, now.day, tzinfo=tz) + timedelta(days=offset_days)
+
+
+def utc_iso(dt: datetime) -> str:
+    return dt.astimezone(UTC).isoformat()
+
+
+class DigestItem(NamedTuple):
+    """Строка дайджеста (событие, задача, напоминание) с готовым ключом сортировки."""
+    key: int       # Stamp.day_end_key: по дню, внутри дня целодневные после всего со временем
+    date: date
+    title: str
+    time: str      # «HH:MM» или ""
+
+
+def digest_item(stamp: Stamp, title: str) -> DigestItem:
+    return DigestItem(stamp.day_end_key, stamp.date, title, stamp.hhmm)
+
+
+def dated_item(d: date, title: str) -> DigestItem:
+    """Элемент на целый день d (напоминания с датой)."""
+    return DigestItem(d.toordinal() * (MINUTES_PER_DAY + 1) + MINUTES_PER_DAY, d, title, "")
@@ -0,0 +1,109 @@
+"""
+Общий пул HTTP-соединений к Google.
+
+httplib2.Http не потокобезопасен, но держит keep-alive соединение к каждому
+хосту. Поэтому держим небольшой пул таких объектов: запрос берёт свободный,
+выполняется и возвращает его обратно — следующий запрос идёт по уже открытому
+TCP/TLS-соединению. Размер пула = предел одновременных соединений на хост.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import metrics
+
+HTTP_TIMEOUT = float(os.getenv("GCAL_HTTP_TIMEOUT", "15"))
+POOL_SIZE = max(1, int(os.getenv("GCAL_HTTP_POOL_SIZE", "4")))
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_SIZE)
+_idle: list = []
+_created: list = []
+_stats = {"checkouts": 0, "reused": 0, "created": 0, "in_use": 0}
+
+
+def _has_open_connection(http) -> bool:
+    return any(getattr(conn, "sock", None) is not None for conn in http.connections.values())
+
+
+def _apply_timeout(http, timeout: float) -> None:
+    http.timeout = timeout
+    for conn in http.connections.values():
+        conn.timeout = timeout
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            sock.settimeout(timeout)
+
+
+@contextmanager
+def connection(timeout: float | None = None) -> Iterator:
+    """
+    Берёт httplib2.Http из пула (ждёт, если все заняты) и возвращает его после работы.
+    timeout сужает GCAL_HTTP_TIMEOUT для этого вызова (например, под остаток дедлайна).
+    """
+    import httplib2
+
+    _slots.acquire()
+    try:
+        with _lock:
+            http = _idle.pop() if _idle else None
+            _stats["checkouts"] += 1
+            _stats["in_use"] += 1
+            if http is None:
+                _stats["created"] += 1
+            elif _has_open_connection(http):
+                _stats["reused"] += 1
+        if http is None:
+            http = httplib2.Http(timeout=HTTP_TIMEOUT)
+            with _lock:
+                _created.append(http)
+        _apply_timeout(http, HTTP_TIMEOUT if timeout is None else min(HTTP_TIMEOUT, timeout))
+        try:
+            yield http
+        finally:
+            with _lock:
+                _stats["in_use"] -= 1
+                _idle.append(http)
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def authorized(credentials, timeout: float | None = None) -> Iterator:
+    """То же, что connection(), но с авторизацией Google (AuthorizedHttp поверх пула)."""
+    import google_auth_httplib2
+
+    with connection(timeout) as http:
+        yield google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+
+
+def stats() -> dict:
+    """Счётчики пула: checkouts, reused (hit rate), created, in_use, idle, open_connections."""
+    with _lock:
+        out = dict(_stats)
+        out["idle"] = len(_idle)
+        out["open_connections"] = sum(
+            1 for http in _created for conn in list(http.connections.values())
+            if getattr(conn, "sock", None) is not None
+        )
+    out["hit_rate"] = out["reused"] / out["checkouts"] if out["checkouts"] else 0.0
+    return out
+
+
+metrics.Gauge(
+    "organizer_gcal_http_pool",
+    "Пул соединений к Google: checkouts, reused, created, in_use, idle, open_connections, hit_rate",
+    lambda: {(("stat", k),): v for k, v in stats().items()},
+)
+
+
+def close_all() -> None:
+    """Закрывает простаивающие соединения (например, при остановке сервера)."""
+    with _lock:
+        for http in _idle:
+            http.close()
+            _created.remove(http)
+        _idle.clear()
@@ -0,0 +1,94 @@
+"""
+Сторож event loop: замечает, когда цикл застрял на блокирующем вызове.
+
+Внутри цикла крутится корутина-пульс: раз в LOOP_WATCHDOG_INTERVAL секунд
+она засыпает и меряет, насколько позже проснулась (лаг → метрика
+organizer_event_loop_lag_seconds). Отдельный поток следит за последним
+пульсом: если цикл молчит дольше LOOP_STALL_MS, в лог уходит стек потока
+цикла и имя текущей задачи — т.е. ровно тот синхронный вызов
+(build_digest_text, storage._load/_save…), который держит цикл.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+import metrics
+
+INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+STALL_MS = float(os.getenv("LOOP_STALL_MS", "500"))  # 0 — сторож выключен
+
+_last_beat = 0.0
+_heartbeat: asyncio.Task | None = None
+_stop = threading.Event()
+
+
+async def _pulse() -> None:
+    global _last_beat
+    while True:
+        start = time.monotonic()
+        _last_beat = start
+        await asyncio.sleep(INTERVAL)
+        now = time.monotonic()
+        _last_beat = now
+        metrics.EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - start - INTERVAL))
+
+
+def _describe_task(loop: asyncio.AbstractEventLoop) -> str:
+    try:
+        task = asyncio.current_task(loop)
+    except RuntimeError:
+        return "?"
+    if task is None:
+        return "(вне задачи: колбэк цикла)"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+def _watch(loop: asyncio.AbstractEventLoop, loop_thread_id: int) -> None:
+    threshold = STALL_MS / 1000
+    stalled_since: float | None = None
+    while not _stop.wait(min(INTERVAL, threshold / 2)):
+        silent = time.monotonic() - _last_beat
+        if silent < threshold:
+            if stalled_since is not None:
+                print(f"[loop] цикл ожил через {(time.monotonic() - stalled_since) * 1000:.0f} мс")
+                stalled_since = None
+            continue
+        if stalled_since is not None:
+            continue  # об этой остановке уже написали
+        stalled_since = _last_beat
+        metrics.EVENT_LOOP_STALLS.inc()
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (стек недоступен)\n"
+        print(
+            f"[loop] event loop заблокирован {silent * 1000:.0f} мс, задача {_describe_task(loop)}:\n"
+            f"{stack.rstrip()}"
+        )
+
+
+def start() -> None:
+    """Запускает пульс в текущем цикле и поток-сторож. Вызывать из корутины (startup)."""
+    global _heartbeat, _last_beat
+    if STALL_MS <= 0 or _heartbeat is not None:
+        return
+    loop = asyncio.get_running_loop()
+    _last_beat = time.monotonic()
+    _stop.clear()
+    _heartbeat = loop.create_task(_pulse(), name="loop-watchdog")
+    threading.Thread(
+        target=_watch, args=(loop, threading.get_ident()), name="loop-watchdog", daemon=True,
+    ).start()
+    print(f"[loop] сторож включён: порог {STALL_MS:.0f} мс")
+
+
+def stop() -> None:
+    global _heartbeat
+    _stop.set()
+    if _heartbeat is not None:
+        _heartbeat.cancel()
+        _heartbeat = None
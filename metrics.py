@@ -0,0 +1,155 @@
+"""
+Минимальные метрики в формате Prometheus (text exposition 0.0.4).
+
+Без внешних зависимостей: счётчики, гистограммы и гейджи-колбэки,
+потокобезопасные. server.py отдаёт render() на /metrics.
+"""
+from __future__ import annotations
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: list = []
+_lock = threading.Lock()
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, doc: str):
+        self.name, self.doc = name, doc
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = list(self._values.items())
+        for key, value in items:
+            out.append(f"{self.name}{_fmt_labels(key)} {_fmt_value(value)}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.doc = name, doc
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: dict[tuple, list] = {}  # key -> [counts по бакетам, sum, count]
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._series.items()]
+        for key, (counts, total, count) in items:
+            for bound, c in zip(self.buckets, counts):
+                out.append(f"{self.name}_bucket{_fmt_labels(key, (('le', _fmt_value(bound)),))} {c}")
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {count}")
+        return out
+
+
+class Gauge:
+    """Гейдж, значения которого считает колбэк в момент выдачи: () -> {labels-tuple: value}."""
+
+    def __init__(self, name: str, doc: str, collect: Callable[[], dict]):
+        self.name, self.doc, self._collect = name, doc, collect
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self._collect()
+        except Exception:
+            values = {}
+        for key, value in values.items():
+            out.append(f"{self.name}{_fmt_labels(key)} {_fmt_value(float(value))}")
+        return out
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Метрики бота ---
+
+WEBHOOK_SECONDS = Histogram("organizer_webhook_seconds", "Обработка входящего апдейта Telegram")
+DIGEST_SECONDS = Histogram("organizer_digest_build_seconds", "Сборка дайджеста целиком")
+DIGEST_STAGE_SECONDS = Histogram(
+    "organizer_digest_stage_seconds",
+    "Этапы сборки дайджеста: google_events, google_tasks, storage, render",
+)
+DIGEST_PREBUILT = Counter("organizer_digest_prebuilt_total", "Плановые рассылки, отправленные из предсборки")
+BOT_API_SECONDS = Histogram("organizer_bot_api_seconds", "Вызовы Telegram Bot API")
+GOOGLE_REQUESTS = Counter("organizer_google_requests_total", "Запросы к Google API по методам")
+GOOGLE_SECONDS = Histogram("organizer_google_http_seconds", "HTTP-вызовы Google (batch — одним вызовом)")
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "organizer_event_loop_lag_seconds",
+    "Опоздание пульса event loop (см. loop_watchdog)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_STALLS = Counter("organizer_event_loop_stalls_total", "Блокировки event loop дольше LOOP_STALL_MS")
+GCAL_PUSH_NOTIFICATIONS = Counter(
+    "organizer_gcal_push_notifications_total",
+    "Push-уведомления Calendar по X-Goog-Resource-State: sync, exists, not_exists",
+)
+GCAL_CACHE_LOOKUPS = Counter(
+    "organizer_gcal_cache_lookups_total",
+    "Кэш ответов Google: fresh, revalidated (304), miss, stale, synced (syncToken), quota (сверх своей квоты)",
+)
+GOOGLE_QUOTA_EVENTS = Counter(
+    "organizer_google_quota_events_total",
+    "Квота Google: throttled, exhausted, rate_limited (429), served_from_cache",
+)
@@ -0,0 +1,110 @@
+"""
+Сэмплирующий профайлер для продакшена, включается на время по команде админа.
+
+Фоновый поток раз в PROFILE_INTERVAL_MS снимает стеки всех потоков
+(sys._current_frames) и считает одинаковые стеки. Результат — collapsed stacks
+(«поток;модуль.функция;… N» построчно): это вход flamegraph.pl, speedscope и
+inferno. Время — настенное, поэтому видно и ожидание Google/Telegram, и CPU.
+Пока профайлер выключен, он ничего не стоит.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+MAX_DEPTH = 128
+
+_lock = threading.Lock()
+_active: "Session | None" = None
+
+
+class Session:
+    """Один прогон профайлера: до seconds секунд или до updates апдейтов — что раньше."""
+
+    def __init__(self, seconds: float, updates: int | None):
+        self.seconds = seconds
+        self.updates = updates
+        self.updates_seen = 0
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self.done: Future = Future()  # результат — текст collapsed stacks
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+
+    def _loop(self) -> None:
+        own = threading.get_ident()
+        end = self.started_at + self.seconds
+        while not self._stop.is_set() and time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self._stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+            self.samples += 1
+            self._stop.wait(INTERVAL)
+        self._finish()
+
+    def _finish(self) -> None:
+        global _active
+        with _lock:
+            if _active is self:
+                _active = None
+        lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+        elapsed = time.monotonic() - self.started_at
+        print(f"[profile] done: {self.samples} samples in {elapsed:.1f}s, {self.updates_seen} updates")
+        self.done.set_result("\n".join(lines) + "\n")
+
+    def note_update(self) -> None:
+        self.updates_seen += 1
+        if self.updates is not None and self.updates_seen >= self.updates:
+            self._stop.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _collapse(thread_name: str, frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        parts.append(f"{module}.{code.co_name}")
+        frame = frame.f_back
+    parts.append(thread_name.replace(";", ":"))
+    parts.reverse()
+    return ";".join(p.replace(" ", "_") for p in parts)
+
+
+def start(seconds: float | None = None, updates: int | None = None) -> Session:
+    """
+    Запускает профайлер. Без seconds — MAX_SECONDS (он же верхний предел),
+    с updates — остановится после стольких входящих апдейтов.
+    RuntimeError, если профайлер уже запущен.
+    """
+    global _active
+    seconds = min(seconds or MAX_SECONDS, MAX_SECONDS)
+    with _lock:
+        if _active is not None:
+            raise RuntimeError("Профайлер уже запущен")
+        session = _active = Session(seconds, updates)
+    print(f"[profile] start: {seconds:.0f}s" + (f" / {updates} updates" if updates else ""))
+    session._thread.start()
+    return session
+
+
+def active() -> Session | None:
+    return _active
+
+
+def note_update() -> None:
+    """Вызывается на каждый входящий апдейт Telegram (для режима «N апдейтов»)."""
+    session = _active
+    if session is not None:
+        session.note_update()
@@ -1,11 +1,27 @@
 import os
+
+# Режим профилирования старта: включаем ДО тяжёлых импортов
+if os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true"):
+    import startup_profile
+    startup_profile.enable()
+else:
+    startup_profile = None
+
+import asyncio
+import secrets
 from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from telegram import Update
-from datetime import time as _t
-import storage
 
-from app import build_telegram_application, build_digest_text, send_guest_morning_digest
+from app import build_telegram_application, restore_schedules
+from calendar_source import warm_up as warm_up_google
+import gcal_transport
+import metrics
+import tracing
+import sampling_profiler
+import loop_watchdog
+import gcal_push
 
 load_dotenv()
 
@@ -14,61 +30,48 @@ WEBHOOK_BASE = os.getenv("WEBHOOK_BASE", "").rstrip("/")     # например:
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")         # путь внутри BASE, по умолчанию /webhook
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")             # любая длинная строка
 EXPOSE_SET_WEBHOOK = os.getenv("EXPOSE_SET_WEBHOOK", "true").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")                # если задан — /metrics только с ним
 
 WEBHOOK_URL = f"{WEBHOOK_BASE}{WEBHOOK_PATH}" if WEBHOOK_BASE else ""
 
 fastapi_app = FastAPI(title="Personal Organizer Bot")
 
 tg_app = build_telegram_application()
+if startup_profile:
+    startup_profile.mark("server imported, telegram app built")
 
 @fastapi_app.on_event("startup")
 async def _on_startup():
+    loop_watchdog.start()
     await tg_app.initialize()
     await tg_app.start()
+    # Google-клиенты грузим в фоне: /healthz и вебхуки доступны сразу
+    asyncio.get_running_loop().run_in_executor(None, warm_up_google)
+    # ежедневные рассылки из общего хранилища расписаний (+ досылка пропущенной)
+    await restore_schedules(tg_app.job_queue)
+
+    if gcal_push.ENABLED:
+        tg_app.job_queue.run_repeating(
+            _renew_push_channels, interval=gcal_push.RENEW_INTERVAL, first=10, name="gcal_push_renew",
+        )
+
+    if startup_profile:
+        startup_profile.report_ready()
+
+
+async def _renew_push_channels(context):
     try:
-        chat_id = storage.get_chat_id()
-        if chat_id:
-            base_t = storage.get_daily_time()
-            t_with_tz = _t(
-                base_t.hour,
-                base_t.minute,
-                tzinfo=tg_app.bot.defaults.tzinfo if tg_app.bot.defaults else None
-            )
-            tg_app.job_queue.run_daily(
-                callback=lambda ctx: ctx.bot.send_message(
-                    chat_id=chat_id, text=build_digest_text()
-                ),
-                time=t_with_tz,
-                name=f"morning_digest_{chat_id}",
-                data={"chat_id": chat_id},
-            )
-    except Exception:
-        pass
-
-    # гостевой планировщик по тому же времени (если задан гость)
-    try:
-        guest_id = int(os.getenv("GUEST_USER_ID", "0") or "0")
-        if guest_id:
-            base_t = storage.get_daily_time()
-            t_with_tz = _t(
-                base_t.hour,
-                base_t.minute,
-                tzinfo=tg_app.bot.defaults.tzinfo if tg_app.bot.defaults else None
-            )
-            tg_app.job_queue.run_daily(
-                callback=send_guest_morning_digest,
-                time=t_with_tz,
-                name=f"guest_digest_{guest_id}",
-                data={"chat_id": guest_id},
-            )
-    except Exception:
-        pass
+        await asyncio.get_running_loop().run_in_executor(None, gcal_push.ensure_channels)
+    except Exception as e:
+        print(f"[push] продление каналов не удалось: {e}")
 
 
 @fastapi_app.on_event("shutdown")
 async def _on_shutdown():
+    loop_watchdog.stop()
     await tg_app.stop()
     await tg_app.shutdown()
+    gcal_transport.close_all()
 
 @fastapi_app.get("/healthz")
 async def healthz():
@@ -79,6 +82,34 @@ async def healthz_head():
     # Просто вернуть 200 без тела
     return {}
 
+def _check_token(token: str, authorization: str | None) -> None:
+    if METRICS_TOKEN:
+        given = token or (authorization or "").removeprefix("Bearer ").strip()
+        # байты, а не str: compare_digest падает на не-ASCII строках
+        if not secrets.compare_digest(given.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=403, detail="bad token")
+
+@fastapi_app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(token: str = "", authorization: str | None = Header(None)):
+    _check_token(token, authorization)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@fastapi_app.get("/debug/profile", response_class=PlainTextResponse)
+async def profile_endpoint(
+    seconds: float = 30, updates: int | None = None,
+    token: str = "", authorization: str | None = Header(None),
+):
+    # без токена профайлер наружу не отдаём, даже если /metrics открыт
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="METRICS_TOKEN not set")
+    _check_token(token, authorization)
+    try:
+        session = sampling_profiler.start(seconds, updates)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    collapsed = await asyncio.wrap_future(session.done)
+    return PlainTextResponse(collapsed)
+
 @fastapi_app.get("/set_webhook")
 async def set_webhook():
     if not EXPOSE_SET_WEBHOOK:
@@ -92,6 +123,26 @@ async def set_webhook():
     )
     return {"ok": True, "url": WEBHOOK_URL}
 
+@fastapi_app.post(gcal_push.NOTIFY_PATH)
+async def gcal_notify(
+    x_goog_channel_id: str = Header(""),
+    x_goog_channel_token: str | None = Header(None),
+    x_goog_resource_state: str = Header(""),
+):
+    if not gcal_push.ENABLED:
+        raise HTTPException(status_code=404)
+    # реестр каналов и сброс кэша — SQLite, не держим ими event loop
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(
+        None, gcal_push.check_token, x_goog_channel_id, x_goog_channel_token, x_goog_resource_state,
+    ):
+        raise HTTPException(status_code=403, detail="bad channel token")
+    await loop.run_in_executor(
+        None, gcal_push.handle_notification, x_goog_channel_id, x_goog_resource_state,
+    )
+    # Google ждёт 2xx, иначе будет повторять
+    return PlainTextResponse("")
+
 @fastapi_app.post(WEBHOOK_PATH)
 async def telegram_webhook(
     request: Request,
@@ -100,7 +151,12 @@ async def telegram_webhook(
     # Проверяем секрет от Telegram
     if WEBHOOK_SECRET and x_telegram_bot_api_secret_token != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="bad secret")
-    data = await request.json()
-    update = Update.de_json(data, tg_app.bot)
-    await tg_app.process_update(update)
+    with metrics.WEBHOOK_SECONDS.time(), tracing.span("webhook") as sp:
+        data = await request.json()
+        update = Update.de_json(data, tg_app.bot)
+        sp.set(update_id=update.update_id)
+        await tg_app.process_update(update)
+        # user_data/bot_data — сразу в общее хранилище, чтобы следующий апдейт
+        # этого пользователя на другом воркере увидел изменения
+        await tg_app.update_persistence()
     return {"ok": True}
@@ -0,0 +1,201 @@
+"""
+Общее состояние бота для нескольких процессов/инстансов.
+
+Всё, что раньше жило в памяти процесса или в data.json (настройки и
+напоминания из storage, user_data/bot_data Telegram, снимки дайджеста для
+фоновой сверки), хранится в бэкенде с простым интерфейсом StateBackend:
+значения по ключу, атомарная правка read-modify-write и аренды (lease)
+с TTL — через них задачи JobQueue выбирают одного исполнителя на каждое
+срабатывание.
+
+Бэкенды (STATE_BACKEND):
+  • sqlite (по умолчанию) — один файл STATE_PATH, WAL; несколько воркеров
+    uvicorn или процессов на одном хосте;
+  • memory — локальная замена Redis-подобного хранилища в памяти процесса
+    (для разработки и бенчей). Сетевой бэкенд реализует те же методы:
+    get/set/delete → GET/SET/DEL, edit → WATCH/MULTI, acquire → SET NX PX.
+"""
+from __future__ import annotations
+
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_PATH = Path(os.getenv("STATE_PATH", "state.sqlite3"))
+# Сколько ждать блокировку SQLite, если файл правит другой процесс
+BUSY_TIMEOUT_MS = int(os.getenv("STATE_BUSY_TIMEOUT_MS", "5000"))
+
+# Кто мы среди инстансов — владелец аренд
+INSTANCE_ID = os.getenv("INSTANCE_ID", "") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StateBackend:
+    """Интерфейс хранилища. Значения — любые pickle-совместимые объекты."""
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def edit(self, key: str, default: Any = None):
+        """
+        Контекстный менеджер: отдаёт значение (или default) для правки на месте
+        и сохраняет его на выходе; другие писатели этого ключа ждут.
+        """
+        raise NotImplementedError
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт аренду name на ttl секунд, если она свободна, истекла или уже наша."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(StateBackend):
+    def __init__(self, path: Path):
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                str(self._path), check_same_thread=False, isolation_level=None,
+                timeout=BUSY_TIMEOUT_MS / 1000,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " name TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._db().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    @contextmanager
+    def edit(self, key: str, default: Any = None) -> Iterator[Any]:
+        with self._lock:
+            db = self._db()
+            # IMMEDIATE — сразу берём блокировку записи: другие процессы ждут до COMMIT
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+                value = pickle.loads(row[0]) if row else default
+                yield value
+                db.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)",
+                    (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+                )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cur = self._db().execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires"
+                " WHERE leases.expires <= ? OR leases.owner = excluded.owner",
+                (name, owner, now + ttl, now),
+            )
+            return cur.rowcount > 0
+
+
+class MemoryBackend(StateBackend):
+    """Redis-подобное хранилище в памяти процесса: те же операции, без общего доступа."""
+
+    def __init__(self):
+        self._data: dict[str, bytes] = {}
+        self._leases: dict[str, tuple[str, float]] = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            blob = self._data.get(key)
+        # копия через pickle — как при чтении из настоящего хранилища
+        return pickle.loads(blob) if blob is not None else default
+
+    def set(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = blob
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    @contextmanager
+    def edit(self, key: str, default: Any = None) -> Iterator[Any]:
+        with self._lock:
+            value = self.get(key, default)
+            yield value
+            self.set(key, value)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(name)
+            if current and current[1] > now and current[0] != owner:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+
+_backend: StateBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def backend() -> StateBackend:
+    """Бэкенд процесса, создаётся лениво по STATE_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if BACKEND == "memory":
+                    _backend = MemoryBackend()
+                elif BACKEND == "sqlite":
+                    _backend = SQLiteBackend(STATE_PATH)
+                else:
+                    raise RuntimeError(f"STATE_BACKEND={BACKEND!r}: ожидается sqlite или memory")
+    return _backend
+
+
+def claim(name: str, ttl: float) -> bool:
+    """Аренда от имени этого инстанса: True — выполнять должны мы."""
+    return backend().acquire(name, INSTANCE_ID, ttl)
@@ -0,0 +1,94 @@
+"""
+Профилирование холодного старта (STARTUP_PROFILE=1).
+
+enable() ставит в sys.meta_path обёртку, которая засекает время загрузки
+каждого модуля (полное и «собственное» — без вложенных импортов).
+report_ready() печатает топ самых дорогих модулей и время до готовности
+сервера. В обычном режиме модуль не импортируется вовсе.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import importlib.abc
+
+TOP_N = int(os.getenv("STARTUP_PROFILE_TOP", "25"))
+
+_t0 = time.perf_counter()
+_enabled = False
+_in_find: set[str] = set()
+_stack: list[list[float]] = []  # [время детей] для модулей, которые сейчас грузятся
+_timings: dict[str, tuple[float, float]] = {}  # имя -> (полное, собственное), секунды
+_marks: list[tuple[str, float]] = []
+
+
+class _TimedLoader:
+    def __init__(self, name: str, loader):
+        self._name = name
+        self._loader = loader
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        _stack.append([0.0])
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = _stack.pop()[0]
+            if _stack:
+                _stack[-1][0] += total
+            _timings[self._name] = (total, total - children)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        if fullname in _in_find:
+            return None
+        _in_find.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            _in_find.discard(fullname)
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(fullname, spec.loader)
+        return spec
+
+
+def enable() -> None:
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    sys.meta_path.insert(0, _TimingFinder())
+
+
+def mark(label: str) -> None:
+    """Отметка на шкале старта (секунды от enable/импорта модуля)."""
+    _marks.append((label, time.perf_counter() - _t0))
+
+
+def report_ready() -> None:
+    if not _enabled:
+        return
+    ready = time.perf_counter() - _t0
+    print(f"[startup] ready in {ready * 1000:.0f} ms, modules imported: {len(_timings)}")
+    for label, at in _marks:
+        print(f"[startup]   {label}: {at * 1000:.0f} ms")
+    top = sorted(_timings.items(), key=lambda kv: kv[1][1], reverse=True)[:TOP_N]
+    print("[startup] self ms | cumulative ms | module")
+    for name, (total, own) in top:
+        print(f"[startup] {own * 1000:7.1f} | {total * 1000:13.1f} | {name}")
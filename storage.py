@@ -1,10 +1,17 @@
 import json
 import re
+import copy
+import tracing
+import shared_state
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import time, timedelta, datetime
 from typing import Optional, Iterable
 
+# Данные живут в общем хранилище (shared_state) под одним ключом;
+# data.json — старый формат, импортируется один раз при первом запуске.
 DATA_PATH = Path("data.json")
+DATA_KEY = "storage:data"
 
 DEFAULT_DATA = {
     "chat_id": None,
@@ -16,9 +23,10 @@ DEFAULT_DATA = {
 }
 
 # УТИЛИТЫ
-def _ensure_file():
-    if not DATA_PATH.exists():
-        DATA_PATH.write_text(json.dumps(DEFAULT_DATA, ensure_ascii=False, indent=2), encoding="utf-8")
+def _initial_data() -> dict:
+    if DATA_PATH.exists():
+        return json.loads(DATA_PATH.read_text(encoding="utf-8"))
+    return copy.deepcopy(DEFAULT_DATA)
 
 def _norm_text(s: str) -> str:
     """
@@ -28,21 +36,29 @@ def _norm_text(s: str) -> str:
     """
     return (s or "").strip().lower()
 
+@tracing.traced("storage._load")
 def _load() -> dict:
-    _ensure_file()
-    return json.loads(DATA_PATH.read_text(encoding="utf-8"))
-
-def _save(data: dict) -> None:
-    DATA_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    data = shared_state.backend().get(DATA_KEY)
+    if data is None:
+        with _edit() as data:
+            pass  # первая запись: импорт data.json или значения по умолчанию
+    return data
+
+@contextmanager
+def _edit():
+    """Атомарная правка данных: другие процессы/воркеры ждут, пока мы не сохраним."""
+    with tracing.span("storage._save"), shared_state.backend().edit(DATA_KEY, {}) as data:
+        if not data:
+            data.update(_initial_data())
+        yield data
 
 # --- chat_id ---
 def get_chat_id() -> int | None:
     return _load().get("chat_id")
 
 def set_chat_id(cid: int) -> None:
-    data = _load()
-    data["chat_id"] = cid
-    _save(data)
+    with _edit() as data:
+        data["chat_id"] = cid
 
 # --- daily_time ---
 def get_daily_time() -> time:
@@ -58,15 +74,16 @@ def set_daily_time(raw: str) -> None:
     hh, mm = map(int, parts)
     if not (0 <= hh < 24 and 0 <= mm < 60):
         raise ValueError("Часы/минуты вне диапазона")
-    data = _load()
-    data["daily_time"] = f"{hh:02d}:{mm:02d}"
-    _save(data)
+    with _edit() as data:
+        data["daily_time"] = f"{hh:02d}:{mm:02d}"
 
 # --- custom_reminders ---
 def list_custom_reminders() -> list[dict]:
     """Возвращает список пользовательских напоминаний (нормализованный формат)."""
-    data = _load()
-    arr = data.get("custom_reminders", [])
+    return _normalize_reminders(_load().get("custom_reminders", []))
+
+
+def _normalize_reminders(arr: list) -> list[dict]:
     out: list[dict] = []
 
     for item in arr:
@@ -159,7 +176,11 @@ def add_custom_reminder(text: str, due: str | None = None, user_id: int | None =
         except ValueError:
             raise ValueError("Дата должна быть в формате YYYY-MM-DD")
 
-    data = _load()
+    with _edit() as data:
+        _add_reminder(data, text, due, user_id, share)
+
+
+def _add_reminder(data: dict, text: str, due: str | None, user_id: int | None, share: bool | None) -> None:
     arr = data.get("custom_reminders", [])
 
     # Нормализуем уже хранящиеся записи (строки → dict)
@@ -202,53 +223,48 @@ def add_custom_reminder(text: str, due: str | None = None, user_id: int | None =
     arr.append(new_item)
 
     data["custom_reminders"] = arr
-    _save(data)
 
 
 def clear_custom_reminders() -> None:
     """Полностью очищает список напоминаний."""
-    data = _load()
-    data["custom_reminders"] = []
-    _save(data)
+    with _edit() as data:
+        data["custom_reminders"] = []
 
 def delete_user_reminder(user_id: int, index_in_user_list: int) -> bool:
-    all_items = list_custom_reminders()
-    user_items = [i for i in all_items if i.get("user_id") == user_id]
-
-    # Находим элемент и удаляем из общего списка
-    if not (0 <= index_in_user_list < len(user_items)): 
-        return False
-    target = user_items[index_in_user_list]
-    all_items.remove(target)
-    data = _load()
-    data["custom_reminders"] = all_items
-    _save(data)
+    with _edit() as data:
+        all_items = _normalize_reminders(data.get("custom_reminders", []))
+        user_items = [i for i in all_items if i.get("user_id") == user_id]
+
+        # Находим элемент и удаляем из общего списка
+        if not (0 <= index_in_user_list < len(user_items)):
+            return False
+        target = user_items[index_in_user_list]
+        all_items.remove(target)
+        data["custom_reminders"] = all_items
     return True
 
 def update_user_reminder(user_id: int, index_in_user_list: int, *, new_text: str, new_due_iso: str | None, new_share: bool | None = None) -> bool:
-    all_items = list_custom_reminders()
-    user_items = [i for i in all_items if i.get("user_id") == user_id]
-    if not (0 <= index_in_user_list < len(user_items)): 
-        return False
-    item = user_items[index_in_user_list] 
-    item["text"] = new_text.strip()
-    if new_due_iso:
-        item["due"] = new_due_iso
-    # управляем флагом расшаривания
-    if new_share is True:
-        item["share"] = True
-    elif new_share is False:
-        item.pop("share", None)
-    data = _load()
-    data["custom_reminders"] = all_items
-    _save(data)
+    with _edit() as data:
+        all_items = _normalize_reminders(data.get("custom_reminders", []))
+        user_items = [i for i in all_items if i.get("user_id") == user_id]
+        if not (0 <= index_in_user_list < len(user_items)):
+            return False
+        item = user_items[index_in_user_list]
+        item["text"] = new_text.strip()
+        if new_due_iso:
+            item["due"] = new_due_iso
+        # управляем флагом расшаривания
+        if new_share is True:
+            item["share"] = True
+        elif new_share is False:
+            item.pop("share", None)
+        data["custom_reminders"] = all_items
     return True
 
 def set_last_digest(text: str) -> None:
-    data = _load()
-    data["last_digest_text"] = text or ""
-    data["last_digest_at"] = datetime.utcnow().isoformat() + "Z"
-    _save(data)
+    with _edit() as data:
+        data["last_digest_text"] = text or ""
+        data["last_digest_at"] = datetime.utcnow().isoformat() + "Z"
 
 def get_last_digest() -> tuple[str, str | None]:
     d = _load()
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+# модули бота лежат в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeClock:
+    """Подмена модуля time: monotonic() стоит на месте, sleep() двигает часы."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
@@ -0,0 +1,67 @@
+import pytest
+
+import app
+
+
+def _snapshot(events=None, tasks=None) -> dict:
+    return {"events": events or {}, "tasks": tasks or {}}
+
+
+def test_diff_reports_added_removed_and_moved():
+    old = _snapshot(
+        events={"Стендап": [("2026-10-19", "10:00")], "Обед": [("2026-10-19", "13:00")]},
+        tasks={"Отчёт": [("2026-10-20", "")]},
+    )
+    new = _snapshot(
+        events={"Стендап": [("2026-10-19", "11:30")], "Кино": [("2026-10-21", "19:00")]},
+        tasks={"Отчёт": [("2026-10-20", "")]},
+    )
+    assert app._diff_snapshots(old, new) == [
+        "➕ 21.10 19:00 Кино",
+        "➖ 19.10 13:00 Обед",
+        "🔁 Стендап: 19.10 10:00 → 19.10 11:30",
+    ]
+
+
+def test_diff_labels_tasks_and_ignores_unchanged():
+    old = _snapshot(tasks={"Налоги": [("2026-10-20", "")]})
+    new = _snapshot(tasks={"Налоги": [("2026-10-20", "")], "Визит": [("2026-10-22", "")]})
+    assert app._diff_snapshots(old, new) == ["➕ 22.10 [Задача] Визит"]
+    assert app._diff_snapshots(new, new) == []
+
+
+@pytest.fixture
+def prebuild(monkeypatch):
+    monkeypatch.setattr(app, "DIGEST_PREBUILD_MINUTES", 10)
+    monkeypatch.setattr(app, "DIGEST_PREBUILD_JITTER", 1)
+
+
+def _since_midnight(at: str) -> int:
+    hh, mm = map(int, at.split(":"))
+    return hh * 3600 + mm * 60
+
+
+def test_prebuild_leads_split_window_between_digests_of_one_time(prebuild, monkeypatch):
+    monkeypatch.setattr(app, "DIGEST_PREBUILD_JITTER", 0)
+    schedules = {"b": {"time": "08:00"}, "a": {"time": "08:00"}, "c": {"time": "09:00"}}
+    # окно 600 с, две рассылки в 08:00 делят 80% окна по рангу
+    assert app._prebuild_leads(schedules) == {"a": 600, "b": 360, "c": 600}
+
+
+@pytest.mark.parametrize("at", ["08:00", "00:07", "00:01"])
+def test_prebuild_leads_with_jitter_stay_in_slot_and_on_send_day(prebuild, at):
+    schedules = {name: {"time": at} for name in ("a", "b", "c")}
+    window = min(600, _since_midnight(at))
+    slot = window * 0.8 / 3
+    for _ in range(200):
+        leads = app._prebuild_leads(schedules)
+        for rank, name in enumerate(sorted(schedules)):
+            top = window - rank * slot
+            assert top - slot <= leads[name] <= top
+            assert 0 < leads[name] <= _since_midnight(at)  # не раньше полуночи дня рассылки
+
+
+def test_no_prebuild_at_midnight_or_when_disabled(prebuild, monkeypatch):
+    assert app._prebuild_leads({"a": {"time": "00:00"}}) == {}
+    monkeypatch.setattr(app, "DIGEST_PREBUILD_MINUTES", 0)
+    assert app._prebuild_leads({"a": {"time": "08:00"}}) == {}
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import gcal_policy
+from conftest import FakeClock
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gcal_policy, "time", fake)
+    return fake
+
+
+class Resp(dict):
+    """Ответ httplib2: заголовки + .status."""
+
+    def __init__(self, status: int):
+        super().__init__()
+        self.status = status
+
+
+class HttpError(Exception):
+    """Как googleapiclient.errors.HttpError: ответ в .resp, тело в .content."""
+
+    def __init__(self, status: int, reason: str = ""):
+        self.resp = Resp(status)
+        errors = [{"domain": "usageLimits", "reason": reason}] if reason else []
+        self.content = json.dumps({"error": {"code": status, "errors": errors}}).encode()
+
+
+def test_breaker_opens_after_threshold_failures(clock):
+    breaker = gcal_policy.CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failure_count(clock):
+    breaker = gcal_policy.CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_allows_one_probe_and_closes_on_success(clock):
+    breaker = gcal_policy.CircuitBreaker(threshold=1, cooldown=60)
+    breaker.record_failure()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # пробная попытка уже идёт
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = gcal_policy.CircuitBreaker(threshold=5, cooldown=60)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 30
+    assert not breaker.allow()
+
+
+def test_call_retries_transient_errors_then_opens_breaker(clock, monkeypatch):
+    monkeypatch.setattr(gcal_policy, "breaker", gcal_policy.CircuitBreaker(threshold=1, cooldown=60))
+    monkeypatch.setattr(gcal_policy, "MAX_ATTEMPTS", 3)
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        raise HttpError(503)
+
+    with pytest.raises(HttpError):
+        gcal_policy.call(attempt)
+    assert len(calls) == 3
+    with pytest.raises(gcal_policy.GoogleUnavailable):
+        gcal_policy.call(attempt)
+    assert len(calls) == 3  # breaker открыт — в Google не ходим
+
+
+def test_call_does_not_retry_client_errors(clock, monkeypatch):
+    monkeypatch.setattr(gcal_policy, "breaker", gcal_policy.CircuitBreaker(threshold=1, cooldown=60))
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        raise HttpError(404)
+
+    with pytest.raises(HttpError):
+        gcal_policy.call(attempt)
+    assert len(calls) == 1
+    assert gcal_policy.breaker.state == "closed"  # Google ответил — он жив
+
+
+@pytest.mark.parametrize("status, reason, expected", [
+    (429, "", True),
+    (403, "rateLimitExceeded", True),
+    (403, "userRateLimitExceeded", True),
+    (403, "forbidden", False),
+    (503, "", False),
+])
+def test_is_rate_limited(status, reason, expected):
+    exc = HttpError(status, reason)
+    assert gcal_policy.is_rate_limited(exc) is expected
+    if expected:
+        assert gcal_policy.is_transient(exc)
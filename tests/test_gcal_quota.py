@@ -0,0 +1,66 @@
+import pytest
+
+import gcal_quota
+from conftest import FakeClock
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gcal_quota, "time", fake)
+    return fake
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    bucket = gcal_quota.TokenBucket(rate=1, capacity=10)
+    assert bucket.take(10, 0)
+    assert not bucket.take(1, 0)
+    clock.now += 4
+    assert bucket.tokens == pytest.approx(4)
+    clock.now += 100
+    assert bucket.tokens == pytest.approx(10)
+
+
+def test_take_waits_for_refill_within_timeout(clock):
+    bucket = gcal_quota.TokenBucket(rate=2, capacity=10)
+    bucket.spend(10)
+    start = clock.now
+    assert not bucket.take(4, timeout=1)
+    assert clock.now == start  # не дождались бы — и не ждём
+    assert bucket.take(4, timeout=5)
+    assert clock.now - start == pytest.approx(2)
+
+
+def test_take_over_capacity_needs_full_bucket_and_goes_into_debt(clock):
+    bucket = gcal_quota.TokenBucket(rate=1, capacity=5)
+    assert bucket.take(8, 0)
+    assert bucket.tokens == pytest.approx(-3)
+
+
+def test_slow_down_halves_share_down_to_minimum(clock):
+    bucket = gcal_quota.TokenBucket(rate=1, capacity=10)
+    bucket.slow_down()
+    assert bucket.share == pytest.approx(0.5)
+    bucket.slow_down()
+    assert bucket.share == pytest.approx(0.25)
+    for _ in range(20):
+        bucket.slow_down()
+    assert bucket.share == pytest.approx(gcal_quota.MIN_SHARE)
+
+
+def test_share_recovers_over_time_without_requests(clock):
+    bucket = gcal_quota.TokenBucket(rate=1, capacity=10)
+    for _ in range(20):
+        bucket.slow_down()
+    clock.now += gcal_quota.RECOVERY_SECONDS / 2
+    assert bucket.current_share == pytest.approx((1 + gcal_quota.MIN_SHARE) / 2)
+    clock.now += gcal_quota.RECOVERY_SECONDS
+    assert bucket.current_share == 1.0
+
+
+def test_reduced_share_slows_refill(clock):
+    bucket = gcal_quota.TokenBucket(rate=1, capacity=100)
+    bucket.spend(100)
+    bucket.slow_down()
+    clock.now += 2
+    assert bucket.tokens == pytest.approx(1)
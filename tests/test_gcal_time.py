@@ -0,0 +1,44 @@
+from datetime import date
+
+import gcal_time
+
+TZ = "Europe/Belgrade"
+
+
+def test_event_time_converts_to_local_day_and_minute():
+    stamp = gcal_time.event_time("2026-10-19T22:30:00Z", TZ)
+    assert stamp == gcal_time.Stamp(date(2026, 10, 20).toordinal(), 30, False)
+    assert stamp.date == date(2026, 10, 20)
+    assert stamp.hhmm == "00:30"
+
+
+def test_event_time_all_day_and_garbage():
+    stamp = gcal_time.event_time("2026-10-19", TZ)
+    assert stamp.all_day and stamp.date == date(2026, 10, 19) and stamp.hhmm == ""
+    assert gcal_time.event_time("завтра", TZ) is None
+
+
+def test_task_due_midnight_utc_is_all_day():
+    assert gcal_time.task_due("2026-10-19T00:00:00.000Z", TZ).all_day
+    due = gcal_time.task_due("2026-10-19T15:45:00.000Z", TZ)
+    assert not due.all_day and due.hhmm == "17:45"
+
+
+def test_key_orders_by_day_then_minute():
+    early = gcal_time.event_time("2026-10-19T08:00:00+02:00", TZ)
+    late = gcal_time.event_time("2026-10-19T21:00:00+02:00", TZ)
+    next_day = gcal_time.event_time("2026-10-20", TZ)
+    assert early.key < late.key < next_day.key
+    assert gcal_time.event_time("2026-10-19", TZ).key < early.key  # целый день — в 00:00
+
+
+def test_day_end_key_puts_all_day_after_timed_items_of_the_same_day():
+    all_day = gcal_time.event_time("2026-10-19", TZ)
+    late = gcal_time.event_time("2026-10-19T23:59:00+02:00", TZ)
+    next_morning = gcal_time.event_time("2026-10-20T00:00:00+02:00", TZ)
+    assert late.day_end_key < all_day.day_end_key < next_morning.day_end_key
+
+
+def test_dated_item_matches_all_day_digest_item():
+    stamp = gcal_time.event_time("2026-10-19", TZ)
+    assert gcal_time.dated_item(date(2026, 10, 19), "x") == gcal_time.digest_item(stamp, "x")
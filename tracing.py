@@ -0,0 +1,202 @@
+"""
+Лёгкая трассировка: спаны на апдейт Telegram и всё, что он вызывает.
+
+Текущий спан живёт в contextvars, поэтому вложенность сохраняется и в
+корутинах, и в потоках, если запускать их через contextvars.copy_context().
+Готовые спаны уходят в фоновый поток-экспортёр:
+• TRACE_JSONL=traces.jsonl — по строке JSON на спан;
+• TRACE_OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces — OTLP/HTTP JSON
+  (любой совместимый коллектор: otel-collector, Jaeger, Tempo).
+Если не задано ни то, ни другое — span() почти ничего не стоит.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import queue
+import inspect
+import secrets
+import threading
+import functools
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Iterator
+
+JSONL_PATH = os.getenv("TRACE_JSONL", "")
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "personal-organizer-bot")
+FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+MAX_QUEUE = 10000
+
+ENABLED = bool(JSONL_PATH or OTLP_ENDPOINT)
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("trace_span", default=None)
+_queue: "queue.Queue[Span]" = queue.Queue(maxsize=MAX_QUEUE)
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, name: str, parent: "Span | None", attrs: dict):
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attrs = attrs
+        self.error: str | None = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attrs": self.attrs,
+            **({"error": self.error} if self.error else {}),
+        }
+
+
+class _NoopSpan:
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span | _NoopSpan]:
+    """Открывает спан (дочерний к текущему) на время блока."""
+    if not ENABLED:
+        yield _NOOP
+        return
+    s = Span(name, _current.get(), attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+        _export(s)
+
+
+def traced(name: str | None = None):
+    """Декоратор: оборачивает функцию (обычную или async) в спан."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- экспорт ---
+
+def _export(s: Span) -> None:
+    _ensure_worker()
+    try:
+        _queue.put_nowait(s)
+    except queue.Full:
+        pass  # лучше потерять спан, чем тормозить обработку
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="trace-export", daemon=True)
+            _worker.start()
+
+
+def _worker_loop() -> None:
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < 512:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=left))
+            except queue.Empty:
+                break
+        _flush(batch)
+
+
+def _flush(batch: list[Span]) -> None:
+    if JSONL_PATH:
+        try:
+            with open(JSONL_PATH, "a", encoding="utf-8") as f:
+                for s in batch:
+                    f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"[trace] jsonl export failed: {e}")
+    if OTLP_ENDPOINT:
+        try:
+            body = json.dumps(_otlp_payload(batch), default=str).encode("utf-8")
+            req = urllib.request.Request(
+                OTLP_ENDPOINT, data=body, method="POST",
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(req, timeout=5).close()
+        except Exception as e:
+            print(f"[trace] otlp export failed: {e}")
+
+
+def _otlp_value(v) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _otlp_payload(batch: list[Span]) -> dict:
+    spans = []
+    for s in batch:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "organizer"}, "spans": spans}],
+        }]
+    }